@@ -1,3 +1,5 @@
+import logging
+
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
@@ -8,6 +10,8 @@ from ..serializers.admin_profile_serializer import AdminProfileSerializer
 from ..serializers.doctor_profile_serializer import DoctorProfileSerializer
 from ..serializers.patient_profile_serializer import PatientProfileSerializer
 
+logger = logging.getLogger(__name__)
+
 
 class RegisterView(generics.CreateAPIView):
     """ User Registration View (Handles User and Profile) """
@@ -63,15 +67,14 @@ class RegisterView(generics.CreateAPIView):
             elif data.get("user_type") == "Doctor":
                 profile_serializer = DoctorProfileSerializer(data=profile_data)
             elif data.get("user_type") == "Patient":
-                print("Patient profile serializer")
+                logger.debug("Using the patient profile serializer")
                 profile_serializer = PatientProfileSerializer(data=profile_data)
 
             if profile_serializer.is_valid():
-                print("profile_serializer is valid")
                 profile_serializer.save()
-                print(profile_serializer.data)
+                # Profile data and tokens are never logged
+                logger.info("Registered user %s as %s", user.id, data.get("user_type"))
                 refresh = RefreshToken.for_user(user)
-                print(refresh)
                 return Response({
                     "user": user_serializer.data,
                     "profile": profile_serializer.data,
@@ -79,11 +82,10 @@ class RegisterView(generics.CreateAPIView):
                     "access": str(refresh.access_token)
                 }, status=status.HTTP_201_CREATED)
             else:
-                print("profile_serializer is not valid")
-                print(profile_serializer.errors)  # Print the errors
+                # Error messages can echo submitted values, so only field names are logged
+                logger.info("Invalid profile data in fields: %s", sorted(profile_serializer.errors))
                 user.delete()
                 return Response(profile_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         else:
-            print("user_serializer is not valid")
-            print(user_serializer.errors)  # Print the errors
+            logger.info("Invalid user data in fields: %s", sorted(user_serializer.errors))
             return Response(user_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
@@ -18,6 +18,8 @@ import cloudinary
 import cloudinary.uploader
 import cloudinary.api
 
+from core.structured_logging import parse_sample_rates
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -216,6 +218,13 @@ DEFAULT_FILE_STORAGE = "cloudinary_storage.storage.MediaCloudinaryStorage"
 
 
 # Configure logging based on environment
+# Logging: records are queued and written by a background thread, as JSON
+# lines by default (LOG_FORMAT=text for the plain format). LOG_SAMPLE_RATES
+# ("logger=rate,...", e.g. django.request=0.1) keeps only that share of a
+# logger's DEBUG/INFO records; longer string fields than LOG_MAX_FIELD_LENGTH
+# are truncated. See core/structured_logging.py
+LOG_FORMAT = env('LOG_FORMAT', default='json')
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -224,12 +233,23 @@ LOGGING = {
             'format': '{levelname} {asctime} {module} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'core.structured_logging.JsonFormatter',
+            'max_field_length': env.int('LOG_MAX_FIELD_LENGTH', default=2000),
+        },
+    },
+    'filters': {
+        'sampling': {
+            '()': 'core.structured_logging.SamplingFilter',
+            'rates': parse_sample_rates(env('LOG_SAMPLE_RATES', default='')),
+        },
     },
     'handlers': {
         'console': {
             'level': env('DJANGO_LOG_LEVEL', default='INFO'),
-            'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
+            'class': 'core.structured_logging.QueueingStreamHandler',
+            'formatter': 'json' if LOG_FORMAT == 'json' else 'verbose',
+            'filters': ['sampling'],
         },
     },
     'root': {
@@ -0,0 +1,205 @@
+"""
+Non-blocking, structured logging.
+
+Log calls on request paths only put the record on an in-memory queue. A
+listener thread formats each record as one JSON object per line and writes
+it to stdout. When the queue is full, records are dropped and counted rather
+than blocking the caller.
+
+- JsonFormatter: timestamp, level, logger, message, source location, any
+  `extra=` fields and the exception. String values longer than
+  max_field_length are truncated.
+- SamplingFilter: keeps only a share of the DEBUG/INFO records of chosen
+  loggers (e.g. "uvicorn.access=0.1"); warnings and errors are always kept.
+
+Document text and model output can contain patient data, so they are never
+logged at INFO or above; log lengths and counts instead, and previews only at
+DEBUG.
+
+The same module exists in the OCR service (utils/structured_logging.py),
+which sets it up in code; here Django's LOGGING setting configures it.
+"""
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import traceback
+from typing import Any, Dict, Mapping, Optional
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+DEFAULT_MAX_FIELD_LENGTH = 2000
+DEFAULT_QUEUE_SIZE = 10000
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """Parse "logger=rate,..." (e.g. "uvicorn.access=0.1,utils.ocr_processor=0.5")"""
+    rates = {}
+    for entry in value.split(","):
+        name, _, rate = entry.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+def _truncate(value: Any, max_length: int) -> Any:
+    if isinstance(value, str) and len(value) > max_length:
+        return f"{value[:max_length]}... [{len(value) - max_length} more chars]"
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects with truncated string fields"""
+
+    def __init__(self, max_field_length: int = DEFAULT_MAX_FIELD_LENGTH, **kwargs):
+        super().__init__(**kwargs)
+        self.max_field_length = max_field_length
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": _truncate(record.getMessage(), self.max_field_length),
+            "module": record.module,
+            "function": record.funcName,
+            "line": record.lineno,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = _truncate(value, self.max_field_length)
+        if record.exc_info:
+            entry["exception"] = "".join(traceback.format_exception(*record.exc_info))
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a share of the records below WARNING of the configured loggers. A
+    logger's rate also applies to its children unless they have their own.
+    """
+
+    def __init__(self, rates: Optional[Mapping[str, float]] = None, name: str = ""):
+        super().__init__(name)
+        self.rates = dict(rates or {})
+
+    def _rate(self, logger_name: str) -> float:
+        name = logger_name
+        while True:
+            if name in self.rates:
+                return self.rates[name]
+            if "." not in name:
+                return 1.0
+            name = name.rsplit(".", 1)[0]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Wait for room rather than failing to stop when the queue is full
+        self.queue.put(self._sentinel)
+
+
+class QueueingStreamHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on a bounded queue for a listener thread that formats and
+    writes them to a stream (stdout by default). Records that do not fit are
+    dropped and counted in `dropped`.
+
+    The formatter set on this handler is used by the listener, so formatting
+    happens off the calling thread too.
+    """
+
+    def __init__(self, stream=None, queue_size: int = DEFAULT_QUEUE_SIZE):
+        super().__init__(queue.Queue(queue_size))
+        self.target = logging.StreamHandler(stream or sys.stdout)
+        self.dropped = 0
+        self._listener: Optional[_Listener] = None
+        self._start_listener()
+        # Threads do not survive fork, so a forked worker (batch processing)
+        # starts its own listener, on a new queue whose lock no thread holds
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start_listener(self) -> None:
+        self._listener = _Listener(self.queue, self.target, respect_handler_level=False)
+        self._listener.start()
+
+    def _after_fork(self) -> None:
+        if self._listener is not None:
+            self.queue = queue.Queue(self.queue.maxsize)
+            self._start_listener()
+
+    def setFormatter(self, fmt: Optional[logging.Formatter]) -> None:
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message now: its arguments may change once the caller moves
+        # on. The record stays in this process, so exc_info can be kept as is
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self) -> None:
+        """Write everything queued so far"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._start_listener()
+
+    def close(self) -> None:
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        super().close()
+
+
+def setup_logging(
+    level: str = "INFO",
+    json_format: bool = True,
+    sample_rates: Optional[Mapping[str, float]] = None,
+    max_field_length: int = DEFAULT_MAX_FIELD_LENGTH,
+    stream=None,
+) -> QueueingStreamHandler:
+    """
+    Route all logging (including uvicorn's) through one queueing handler on the
+    root logger, replacing existing root handlers
+    """
+    handler = QueueingStreamHandler(stream)
+    if json_format:
+        handler.setFormatter(JsonFormatter(max_field_length))
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+        existing.close()
+    root.addHandler(handler)
+    root.setLevel(level)
+    # uvicorn installs its own stream handlers; send its records to ours instead
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logger = logging.getLogger(name)
+        logger.handlers.clear()
+        logger.propagate = True
+    return handler
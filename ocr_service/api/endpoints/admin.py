@@ -0,0 +1,72 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+import hmac
+from typing import Optional
+
+from api.models.schemas import LearnTemplateRequest
+from utils.document_pipeline import document_pipeline
+from utils.job_memory import job_memory
+from utils.lab_templates import TemplateLearningError
+from utils.ocr_processor import URLHandler
+from core.config import settings
+
+
+def require_admin_key(x_admin_key: Optional[str] = Header(default=None)) -> None:
+    """Allow the request only with the configured X-Admin-Key"""
+    if not settings.ADMIN_API_KEY or not hmac.compare_digest(
+        (x_admin_key or "").encode(), settings.ADMIN_API_KEY.encode()
+    ):
+        raise HTTPException(status_code=403, detail="A valid admin key is required")
+
+
+# Create router; every route requires the admin key
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin_key)])
+
+
+@router.get("/memory/jobs")
+async def worst_memory_jobs():
+    """
+    Jobs with the largest peak RSS growth since the service started, worst first.
+
+    Entries identify documents by hash only; look them up in the artifact store
+    or the logs to find the source.
+    """
+    return {"jobs": job_memory.worst_jobs.snapshot()}
+
+
+def _template_registry():
+    if document_pipeline.templates is None:
+        raise HTTPException(status_code=404, detail="Lab templates are disabled (TEMPLATE_DIR is not set)")
+    return document_pipeline.templates
+
+
+@router.get("/templates")
+async def list_templates():
+    """Lab templates the pipeline matches documents against"""
+    return {"templates": [template.summary() for template in _template_registry().templates()]}
+
+
+@router.post("/templates", status_code=201)
+async def learn_template(request: LearnTemplateRequest):
+    """
+    Learn a lab template from a document and its confirmed extraction.
+
+    Every numeric parameter of the confirmed result must be found in the
+    document's OCR text, otherwise nothing is stored (422).
+    """
+    registry = _template_registry()
+    if not URLHandler.is_cloudinary_url(request.document_url):
+        raise HTTPException(status_code=400, detail="Only Cloudinary URLs are supported")
+    try:
+        template = await document_pipeline.learn_template(
+            request.document_url, request.confirmed.model_dump(exclude_none=True)
+        )
+    except TemplateLearningError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"templates": len(registry), "template": template.summary()}
+
+
+@router.delete("/templates/{template_id}")
+async def delete_template(template_id: str):
+    if not _template_registry().remove(template_id):
+        raise HTTPException(status_code=404, detail=f"No lab template {template_id}")
+    return {"deleted": template_id}
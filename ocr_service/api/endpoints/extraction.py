@@ -1,24 +1,18 @@
-from fastapi import APIRouter, HTTPException, File, UploadFile
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
-import tempfile
-import os
+import asyncio
 import logging
 import requests
-from typing import Dict, Any
-from io import BytesIO
-from PIL import Image
-from pdf2image import convert_from_bytes, convert_from_path
-import pytesseract
-from urllib.parse import urlparse
+
+# OCR processing lives in utils.ocr_processor; re-exported here for existing imports
+from utils.ocr_processor import URLHandler, OCRProcessor, ocr_processor, REQUEST_TIMEOUT, LARGE_FILE_THRESHOLD
+from utils.upload_spool import spool_upload, UploadError, UploadTooLargeError, UPLOAD_OPENAPI
+from core.config import settings
 
 # Create router
 router = APIRouter(tags=["extraction"])
 logger = logging.getLogger(__name__)
 
-# Constants
-REQUEST_TIMEOUT = 360  # 3 minutes for downloading files
-LARGE_FILE_THRESHOLD = 5_000_000  # 5MB threshold for large files
-
 # Models
 class ImageURLRequest(BaseModel):
     image_url: str
@@ -26,152 +20,6 @@ class ImageURLRequest(BaseModel):
 class PDFURLRequest(BaseModel):
     pdf_url: str
 
-# URL Handler class - simplified for Cloudinary only
-class URLHandler:
-    @staticmethod
-    def is_cloudinary_url(url):
-        """Check if a URL is from Cloudinary."""
-        parsed_url = urlparse(url)
-        hostname = parsed_url.netloc
-        return hostname == 'cloudinary.com' or hostname.endswith('.cloudinary.com')
-
-    @staticmethod
-    def get_cloudinary_direct_url(url):
-        """
-        Get direct access URL for Cloudinary images.
-        Add fl_attachment to prevent transformations that might affect OCR quality.
-        """
-        if '?' in url:
-            return f"{url}&fl_attachment=true&fl_sanitize=true"
-        else:
-            return f"{url}?fl_attachment=true&fl_sanitize=true"
-
-# OCR Processor class - simplified for Cloudinary only
-class OCRProcessor:
-    def __init__(self):
-        self.url_handler = URLHandler()
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-    
-    def get_image_from_url(self, url):
-        """Get image from Cloudinary URL."""
-        logger.info("Processing Cloudinary URL")
-        direct_url = URLHandler.get_cloudinary_direct_url(url)
-        response = requests.get(direct_url, headers=self.headers, timeout=REQUEST_TIMEOUT)
-        
-        if response.status_code != 200:
-            raise Exception(f"Failed to fetch image from URL: HTTP {response.status_code}")
-        
-        return Image.open(BytesIO(response.content))
-
-    def extract_text_from_pdf_content(self, pdf_content: bytes) -> str:
-        """Extract text from PDF content using Tesseract OCR."""
-        try:
-            # Check file size to determine processing strategy
-            content_length = len(pdf_content)
-            
-            if content_length > LARGE_FILE_THRESHOLD:
-                logger.info(f"Warning: Large PDF detected ({content_length/1_000_000:.2f}MB). Processing may take longer.")
-                # For large files, process one page at a time to avoid memory issues
-                from pdf2image import pdfinfo_from_bytes
-                
-                pdf_bytes = BytesIO(pdf_content)
-                info = pdfinfo_from_bytes(pdf_bytes.getvalue())
-                max_pages = info["Pages"]
-                
-                extracted_text = ""
-                
-                # Process each page individually to conserve memory
-                for page in range(1, max_pages + 1):
-                    logger.info(f"Processing page {page}/{max_pages}")
-                    images = convert_from_bytes(
-                        pdf_bytes.getvalue(),
-                        first_page=page,
-                        last_page=page
-                    )
-                    
-                    if images:
-                        text = pytesseract.image_to_string(images[0], config=r'--oem 3 --psm 6')
-                        extracted_text += f"{text}\n"
-            else:
-                # For smaller files, process all at once
-                images = convert_from_bytes(pdf_content)
-                extracted_text = ""
-                
-                for img in images:
-                    custom_config = r'--oem 3 --psm 6'
-                    text = pytesseract.image_to_string(img, config=custom_config)
-                    extracted_text += text + "\n"
-                
-            if extracted_text:
-                logger.info(f"Extracted Text from PDF: {extracted_text[:100]}...")  # Log just a preview
-                return extracted_text
-            else:
-                logger.warning("No text extracted from PDF.")
-                return ""
-        
-        except Exception as e:
-            logger.exception(f"Error processing PDF content: {e}")
-            return ""
-
-    def extract_text_from_url(self, url: str) -> str:
-        """Extract text from a Cloudinary URL, handling both images and PDFs."""
-        try:
-            # Handle Cloudinary URL
-            if not URLHandler.is_cloudinary_url(url):
-                logger.warning("URL is not from Cloudinary, but processing anyway")
-            
-            logger.info("Processing Cloudinary URL")
-            processed_url = URLHandler.get_cloudinary_direct_url(url)
-            
-            # Check if the file is large before downloading
-            try:
-                head_response = requests.head(processed_url, headers=self.headers, timeout=10)
-                content_length = int(head_response.headers.get('content-length', 0))
-                
-                if content_length > LARGE_FILE_THRESHOLD:
-                    logger.info(f"Warning: Large file detected ({content_length/1_000_000:.2f}MB). Processing may take longer.")
-                    
-            except Exception as e:
-                logger.warning(f"Could not get content length: {e}")
-            
-            # Download the file from the provided URL
-            response = requests.get(processed_url, headers=self.headers, timeout=REQUEST_TIMEOUT)
-            if response.status_code != 200:
-                raise Exception(f"Failed to fetch file from URL: HTTP {response.status_code}")
-            
-            content_type = response.headers.get('content-type', '').lower()
-            
-            # Determine if this is a PDF or image
-            if 'pdf' in content_type or url.lower().endswith('.pdf'):
-                # Process as PDF
-                return self.extract_text_from_pdf_content(response.content)
-            else:
-                # Process as image
-                try:
-                    image = Image.open(BytesIO(response.content))
-                    custom_config = r'--oem 3 --psm 6'
-                    text = pytesseract.image_to_string(image, config=custom_config)
-                    
-                    if text:
-                        logger.info(f"Extracted Text from image: {text[:100]}...")
-                        return text
-                    else:
-                        logger.warning("No text extracted from image.")
-                        return ""
-                except Exception as e:
-                    logger.exception(f"Error processing image: {e}")
-                    # Try processing as PDF if image processing fails
-                    return self.extract_text_from_pdf_content(response.content)
-            
-        except Exception as e:
-            logger.exception(f"Error processing URL: {e}")
-            return ""
-
-# Create a singleton instance of the OCR processor
-ocr_processor = OCRProcessor()
-
 # API Endpoints
 @router.post("/extract-text/")
 async def extract_text_endpoint(request: ImageURLRequest):
@@ -247,42 +95,43 @@ async def extract_text_from_pdf_endpoint(request: PDFURLRequest):
         )
 
 
-@router.post("/extract-text-from-uploaded-pdf/")
-async def extract_text_from_uploaded_pdf(file: UploadFile = File(...)):
+@router.post("/extract-text-from-uploaded-pdf/", openapi_extra=UPLOAD_OPENAPI)
+async def extract_text_from_uploaded_pdf(request: Request):
     """
     Extract text from an uploaded PDF file using OCR
+    
+    The file is streamed to a temporary file (up to MAX_UPLOAD_BYTES) rather than
+    read into memory, and OCR reads the PDF from disk.
     """
+    try:
+        upload = await spool_upload(
+            request,
+            max_bytes=settings.MAX_UPLOAD_BYTES,
+            spool_dir=settings.UPLOAD_SPOOL_DIR or None,
+        )
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     try:
         # Validate the file
-        if not file.filename.lower().endswith('.pdf'):
+        if not upload.is_pdf:
             raise HTTPException(status_code=400, detail="Only PDF files are supported")
         
-        # Save the file to a temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            # Read and write in chunks to handle large files
-            content = await file.read()
-            temp_file.write(content)
-            temp_path = temp_file.name
+        # Process the PDF file
+        text = await asyncio.to_thread(
+            lambda: "".join(f"{page}\n" for page in ocr_processor.iter_page_texts(upload.path, is_pdf=True))
+        )
         
-        try:
-            # Process the PDF file
-            text = ocr_processor.extract_text_from_pdf_content(content)
-            
-            # Log success
-            logger.info(f"Successfully extracted text from uploaded PDF, length: {len(text) if text else 0}")
-            
-            # If text extraction failed, raise an HTTP error
-            if not text:
-                raise HTTPException(status_code=400, detail="PDF text extraction failed")
-            
-            return {"extracted_text": text}
+        # Log success
+        logger.info(f"Successfully extracted text from uploaded PDF, length: {len(text) if text else 0}")
         
-        finally:
-            # Ensure the temporary file is deleted
-            try:
-                os.unlink(temp_path)
-            except Exception as e:
-                logger.warning(f"Failed to delete temporary file: {str(e)}")
+        # If text extraction failed, raise an HTTP error
+        if not text:
+            raise HTTPException(status_code=400, detail="PDF text extraction failed")
+        
+        return {"extracted_text": text}
     
     except HTTPException:
         raise
@@ -291,4 +140,7 @@ async def extract_text_from_uploaded_pdf(file: UploadFile = File(...)):
         raise HTTPException(
             status_code=500,
             detail=f"Error processing uploaded PDF: {str(e)}"
-        )
\ No newline at end of file
+        )
+    finally:
+        # Ensure the temporary file is deleted
+        upload.cleanup()
\ No newline at end of file
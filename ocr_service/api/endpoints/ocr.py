@@ -1,18 +1,66 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+import asyncio
 import logging
 import json
+import time
+from typing import Any, Awaitable, Optional
 
-from api.models.schemas import DocumentURLRequest, OCRResponse
-from api.endpoints.extraction import ocr_processor, URLHandler
-from utils.ai_processor import ai_processor
+from api.models.schemas import DocumentURLRequest, OCRResponse, ReprocessRequest
+from utils.ocr_processor import URLHandler
+from utils.document_pipeline import (
+    document_pipeline, NoTextExtractedError, DocumentNotFoundError, DeadlineExceededError
+)
+from utils.admission import AdmissionRejected
+from utils.upload_spool import spool_upload, UploadError, UploadTooLargeError, UPLOAD_OPENAPI
 from core.config import settings
 
 # Create router
 router = APIRouter(tags=["ocr"])
 logger = logging.getLogger(__name__)
 
+def overloaded(error: AdmissionRejected) -> HTTPException:
+    """429 response for work that did not fit the OCR memory budget in time"""
+    return HTTPException(
+        status_code=429,
+        detail="OCR service is at capacity, retry later",
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+# How often a blocking request checks whether its client is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
+
+def deadline_from(deadline_seconds: Optional[float]) -> Optional[float]:
+    return None if deadline_seconds is None else time.monotonic() + deadline_seconds
+
+async def run_while_connected(http_request: Request, work: Awaitable[Any]) -> Any:
+    """
+    Await work, cancelling it if the client disconnects first.
+    
+    Cancellation reaches the pipeline at its next page or stage and kills a
+    running tesseract process, so abandoned requests stop using CPU.
+    """
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                logger.info("Client disconnected, cancelling document processing")
+                # 499 Client Closed Request; nobody receives it
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        task.cancel()
+
+def deadline_exceeded() -> HTTPException:
+    return HTTPException(
+        status_code=504,
+        detail="Deadline expired before any text was extracted"
+    )
+
 @router.post("/process_document", response_model=OCRResponse)
-async def process_document(request: DocumentURLRequest):
+async def process_document(request: DocumentURLRequest, http_request: Request):
     """
     Process any document (PDF or image) from a URL and extract structured data.
     
@@ -32,45 +80,25 @@ async def process_document(request: DocumentURLRequest):
                 detail="Only Cloudinary URLs are supported"
             )
         
-        # Extract the raw text first using OCR functionality
-        extracted_text = ocr_processor.extract_text_from_url(document_url)
-        
-        # Log the extracted text for debugging purposes
-        logger.info(f"Text extraction successful, text length: {len(extracted_text) if extracted_text else 0}")
-        logger.debug(f"Extracted text: {extracted_text[:500]}...")  # Log only first 500 chars
-        
-        # Check if we got a string (raw text) or structured data already
-        if isinstance(extracted_text, str) and extracted_text:
-            # Try AI processing if enabled
-            if settings.USE_AI_PROCESSING:
-                # Use the async version of the AI processing function
-                logger.info("Using AI processing for extracted text")
-                structured_data = await ai_processor.process_text_with_ai_async(extracted_text)
-                
-                # Add raw text to the response
-                structured_data["raw_text"] = extracted_text
-                return structured_data
-            else:
-                logger.info("Using rule-based processing for extracted text")
-                structured_data = await ai_processor.structure_medical_data(extracted_text)
-                
-                # Add raw text to the response
-                structured_data["raw_text"] = extracted_text
-                return structured_data
-                
-        elif isinstance(extracted_text, dict):
-            # Already structured data
-            logger.info("Using pre-structured data from extraction")
-            # Try to add raw text if possible
-            extracted_text["raw_text"] = "Pre-structured data - no raw text available"
-            return extracted_text
-        else:
-            # No text extracted or empty text
-            raise HTTPException(
-                status_code=422,
-                detail="Failed to extract any text from the provided document URL"
-            )
+        return await run_while_connected(
+            http_request,
+            document_pipeline.process_url(
+                document_url, deadline=deadline_from(request.deadline_seconds), patient_id=request.patient_id
+            ),
+        )
         
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise overloaded(e)
+    except DeadlineExceededError:
+        raise deadline_exceeded()
+    except NoTextExtractedError:
+        # No text extracted or empty text
+        raise HTTPException(
+            status_code=422,
+            detail="Failed to extract any text from the provided document URL"
+        )
     except Exception as e:
         logger.exception(f"Error processing document: {str(e)}")
         raise HTTPException(
@@ -78,11 +106,157 @@ async def process_document(request: DocumentURLRequest):
             detail=f"Error processing document: {str(e)}"
         )
 
+@router.post("/process_document/stream")
+async def process_document_stream(request: DocumentURLRequest):
+    """
+    Streaming variant of process_document.
+    
+    Returns newline-delimited JSON events as the pipeline progresses:
+    "download" when the file is fetched, "page" with the text of each page,
+    "partial" with the parameters found so far, and finally "result" with the
+    same payload as process_document (or "error" if processing failed).
+    With a deadline, "page_skipped" and "deadline" report pages that ran out
+    of time. Processing stops if the client disconnects.
+    """
+    document_url = str(request.document_url)
+    logger.info(f"Streaming document processing from URL: {document_url}")
+    
+    if not URLHandler.is_cloudinary_url(document_url):
+        raise HTTPException(
+            status_code=400,
+            detail="Only Cloudinary URLs are supported"
+        )
+    
+    events = asyncio.Queue()
+    
+    async def emit(event, data):
+        await events.put({"event": event, "data": data})
+    
+    async def run_pipeline():
+        try:
+            result = await document_pipeline.process_url(
+                document_url, emit=emit, deadline=deadline_from(request.deadline_seconds),
+                patient_id=request.patient_id,
+            )
+            await emit("result", OCRResponse(**result).model_dump())
+        except AdmissionRejected as e:
+            await emit("error", {
+                "status_code": 429,
+                "detail": "OCR service is at capacity, retry later",
+                "retry_after": e.retry_after,
+            })
+        except DeadlineExceededError:
+            await emit("error", {"status_code": 504, "detail": "Deadline expired before any text was extracted"})
+        except NoTextExtractedError:
+            await emit("error", {"status_code": 422, "detail": "Failed to extract any text from the provided document URL"})
+        except Exception as e:
+            logger.exception(f"Error processing document: {str(e)}")
+            await emit("error", {"status_code": 500, "detail": f"Error processing document: {str(e)}"})
+        finally:
+            await events.put(None)
+    
+    async def event_stream():
+        pipeline_task = asyncio.create_task(run_pipeline())
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield json.dumps(event) + "\n"
+        finally:
+            # Stop processing if the client went away before the result
+            pipeline_task.cancel()
+    
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+@router.post("/upload_document", response_model=OCRResponse, openapi_extra=UPLOAD_OPENAPI)
+async def upload_document(
+    request: Request,
+    deadline_seconds: Optional[float] = Query(default=None, gt=0),
+    patient_id: Optional[str] = Query(default=None),
+):
+    """
+    Upload a PDF or image and extract structured data from it.
+    
+    The file (multipart field "file") is streamed to disk and hashed while it is
+    received, up to MAX_UPLOAD_BYTES, and OCR reads it from disk. The optional
+    deadline_seconds query parameter bounds processing, returning the pages
+    OCRed so far when it expires. The optional patient_id query parameter
+    scopes near-duplicate lookups to that patient's documents.
+    """
+    try:
+        upload = await spool_upload(
+            request,
+            max_bytes=settings.MAX_UPLOAD_BYTES,
+            spool_dir=settings.UPLOAD_SPOOL_DIR or None,
+        )
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        logger.info(f"Processing uploaded {upload.content_type} document ({upload.size} bytes)")
+        return await run_while_connected(request, document_pipeline.process_file(
+            upload.path, is_pdf=upload.is_pdf, document_hash=upload.sha256, source=upload.filename,
+            deadline=deadline_from(deadline_seconds), patient_id=patient_id,
+        ))
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise overloaded(e)
+    except DeadlineExceededError:
+        raise deadline_exceeded()
+    except NoTextExtractedError:
+        raise HTTPException(
+            status_code=422,
+            detail="Failed to extract any text from the uploaded document"
+        )
+    except Exception as e:
+        logger.exception(f"Error processing uploaded document: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing uploaded document: {str(e)}"
+        )
+    finally:
+        document_pipeline.release_file(upload.sha256, upload.cleanup, patient_id)
+
+@router.post("/reprocess", response_model=OCRResponse)
+async def reprocess_document(request: ReprocessRequest, http_request: Request):
+    """
+    Reprocess a previously processed document with the current model and prompt.
+    
+    Resumes from the earliest stage whose stored artifact is out of date: only
+    structuring is re-run when the OCR text is still current. Requires
+    ARTIFACT_DIR to be configured.
+    """
+    try:
+        return await run_while_connected(http_request, document_pipeline.reprocess(request.document_hash))
+    except HTTPException:
+        raise
+    except DocumentNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except AdmissionRejected as e:
+        raise overloaded(e)
+    except NoTextExtractedError:
+        raise HTTPException(
+            status_code=422,
+            detail="Failed to extract any text from the stored document"
+        )
+    except Exception as e:
+        logger.exception(f"Error reprocessing document: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error reprocessing document: {str(e)}"
+        )
+
 # Add backward compatibility with previous endpoint for existing integrations
 @router.post("/process_cloudinary", response_model=OCRResponse)
-async def process_cloudinary_document(request: DocumentURLRequest):
+async def process_cloudinary_document(request: DocumentURLRequest, http_request: Request):
     """
     Legacy endpoint for Cloudinary document processing.
     Redirects to the more generic process_document endpoint.
     """
-    return await process_document(request)
\ No newline at end of file
+    return await process_document(request, http_request)
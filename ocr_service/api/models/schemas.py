@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Dict, Any, Optional, List
 
 class ImageURLRequest(BaseModel):
@@ -12,6 +12,14 @@ class PDFURLRequest(BaseModel):
 class DocumentURLRequest(BaseModel):
     """Request model for processing any document (image or PDF) from a URL"""
     document_url: str
+    # Optional time budget; when it runs out, the pages OCRed so far are returned
+    deadline_seconds: Optional[float] = Field(default=None, gt=0)
+    # Optional patient scope: near-duplicate lookups only match this patient's documents
+    patient_id: Optional[str] = None
+
+class ReprocessRequest(BaseModel):
+    """Request model for reprocessing a stored document by its hash"""
+    document_hash: str
 
 # Keep for backward compatibility
 ProcessCloudinaryURLRequest = DocumentURLRequest
@@ -26,4 +34,18 @@ class OCRResponse(BaseModel):
     lab_name: Optional[str] = None
     test_type: Optional[str] = None
     tests: List[Dict[str, Any]] = []
-    raw_text: Optional[str] = None  # Added field to include the raw extracted text
\ No newline at end of file
+    raw_text: Optional[str] = None  # Added field to include the raw extracted text
+    confidence: Optional[float] = None  # Confidence of the rule-based extraction (0-1)
+    document_hash: Optional[str] = None  # SHA-256 of the document, used to reprocess it later
+    partial: Optional[bool] = None  # True if the deadline expired before every page was OCRed
+    skipped_pages: Optional[List[int]] = None  # Pages that overran their share of the deadline
+    processing_tier: Optional[str] = None  # Which tier produced the result: rules, llm, rules+llm, rules_fallback, template
+    template_id: Optional[str] = None  # Lab template the result was read with (processing_tier "template")
+    near_duplicate_of: Optional[str] = None  # Hash of the earlier document whose result was reused
+    near_duplicate_distance: Optional[int] = None  # Perceptual hash distance to that document, in bits
+    ocr_languages: Optional[Dict[str, int]] = None  # Pages OCRed with each Tesseract language (eng, ben, eng+ben)
+
+class LearnTemplateRequest(BaseModel):
+    """Request model for learning a lab template from a confirmed extraction"""
+    document_url: str
+    confirmed: OCRResponse
\ No newline at end of file
@@ -0,0 +1,299 @@
+"""
+Offline batch OCR and structuring for backfills.
+
+Runs the same DocumentPipeline as the API over a directory of local files or a
+manifest (one local path or Cloudinary URL per line), using a process pool.
+Results are appended to an NDJSON file as they finish; re-running with the same
+output file skips inputs that already succeeded, so interrupted runs resume.
+
+With --reprocess-stored, every document in the artifact store (ARTIFACT_DIR)
+is brought up to the current stage versions instead, e.g. after changing
+GEMINI_MODEL; documents whose OCR text is still current are only re-structured.
+
+Usage:
+    python -m batch /archive/reports --output results.ndjson --workers 8
+    python -m batch manifest.txt --output results.ndjson
+    python -m batch --reprocess-stored --output reprocessed.ndjson
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, List, Set
+
+logger = logging.getLogger("batch")
+
+SUPPORTED_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp"}
+# Inputs referring to documents in the artifact store rather than files or URLs
+STORED_DOCUMENT_PREFIX = "stored:"
+
+
+def is_url(reference: str) -> bool:
+    return reference.startswith(("http://", "https://"))
+
+
+def discover_inputs(source: str) -> List[str]:
+    """
+    List the documents to process.
+
+    Args:
+        source: A directory (scanned recursively for supported files) or a
+            manifest file with one path or URL per line (lines starting with '#' are skipped)
+
+    Returns:
+        List: Input references in a stable order
+    """
+    if os.path.isdir(source):
+        inputs = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS:
+                    inputs.append(os.path.join(root, name))
+        return sorted(inputs)
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    inputs = []
+    with open(source, encoding="utf-8") as manifest:
+        for line in manifest:
+            reference = line.strip()
+            if not reference or reference.startswith("#"):
+                continue
+            if not is_url(reference) and not os.path.isabs(reference):
+                # Relative paths are relative to the manifest
+                reference = os.path.join(base_dir, reference)
+            inputs.append(reference)
+    return inputs
+
+
+def load_completed(output_path: str) -> Set[str]:
+    """Inputs that already have a successful result in the output file"""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, encoding="utf-8") as output:
+        for line in output:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Partially written last line of an interrupted run
+                continue
+            if record.get("status") == "ok":
+                completed.add(record["input"])
+    return completed
+
+
+def open_for_append(output_path: str):
+    """
+    Open the output file for appending records. A run that was killed while
+    writing leaves a torn last line without a newline; it is cut off first, so
+    the next record does not end up on the same line and get lost with it.
+    """
+    output = open(output_path, "a+b")
+    size = output.seek(0, os.SEEK_END)
+    end = size
+    while end > 0:
+        start = max(end - (1 << 16), 0)
+        output.seek(start)
+        newline = output.read(end - start).rfind(b"\n")
+        if newline >= 0:
+            end = start + newline + 1
+            break
+        end = start
+    if end < size:
+        logger.warning(f"Dropping a partially written record at the end of {output_path}")
+        output.truncate(end)
+    output.close()
+    return open(output_path, "a", encoding="utf-8")
+
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file, read in chunks"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as document:
+        for chunk in iter(lambda: document.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def process_input(reference: str) -> Dict[str, Any]:
+    """Run the document pipeline on one input (executed in a worker process)"""
+    from utils.async_bridge import run_sync
+    from utils.document_pipeline import document_pipeline
+
+    pages = 0
+
+    async def count_pages(event, data):
+        nonlocal pages
+        if event == "page":
+            pages += 1
+
+    started = time.monotonic()
+    try:
+        if reference.startswith(STORED_DOCUMENT_PREFIX):
+            document_hash = reference[len(STORED_DOCUMENT_PREFIX):]
+            result = run_sync(document_pipeline.reprocess(document_hash, emit=count_pages))
+        elif is_url(reference):
+            result = run_sync(document_pipeline.process_url(reference, emit=count_pages))
+        else:
+            is_pdf = reference.lower().endswith(".pdf")
+            result = run_sync(document_pipeline.process_file(
+                reference, is_pdf=is_pdf, document_hash=hash_file(reference), emit=count_pages, source=reference
+            ))
+        return {
+            "input": reference,
+            "status": "ok",
+            "pages": pages,
+            "seconds": round(time.monotonic() - started, 3),
+            "result": result,
+        }
+    except Exception as e:
+        return {
+            "input": reference,
+            "status": "error",
+            "pages": pages,
+            "seconds": round(time.monotonic() - started, 3),
+            "error": f"{type(e).__name__}: {e}",
+        }
+
+
+def _init_worker(log_level: str) -> None:
+    logging.basicConfig(level=log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+
+def _start_pool(workers: int, log_level: str) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(log_level,))
+
+
+def run_batch(
+    inputs: Iterable[str],
+    output_path: str,
+    workers: int,
+    log_level: str,
+    job: Callable[[str], Dict[str, Any]] = process_input,
+) -> Dict[str, Any]:
+    """
+    Process inputs on a process pool, appending one NDJSON record per input.
+
+    A worker that dies (e.g. killed by the OOM killer on a large PDF) breaks
+    the whole pool: the documents in flight on it are recorded as failed, so
+    a re-run retries them, and the rest continue on a new pool.
+
+    Returns:
+        Dict: Throughput summary
+    """
+    pending = deque(inputs)
+    summary = {"documents": 0, "pages": 0, "failures": 0}
+    started = time.monotonic()
+    max_in_flight = workers * 2
+    in_flight: Dict[Future, str] = {}
+
+    with open_for_append(output_path) as output:
+
+        def collect(futures: Iterable[Future]) -> bool:
+            """Write the records of finished jobs; True if the pool broke"""
+            broken = False
+            for future in futures:
+                reference = in_flight.pop(future)
+                try:
+                    record = future.result()
+                except BrokenProcessPool as e:
+                    broken = True
+                    record = {
+                        "input": reference,
+                        "status": "error",
+                        "pages": 0,
+                        "error": f"BrokenProcessPool: a worker process died, e.g. out of memory ({e})",
+                    }
+                output.write(json.dumps(record) + "\n")
+                # Flush each record so it survives an interrupted run
+                output.flush()
+                summary["documents"] += 1
+                summary["pages"] += record["pages"]
+                if record["status"] != "ok":
+                    summary["failures"] += 1
+                    logger.warning(f"Failed {record['input']}: {record['error']}")
+            return broken
+
+        pool = _start_pool(workers, log_level)
+        try:
+            while pending or in_flight:
+                broken = False
+                try:
+                    # Keep a bounded number of submissions so huge manifests do not
+                    # queue every input up front
+                    while pending and len(in_flight) < max_in_flight:
+                        in_flight[pool.submit(job, pending[0])] = pending[0]
+                        pending.popleft()
+                except BrokenProcessPool:
+                    broken = True
+                if not broken:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    broken = collect(done)
+                if broken:
+                    # Every job still on the broken pool fails with it (or has finished)
+                    logger.warning(
+                        f"A worker process died, recording {len(in_flight)} more documents in flight "
+                        f"as failed and starting a new pool"
+                    )
+                    collect(wait(in_flight).done)
+                    pool.shutdown()
+                    pool = _start_pool(workers, log_level)
+        finally:
+            pool.shutdown()
+
+    elapsed = time.monotonic() - started
+    summary["seconds"] = round(elapsed, 2)
+    summary["docs_per_second"] = round(summary["documents"] / elapsed, 3) if elapsed else 0.0
+    summary["pages_per_second"] = round(summary["pages"] / elapsed, 3) if elapsed else 0.0
+    return summary
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m batch", description=__doc__.split("\n\n")[0])
+    parser.add_argument("source", nargs="?", help="Directory of documents or manifest file of paths/URLs")
+    parser.add_argument(
+        "--reprocess-stored", action="store_true",
+        help="Reprocess every document in the artifact store from its earliest stale stage",
+    )
+    parser.add_argument("--output", "-o", default="results.ndjson", help="NDJSON output (also the resume checkpoint)")
+    parser.add_argument("--workers", "-w", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--log-level", default="WARNING", help="Log level for worker processes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level="INFO", format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    if args.reprocess_stored:
+        from core.config import settings
+        from utils.artifact_store import ArtifactStore
+
+        if not settings.ARTIFACT_DIR:
+            parser.error("--reprocess-stored requires ARTIFACT_DIR to be set")
+        inputs = [
+            STORED_DOCUMENT_PREFIX + document_hash
+            for document_hash in ArtifactStore(settings.ARTIFACT_DIR).iter_document_hashes()
+        ]
+    elif args.source:
+        inputs = discover_inputs(args.source)
+    else:
+        parser.error("a source directory or manifest is required")
+    completed = load_completed(args.output)
+    remaining = [reference for reference in inputs if reference not in completed]
+    logger.info(f"{len(inputs)} inputs, {len(inputs) - len(remaining)} already done, {len(remaining)} to process")
+
+    summary = run_batch(remaining, args.output, max(args.workers, 1), args.log_level)
+    print(
+        f"Processed {summary['documents']} documents ({summary['pages']} pages) in {summary['seconds']}s: "
+        f"{summary['docs_per_second']} docs/s, {summary['pages_per_second']} pages/s, "
+        f"{summary['failures']} failures"
+    )
+    return 1 if summary["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""
+Benchmarks for the OCR pipeline stages on synthetic lab reports.
+
+Measures, for rasterization, OCR and rule-based structuring
+(structure_medical_data):
+
+- throughput in pages per second
+- p50/p95 latency: per page for rasterization and OCR (as the pipeline sees
+  it, so the first page of a small PDF carries the whole conversion), per
+  document for structuring
+- the peak RSS growth of the worst document
+
+It also scores the structured results against the reports' ground truth.
+Results come from two sources: the printed text, which tests the parser
+alone, and the OCR text, which tests the whole pipeline. Scores are recall and
+precision of parameters (name and value), plus the test type, lab name and
+date hit rates. With --baseline, the run fails if any score dropped, so a
+faster change cannot quietly make results worse.
+
+Stages whose tools are missing (Tesseract; poppler for PDFs) are skipped, with
+a note saying so. Without OCR, structuring runs on the printed text.
+
+Usage:
+    python -m benchmarks.run_benchmarks --count 20 --seed 0 --output results.json
+    python -m benchmarks.run_benchmarks --corpus /tmp/reports --baseline results.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import re
+import shutil
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytesseract
+
+from benchmarks.synthetic_reports import SyntheticReport, generate_reports, load_corpus
+from utils.ai_processor import AIProcessor
+from utils.job_memory import JobMemoryTracker
+from utils.ocr_processor import OCRProcessor
+
+# Scores may drop by this much against a baseline before the run fails
+DEFAULT_TOLERANCE = 0.005
+
+
+@dataclass
+class StageResult:
+    stage: str
+    documents: int = 0
+    pages: int = 0
+    seconds: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    peak_rss_delta_bytes: int = 0
+    note: Optional[str] = None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "stage": self.stage,
+            "documents": self.documents,
+            "pages": self.pages,
+            "pages_per_second": round(self.pages / self.seconds, 2) if self.seconds else None,
+            "p50_ms": percentile_ms(self.latencies, 50),
+            "p95_ms": percentile_ms(self.latencies, 95),
+            "peak_rss_delta_bytes": self.peak_rss_delta_bytes,
+            "note": self.note,
+        }
+
+
+def percentile_ms(values: List[float], percentile: float) -> Optional[float]:
+    """Nearest-rank percentile of durations in seconds, in milliseconds"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(percentile / 100 * len(ordered)), 1)
+    return round(ordered[rank - 1] * 1000, 1)
+
+
+def tesseract_available() -> bool:
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except (pytesseract.TesseractNotFoundError, OSError):
+        return False
+
+
+def poppler_available() -> bool:
+    return shutil.which("pdftoppm") is not None
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r"\s+", " ", name).strip().lower()
+
+
+class AccuracyScore:
+    """Extraction accuracy over a set of reports, micro-averaged"""
+
+    def __init__(self):
+        self.reports = 0
+        self.expected_parameters = 0
+        self.extracted_parameters = 0
+        self.correct_parameters = 0
+        self.test_type_hits = 0
+        self.lab_name_hits = 0
+        self.test_date_hits = 0
+
+    def add(self, report: SyntheticReport, structured: Dict[str, Any]) -> None:
+        extracted = {}
+        for test in structured.get("tests", []):
+            for name, parameter in test.get("parameters", {}).items():
+                extracted[_normalize(name)] = parameter.get("value")
+        correct = 0
+        for parameter in report.parameters:
+            value = extracted.get(_normalize(parameter.name))
+            if isinstance(value, (int, float)) and math.isclose(value, parameter.value, abs_tol=1e-6):
+                correct += 1
+
+        self.reports += 1
+        self.expected_parameters += len(report.parameters)
+        self.extracted_parameters += len(extracted)
+        self.correct_parameters += correct
+        self.test_type_hits += structured.get("test_type") == report.test_type
+        self.lab_name_hits += _normalize(structured.get("lab_name") or "") == _normalize(report.lab_name)
+        self.test_date_hits += structured.get("test_date") == report.test_date
+
+    def summary(self) -> Dict[str, Any]:
+        def rate(hits: int, total: int) -> Optional[float]:
+            return round(hits / total, 4) if total else None
+
+        return {
+            "reports": self.reports,
+            "parameter_recall": rate(self.correct_parameters, self.expected_parameters),
+            "parameter_precision": rate(self.correct_parameters, self.extracted_parameters),
+            "test_type_accuracy": rate(self.test_type_hits, self.reports),
+            "lab_name_accuracy": rate(self.lab_name_hits, self.reports),
+            "test_date_accuracy": rate(self.test_date_hits, self.reports),
+        }
+
+
+def run_benchmarks(
+    corpus: List[Tuple[SyntheticReport, bytes]],
+    ocr: Optional[OCRProcessor] = None,
+    ai: Optional[AIProcessor] = None,
+) -> Dict[str, Any]:
+    """Benchmark the stages over a corpus and score the structured results"""
+    ocr = ocr or OCRProcessor()
+    ai = ai or AIProcessor()
+    memory = JobMemoryTracker(sample_interval=0.005, keep_worst=1)
+    rasterize = StageResult("rasterize")
+    ocr_stage = StageResult("ocr")
+    structure = StageResult("structure")
+    can_ocr = tesseract_available()
+    can_rasterize_pdf = poppler_available()
+
+    # Rasterize and OCR one document at a time, so only its pages are in memory
+    ocr_texts: Dict[str, str] = {}
+    for report, content in corpus:
+        if report.is_pdf and not can_rasterize_pdf:
+            continue
+        page_images = []
+        with memory.track_job(report.report_id, len(content), report.is_pdf) as job:
+            images = ocr.iter_page_images(content, report.is_pdf)
+            while True:
+                started = time.perf_counter()
+                image = next(images, None)
+                elapsed = time.perf_counter() - started
+                rasterize.seconds += elapsed
+                if image is None:
+                    break
+                rasterize.latencies.append(elapsed)
+                page_images.append(image)
+        rasterize.documents += 1
+        rasterize.pages += len(page_images)
+        rasterize.peak_rss_delta_bytes = max(rasterize.peak_rss_delta_bytes, job.peak_rss_delta)
+
+        if not can_ocr:
+            continue
+        texts = []
+        with memory.track_job(report.report_id, len(content), report.is_pdf) as job:
+            for image in page_images:
+                started = time.perf_counter()
+                texts.append(ocr.ocr_image(image))
+                elapsed = time.perf_counter() - started
+                ocr_stage.seconds += elapsed
+                ocr_stage.latencies.append(elapsed)
+        ocr_stage.documents += 1
+        ocr_stage.pages += len(texts)
+        ocr_stage.peak_rss_delta_bytes = max(ocr_stage.peak_rss_delta_bytes, job.peak_rss_delta)
+        ocr_texts[report.report_id] = "".join(f"{text}\n" for text in texts)
+
+    if not can_rasterize_pdf:
+        rasterize.note = "poppler (pdftoppm) not installed, PDFs skipped"
+    if not can_ocr:
+        ocr_stage.note = "tesseract not installed"
+
+    # Structure the OCR text where there is some, otherwise the printed text
+    printed_accuracy, ocr_accuracy = AccuracyScore(), AccuracyScore()
+    for report, _ in corpus:
+        from_ocr = report.report_id in ocr_texts
+        text = ocr_texts[report.report_id] if from_ocr else report.text
+        with memory.track_job(report.report_id, len(text), report.is_pdf) as job:
+            started = time.perf_counter()
+            structured = asyncio.run(ai.structure_medical_data(text))
+            elapsed = time.perf_counter() - started
+        structure.documents += 1
+        structure.pages += report.pages
+        structure.seconds += elapsed
+        structure.latencies.append(elapsed)
+        structure.peak_rss_delta_bytes = max(structure.peak_rss_delta_bytes, job.peak_rss_delta)
+        (ocr_accuracy if from_ocr else printed_accuracy).add(report, structured)
+        if from_ocr:
+            # Score the parser on the printed text too, to tell OCR errors from parser errors
+            printed_accuracy.add(report, asyncio.run(ai.structure_medical_data(report.text)))
+    if not ocr_texts:
+        structure.note = "ran on the printed text, no OCR output"
+
+    return {
+        "documents": len(corpus),
+        "pages": sum(report.pages for report, _ in corpus),
+        "stages": [stage.summary() for stage in (rasterize, ocr_stage, structure)],
+        "accuracy": {
+            "printed_text": printed_accuracy.summary(),
+            "ocr": ocr_accuracy.summary() if ocr_accuracy.reports else None,
+        },
+    }
+
+
+def compare_to_baseline(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Accuracy scores that dropped by more than the tolerance, as messages"""
+    regressions = []
+    for source, scores in baseline.get("accuracy", {}).items():
+        current = results["accuracy"].get(source)
+        if not scores or not current:
+            continue
+        for metric, previous in scores.items():
+            if metric == "reports" or previous is None or current.get(metric) is None:
+                continue
+            if current[metric] < previous - tolerance:
+                regressions.append(f"{source} {metric}: {previous} -> {current[metric]}")
+    return regressions
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    print(f"{results['documents']} documents, {results['pages']} pages")
+    print(f"{'stage':<10} {'docs':>5} {'pages':>6} {'pages/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'peak RSS MB':>12}")
+    for stage in results["stages"]:
+        def cell(value, width):
+            return f"{'-' if value is None else value:>{width}}"
+
+        print(
+            f"{stage['stage']:<10} {stage['documents']:>5} {stage['pages']:>6} "
+            f"{cell(stage['pages_per_second'], 9)} {cell(stage['p50_ms'], 9)} {cell(stage['p95_ms'], 9)} "
+            f"{stage['peak_rss_delta_bytes'] / 1_000_000:>12.1f}"
+            + (f"  ({stage['note']})" if stage["note"] else "")
+        )
+    for source, scores in results["accuracy"].items():
+        if scores:
+            print(f"accuracy ({source}): " + ", ".join(f"{k}={v}" for k, v in scores.items()))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark OCR pipeline stages on synthetic lab reports")
+    parser.add_argument("--corpus", help="Directory written by benchmarks.synthetic_reports (default: generate one)")
+    parser.add_argument("--count", type=int, default=20, help="Reports to generate without --corpus (default: 20)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for generated reports (default: 0)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run; fail if accuracy dropped")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Allowed drop of each accuracy score (default: {DEFAULT_TOLERANCE})")
+    args = parser.parse_args(argv)
+    # Per-document pipeline logs would drown out the results
+    logging.basicConfig(level=logging.WARNING)
+
+    corpus = load_corpus(args.corpus) if args.corpus else generate_reports(args.count, args.seed)
+    results = run_benchmarks(corpus)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            regressions = compare_to_baseline(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print("Accuracy regressed against the baseline:\n  " + "\n  ".join(regressions))
+            return 1
+        print("Accuracy is at or above the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
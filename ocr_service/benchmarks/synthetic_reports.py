@@ -0,0 +1,356 @@
+"""
+Synthetic lab reports with known contents, for benchmarks and accuracy checks.
+
+Each report is drawn with PIL the way scanned lab reports tend to look: a lab
+header, patient details and a result listing, laid out either as
+"Name: value unit (range)" lines or as a ruled table, in a random font and
+size, with optional speckle noise, blur and a slight skew. Reports are
+bundled as multi-page PDFs or as single-page PNG/JPEG images, and the values
+printed on them are kept as ground truth.
+
+Everything is derived from a seed, so a corpus can be regenerated exactly.
+
+Usage:
+    python -m benchmarks.synthetic_reports /tmp/reports --count 50 --seed 7
+"""
+import argparse
+import datetime
+import glob
+import io
+import json
+import os
+import random
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+# Rendered at the resolution the OCR processor rasterizes PDFs at
+PAGE_DPI = 200
+PAGE_SIZE = (1654, 2339)  # A4 at PAGE_DPI
+MARGIN = 120
+FORMATS = ("pdf", "png", "jpeg")
+
+LAB_NAMES = [
+    "City Medical Laboratory",
+    "Popular Diagnostic Centre",
+    "Green Life Medical Lab",
+    "Central Hospital Pathology",
+    "Square Clinic Laboratory",
+    "Lab One Healthcare",
+]
+
+# Test type -> (parameter, unit, low, high). Test types match the names in
+# settings.TEST_TYPE_KEYWORDS, headings include one of their keywords
+PANELS: Dict[str, Tuple[str, List[Tuple[str, str, float, float]]]] = {
+    "CBC": ("COMPLETE BLOOD COUNT", [
+        ("Hemoglobin", "g/dL", 13.5, 17.5),
+        ("Hematocrit", "%", 41.0, 53.0),
+        ("Red Blood Cells", "M/uL", 4.5, 5.9),
+        ("White Blood Cells", "K/uL", 4.5, 11.0),
+        ("Platelets", "K/uL", 150, 400),
+        ("Mean Corpuscular Volume", "fL", 80, 100),
+        ("Neutrophils", "%", 40, 70),
+        ("Lymphocytes", "%", 20, 40),
+    ]),
+    "Lipid Panel": ("LIPID PROFILE", [
+        ("Total Cholesterol", "mg/dL", 0, 200),
+        ("Triglycerides", "mg/dL", 0, 150),
+        ("HDL Cholesterol", "mg/dL", 40, 60),
+        ("LDL Cholesterol", "mg/dL", 0, 130),
+        ("VLDL Cholesterol", "mg/dL", 5, 40),
+    ]),
+    "Liver Function": ("LIVER FUNCTION TEST", [
+        ("Total Bilirubin", "mg/dL", 0.1, 1.2),
+        ("Direct Bilirubin", "mg/dL", 0.0, 0.3),
+        ("Alanine Aminotransferase", "U/L", 7, 56),
+        ("Aspartate Aminotransferase", "U/L", 10, 40),
+        ("Alkaline Phosphatase", "U/L", 44, 147),
+        ("Albumin", "g/dL", 3.5, 5.0),
+    ]),
+    "Kidney Function": ("RENAL FUNCTION TEST", [
+        ("Serum Creatinine", "mg/dL", 0.7, 1.3),
+        ("Blood Urea Nitrogen", "mg/dL", 7, 20),
+        ("Uric Acid", "mg/dL", 3.4, 7.0),
+        ("Sodium", "mmol/L", 135, 145),
+        ("Potassium", "mmol/L", 3.5, 5.1),
+    ]),
+    "Thyroid": ("THYROID PROFILE", [
+        ("Thyroid Stimulating Hormone", "mIU/L", 0.4, 4.0),
+        ("Free Thyroxine", "ng/dL", 0.8, 1.8),
+        ("Total Triiodothyronine", "ng/dL", 80, 200),
+    ]),
+    "Glucose": ("BLOOD GLUCOSE", [
+        ("Fasting Glucose", "mg/dL", 70, 100),
+        ("Random Glucose", "mg/dL", 70, 140),
+        ("Hemoglobin A1c", "%", 4.0, 5.6),
+    ]),
+}
+
+FIRST_NAMES = ["Rahim", "Karim", "Nusrat", "Farhana", "Tanvir", "Ayesha", "Imran", "Sadia"]
+LAST_NAMES = ["Ahmed", "Hossain", "Rahman", "Islam", "Chowdhury", "Khan", "Begum", "Uddin"]
+
+_FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSerif-Regular.ttf",
+    "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
+    "/Library/Fonts/Arial.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+]
+
+
+@dataclass
+class Parameter:
+    name: str
+    value: float
+    unit: str
+    low: float
+    high: float
+
+    @property
+    def normal_range(self) -> str:
+        return f"{_format_number(self.low)}-{_format_number(self.high)}"
+
+    @property
+    def is_abnormal(self) -> bool:
+        return not self.low <= self.value <= self.high
+
+
+@dataclass
+class SyntheticReport:
+    """What a generated report says, and how it was drawn"""
+    report_id: str
+    lab_name: str
+    test_type: str
+    test_date: str
+    parameters: List[Parameter]
+    layout: str  # "lines" or "table"
+    format: str  # "pdf", "png" or "jpeg"
+    pages: int
+    noise: float
+    skew_degrees: float
+    font: str
+    filename: str = ""
+    # Text as printed, page by page, for benchmarking structuring without OCR
+    page_texts: List[str] = field(default_factory=list)
+
+    @property
+    def is_pdf(self) -> bool:
+        return self.format == "pdf"
+
+    @property
+    def text(self) -> str:
+        return "".join(f"{page}\n" for page in self.page_texts)
+
+
+def available_fonts() -> List[str]:
+    """TrueType fonts installed on this machine, plus PIL's bundled font ("default")"""
+    return [path for path in _FONT_CANDIDATES if os.path.exists(path)] + ["default"]
+
+
+def _load_font(font: str, size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.load_default(size=size) if font == "default" else ImageFont.truetype(font, size)
+
+
+def _format_number(value: float) -> str:
+    return f"{value:g}"
+
+
+def _random_value(rng: random.Random, low: float, high: float) -> float:
+    # Mostly normal results, about one in five outside the reference range
+    span = high - low or 1.0
+    if rng.random() < 0.2:
+        value = rng.choice([low - rng.uniform(0.05, 0.4) * span, high + rng.uniform(0.05, 0.4) * span])
+    else:
+        value = rng.uniform(low, high)
+    value = max(value, 0.0)
+    return round(value, 1) if span < 20 else float(round(value))
+
+
+def make_report(
+    rng: random.Random,
+    report_id: str,
+    format: Optional[str] = None,
+    pages: Optional[int] = None,
+    fonts: Optional[List[str]] = None,
+) -> SyntheticReport:
+    """Pick the contents and appearance of one report"""
+    format = format or rng.choice(FORMATS)
+    # Images are single pages; PDFs spread their results over up to four pages
+    pages = 1 if format != "pdf" else pages or rng.choice([1, 1, 2, 3, 4])
+    test_type = rng.choice(list(PANELS))
+    _, panel = PANELS[test_type]
+
+    parameters = []
+    for _ in range(pages):
+        chosen = rng.sample(panel, k=rng.randint(min(3, len(panel)), len(panel)))
+        for name, unit, low, high in chosen:
+            parameters.append(Parameter(name, _random_value(rng, low, high), unit, low, high))
+    # A parameter is reported once; later pages of a long report repeat a panel
+    unique: Dict[str, Parameter] = {}
+    for parameter in parameters:
+        unique.setdefault(parameter.name, parameter)
+
+    test_date = datetime.date(2024, 1, 1) + datetime.timedelta(days=rng.randrange(730))
+    report = SyntheticReport(
+        report_id=report_id,
+        lab_name=rng.choice(LAB_NAMES),
+        test_type=test_type,
+        test_date=test_date.isoformat(),
+        parameters=list(unique.values()),
+        layout=rng.choice(["lines", "lines", "table"]),
+        format=format,
+        pages=min(pages, len(unique)),
+        noise=rng.choice([0.0, 0.0, 0.02, 0.05]),
+        skew_degrees=round(rng.uniform(-1.5, 1.5), 2) if rng.random() < 0.5 else 0.0,
+        font=rng.choice(fonts or available_fonts()),
+    )
+    report.filename = f"{report_id}.{'jpg' if format == 'jpeg' else format}"
+    return report
+
+
+def _page_parameters(report: SyntheticReport) -> List[List[Parameter]]:
+    per_page = -(-len(report.parameters) // report.pages)
+    return [report.parameters[i:i + per_page] for i in range(0, len(report.parameters), per_page)]
+
+
+def render_pages(report: SyntheticReport, rng: random.Random) -> List[Image.Image]:
+    """Draw the pages of a report, filling in report.page_texts with what is printed"""
+    heading, _ = PANELS[report.test_type]
+    size = rng.randint(30, 40)
+    font = _load_font(report.font, size)
+    bold = _load_font(report.font, int(size * 1.4))
+    line_height = int(size * 1.7)
+    patient = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+    images, report.page_texts = [], []
+    for page_number, page_parameters in enumerate(_page_parameters(report), start=1):
+        image = Image.new("L", PAGE_SIZE, 255)
+        draw = ImageDraw.Draw(image)
+        lines: List[str] = []
+        y = MARGIN
+
+        def text(line: str, x: int = MARGIN, line_font=font) -> None:
+            nonlocal y
+            draw.text((x, y), line, fill=rng.randint(0, 40), font=line_font)
+            lines.append(line)
+            y += line_height if line_font is font else int(line_height * 1.4)
+
+        text(report.lab_name, line_font=bold)
+        text(f"Patient: {patient}")
+        text(f"Report Date: {report.test_date}")
+        text(f"Page {page_number} of {report.pages}")
+        y += line_height
+        text(heading, line_font=bold)
+
+        if report.layout == "table":
+            columns = [MARGIN, MARGIN + 720, MARGIN + 950, MARGIN + 1180]
+            draw.line((MARGIN, y - 8, PAGE_SIZE[0] - MARGIN, y - 8), fill=0, width=3)
+            header = ["Test", "Result", "Unit", "Reference"]
+            for x, cell in zip(columns, header):
+                draw.text((x, y), cell, fill=0, font=font)
+            lines.append(" ".join(header))
+            y += line_height
+            draw.line((MARGIN, y - 8, PAGE_SIZE[0] - MARGIN, y - 8), fill=0, width=2)
+            for parameter in page_parameters:
+                cells = [parameter.name, _format_number(parameter.value), parameter.unit, parameter.normal_range]
+                for x, cell in zip(columns, cells):
+                    draw.text((x, y), cell, fill=rng.randint(0, 40), font=font)
+                lines.append(" ".join(cells))
+                y += line_height
+            draw.line((MARGIN, y - 8, PAGE_SIZE[0] - MARGIN, y - 8), fill=0, width=3)
+        else:
+            for parameter in page_parameters:
+                text(
+                    f"{parameter.name}: {_format_number(parameter.value)} {parameter.unit} "
+                    f"({parameter.normal_range})"
+                )
+
+        images.append(_degrade(image, report, rng))
+        report.page_texts.append("\n".join(lines))
+    return images
+
+
+def _degrade(image: Image.Image, report: SyntheticReport, rng: random.Random) -> Image.Image:
+    """Make a clean page look scanned: speckles, a little blur and skew"""
+    if report.noise:
+        pixels = image.load()
+        width, height = image.size
+        for _ in range(int(width * height * report.noise / 10)):
+            pixels[rng.randrange(width), rng.randrange(height)] = rng.choice((0, 128, 255))
+        image = image.filter(ImageFilter.GaussianBlur(0.6))
+    if report.skew_degrees:
+        image = image.rotate(report.skew_degrees, resample=Image.BICUBIC, fillcolor=255)
+    return image.convert("RGB")
+
+
+def encode_report(images: List[Image.Image], report: SyntheticReport) -> bytes:
+    """Bundle rendered pages into the report's file format"""
+    buffer = io.BytesIO()
+    if report.is_pdf:
+        images[0].save(buffer, "PDF", save_all=True, append_images=images[1:], resolution=PAGE_DPI)
+    else:
+        images[0].save(buffer, report.format.upper(), **({"quality": 85} if report.format == "jpeg" else {}))
+    return buffer.getvalue()
+
+
+def generate_reports(count: int, seed: int = 0, formats: Tuple[str, ...] = FORMATS) -> List[Tuple[SyntheticReport, bytes]]:
+    """Generate reports in memory, as (ground truth, file content) pairs"""
+    rng = random.Random(seed)
+    fonts = available_fonts()
+    reports = []
+    for index in range(count):
+        report = make_report(rng, f"report-{seed}-{index:04d}", format=rng.choice(formats), fonts=fonts)
+        reports.append((report, encode_report(render_pages(report, rng), report)))
+    return reports
+
+
+def write_corpus(directory: str, count: int, seed: int = 0) -> str:
+    """
+    Write generated reports to a directory, with their ground truth in
+    ground_truth.json. Returns the path of the ground truth file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    truth = []
+    for report, content in generate_reports(count, seed):
+        with open(os.path.join(directory, report.filename), "wb") as document_file:
+            document_file.write(content)
+        truth.append(asdict(report))
+    path = os.path.join(directory, "ground_truth.json")
+    with open(path, "w", encoding="utf-8") as truth_file:
+        json.dump(truth, truth_file, indent=2)
+    return path
+
+
+def load_corpus(directory: str) -> List[Tuple[SyntheticReport, bytes]]:
+    """Read a corpus written by write_corpus"""
+    with open(os.path.join(directory, "ground_truth.json"), encoding="utf-8") as truth_file:
+        truth = json.load(truth_file)
+    reports = []
+    for entry in truth:
+        entry["parameters"] = [Parameter(**parameter) for parameter in entry["parameters"]]
+        report = SyntheticReport(**entry)
+        with open(os.path.join(directory, report.filename), "rb") as document_file:
+            reports.append((report, document_file.read()))
+    return reports
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate synthetic lab reports with ground truth")
+    parser.add_argument("directory", help="Output directory")
+    parser.add_argument("--count", type=int, default=20, help="Number of reports (default: 20)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args(argv)
+
+    if glob.glob(os.path.join(args.directory, "report-*")):
+        print(f"Warning: {args.directory} already has reports; files with the same names are overwritten")
+    path = write_corpus(args.directory, args.count, args.seed)
+    print(f"Wrote {args.count} reports to {args.directory}, ground truth in {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
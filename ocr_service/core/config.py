@@ -1,4 +1,5 @@
 import os
+import tempfile
 from typing import Dict, List
 
 class Settings:
@@ -8,16 +9,132 @@ class Settings:
     API_PREFIX: str = "/api"
     DEBUG: bool = os.getenv("DEBUG", "False").lower() == "true"
     
+    # Logging: records are queued and written as JSON lines ("text" for plain
+    # lines) by a background thread. LOG_SAMPLE_RATES ("logger=rate,...") keeps
+    # only that share of a logger's DEBUG/INFO records, e.g. uvicorn.access=0.1;
+    # string fields longer than LOG_MAX_FIELD_LENGTH are truncated
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json").lower()
+    LOG_SAMPLE_RATES: str = os.getenv("LOG_SAMPLE_RATES", "")
+    LOG_MAX_FIELD_LENGTH: int = int(os.getenv("LOG_MAX_FIELD_LENGTH", "2000"))
+    
     # OpenAI settings
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     
     # Gemini settings
     GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
     GEMINI_MODEL: str = os.getenv("GEMINI_MODEL", "gemini-1.0-pro")
+    GEMINI_TIMEOUT: float = float(os.getenv("GEMINI_TIMEOUT", "30"))
+    
+    # Gemini circuit breaker: opens when the failure or slow-call rate over the
+    # last GEMINI_CIRCUIT_WINDOW calls crosses its threshold
+    GEMINI_CIRCUIT_FAILURE_RATE: float = float(os.getenv("GEMINI_CIRCUIT_FAILURE_RATE", "0.5"))
+    GEMINI_CIRCUIT_SLOW_CALL_SECONDS: float = float(os.getenv("GEMINI_CIRCUIT_SLOW_CALL_SECONDS", "10"))
+    GEMINI_CIRCUIT_SLOW_CALL_RATE: float = float(os.getenv("GEMINI_CIRCUIT_SLOW_CALL_RATE", "0.5"))
+    GEMINI_CIRCUIT_WINDOW: int = int(os.getenv("GEMINI_CIRCUIT_WINDOW", "20"))
+    GEMINI_CIRCUIT_MIN_CALLS: int = int(os.getenv("GEMINI_CIRCUIT_MIN_CALLS", "5"))
+    GEMINI_CIRCUIT_OPEN_SECONDS: float = float(os.getenv("GEMINI_CIRCUIT_OPEN_SECONDS", "30"))
+    
+    # Provider quota shared by all workers on the host (0 disables a limit).
+    # Calls wait up to GEMINI_RATE_LIMIT_WAIT seconds for budget before falling back
+    GEMINI_RPM_LIMIT: int = int(os.getenv("GEMINI_RPM_LIMIT", "15"))
+    GEMINI_TPM_LIMIT: int = int(os.getenv("GEMINI_TPM_LIMIT", "1000000"))
+    GEMINI_RATE_LIMIT_WAIT: float = float(os.getenv("GEMINI_RATE_LIMIT_WAIT", "20"))
+    GEMINI_RATE_LIMIT_DB: str = os.getenv(
+        "GEMINI_RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "ocr_service_llm_budget.sqlite3")
+    )
+    
+    # Hedged mode: return the rule-based result if Gemini misses the deadline
+    AI_HEDGED_MODE: bool = os.getenv("AI_HEDGED_MODE", "False").lower() == "true"
+    AI_HEDGE_DEADLINE: float = float(os.getenv("AI_HEDGE_DEADLINE", "5"))
+    
+    # Warm up Tesseract and the Gemini client at startup; /ready reports false
+    # until that has finished (or right away when disabled)
+    WARMUP_ENABLED: bool = os.getenv("WARMUP_ENABLED", "True").lower() == "true"
+    
+    # Tesseract languages: "auto" checks each page for Bangla script and uses
+    # eng, ben or eng+ben (eng if the ben model is not installed); anything
+    # else (e.g. "eng", "eng+ben") is used for every page
+    OCR_LANGUAGES: str = os.getenv("OCR_LANGUAGES", "auto")
+    
+    # Pages are handed to tesseract as raw greyscale files in PAGE_BUFFER_DIR
+    # (/dev/shm if empty, else the system temp dir). Each page in flight takes
+    # about 9MB at 300 DPI; Docker's default /dev/shm is 64MB (see --shm-size)
+    PAGE_BUFFER_DIR: str = os.getenv("PAGE_BUFFER_DIR", "")
     
     # Service configuration
     USE_AI_PROCESSING: bool = os.getenv("USE_AI_PROCESSING", "True").lower() == "true"
     
+    # Tiered extraction: the rule-based result is used as-is when its confidence
+    # reaches this threshold, otherwise the document is sent to the LLM
+    RULE_CONFIDENCE_THRESHOLD: float = float(os.getenv("RULE_CONFIDENCE_THRESHOLD", "0.75"))
+    # Fields (e.g. "test_date,lab_name") that trigger an LLM call when the
+    # rule-based result is confident but leaves them empty
+    AI_FILL_MISSING_FIELDS: List[str] = [
+        field.strip() for field in os.getenv("AI_FILL_MISSING_FIELDS", "").split(",") if field.strip()
+    ]
+    
+    # Hosts (host or host:port) accepted as document sources besides Cloudinary,
+    # e.g. "127.0.0.1:9100" for the local stand-in used by the load harness
+    ALLOWED_DOCUMENT_HOSTS: List[str] = [
+        host.strip().lower() for host in os.getenv("ALLOWED_DOCUMENT_HOSTS", "").split(",") if host.strip()
+    ]
+    
+    # Uploads are streamed to disk in UPLOAD_SPOOL_DIR (system temp dir if empty)
+    # and rejected once they exceed MAX_UPLOAD_BYTES
+    MAX_UPLOAD_BYTES: int = int(os.getenv("MAX_UPLOAD_BYTES", str(50_000_000)))
+    UPLOAD_SPOOL_DIR: str = os.getenv("UPLOAD_SPOOL_DIR", "")
+    
+    # Memory budget for rasterized pages across all in-flight OCR work. Work that
+    # does not fit waits up to ADMISSION_MAX_WAIT seconds (0 rejects at once) and
+    # is then rejected with 429. Set the budget to 0 to disable admission control
+    OCR_MEMORY_BUDGET_BYTES: int = int(os.getenv("OCR_MEMORY_BUDGET_BYTES", str(1_500_000_000)))
+    ADMISSION_MAX_WAIT: float = float(os.getenv("ADMISSION_MAX_WAIT", "10"))
+    
+    # Pages OCRed concurrently (0 disables scheduling). Waiting pages are shared
+    # fairly between clients (forwarded user id or API key), smallest jobs first;
+    # SCHEDULER_CLIENT_WEIGHTS ("api-key=weight,...") gives some API keys a
+    # larger or smaller share, e.g. 0.2 for a backfill key
+    OCR_WORKERS: int = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+    SCHEDULER_CLIENT_WEIGHTS: Dict[str, float] = {
+        key.strip(): float(weight)
+        for key, _, weight in (
+            entry.partition("=") for entry in os.getenv("SCHEDULER_CLIENT_WEIGHTS", "").split(",") if "=" in entry
+        )
+    }
+    
+    # Admin key for operational features such as request profiling (X-Profile
+    # with X-Admin-Key); those features are disabled while it is empty
+    ADMIN_API_KEY: str = os.getenv("ADMIN_API_KEY", "")
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "ocr-profiles"))
+    
+    # Per-job memory instrumentation: RSS is sampled every MEMORY_SAMPLE_INTERVAL
+    # seconds while jobs run, and the MEMORY_WORST_JOBS jobs with the largest peak
+    # are listed on /api/admin/memory/jobs. MEMORY_TRACEMALLOC_TOP > 0 records that
+    # many top allocation sites per stage with tracemalloc (slow, debugging only)
+    MEMORY_SAMPLE_INTERVAL: float = float(os.getenv("MEMORY_SAMPLE_INTERVAL", "0.05"))
+    MEMORY_WORST_JOBS: int = int(os.getenv("MEMORY_WORST_JOBS", "20"))
+    MEMORY_TRACEMALLOC_TOP: int = int(os.getenv("MEMORY_TRACEMALLOC_TOP", "0"))
+    
+    # Per-stage artifacts (source metadata, page text, structured output) keyed
+    # by document hash, so documents can be re-structured without re-OCR.
+    # Disabled when empty; note that the stored text contains patient data
+    ARTIFACT_DIR: str = os.getenv("ARTIFACT_DIR", "")
+    
+    # Near-duplicate detection (needs ARTIFACT_DIR): a document whose first
+    # NEAR_DUPLICATE_PAGES pages have perceptual hashes within
+    # NEAR_DUPLICATE_MAX_DISTANCE bits of a stored document's, and whose OCR
+    # text has the same numbers, reuses that document's structured result.
+    # Scoped by patient_id; 0 disables
+    NEAR_DUPLICATE_MAX_DISTANCE: int = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "0"))
+    NEAR_DUPLICATE_PAGES: int = int(os.getenv("NEAR_DUPLICATE_PAGES", "2"))
+    
+    # Lab templates learned from confirmed extractions (POST /api/admin/templates),
+    # stored as JSON in TEMPLATE_DIR; disabled when empty. A document matches a
+    # template when this share of the template's header words are in place
+    TEMPLATE_DIR: str = os.getenv("TEMPLATE_DIR", "")
+    TEMPLATE_MATCH_THRESHOLD: float = float(os.getenv("TEMPLATE_MATCH_THRESHOLD", "0.7"))
+    
     # Test type keywords for rule-based extraction
     TEST_TYPE_KEYWORDS: Dict[str, List[str]] = {
         "CBC": ["complete blood count", "cbc", "hemogram", "blood count", "hematology"],
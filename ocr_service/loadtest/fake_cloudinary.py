@@ -0,0 +1,212 @@
+"""
+Local stand-in for Cloudinary delivery URLs, for load tests.
+
+Serves the files of a directory under any Cloudinary-style path ending in
+their name (e.g. /demo/raw/upload/v1/report.pdf). To look like a real CDN
+under load it supports:
+
+- HEAD and single byte-range GET requests (206, 416)
+- latency: a fixed delay plus random jitter before each response
+- a bandwidth cap per response
+- failure injection: a share of requests answered with 503, and a share
+  whose connection is dropped halfway through the body
+
+The service only accepts it as a document source with ALLOWED_DOCUMENT_HOSTS
+set to its host:port.
+
+Usage:
+    python -m loadtest.fake_cloudinary /tmp/reports --port 9100 --latency 0.2 --error-rate 0.05
+"""
+import argparse
+import mimetypes
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class FaultConfig:
+    latency: float = 0.0  # seconds before every response
+    jitter: float = 0.0  # extra random delay, up to this many seconds
+    bandwidth: float = 0.0  # bytes per second per response, 0 for unlimited
+    error_rate: float = 0.0  # share of requests answered with 503
+    drop_rate: float = 0.0  # share of GETs whose connection drops mid-body
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "FakeCloudinaryServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool) -> None:
+        faults = self.server.faults
+        rng = self.server.rng
+        time.sleep(faults.latency + rng.uniform(0, faults.jitter))
+        self.server.count("requests")
+
+        if rng.random() < faults.error_rate:
+            self.server.count("errors")
+            self._send_status(503, "Injected failure")
+            return
+
+        path = self._file_path()
+        if path is None:
+            self._send_status(404, "Not found")
+            return
+        size = os.path.getsize(path)
+
+        byte_range = self._byte_range(size)
+        if byte_range == "invalid":
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start, end = byte_range or (0, size - 1)
+
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if send_body:
+            self._send_body(path, start, end)
+
+    def _file_path(self) -> Optional[str]:
+        name = os.path.basename(self.path.split("?", 1)[0])
+        path = os.path.join(self.server.directory, name)
+        return path if name and os.path.isfile(path) else None
+
+    def _byte_range(self, size: int):
+        header = self.headers.get("Range")
+        if not header:
+            return None
+        match = _RANGE.match(header.strip())
+        if not match or match.groups() == ("", ""):
+            return "invalid"
+        first, last = match.groups()
+        if first == "":
+            # Suffix range: the last N bytes
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        return (start, end) if start <= end and start < size else "invalid"
+
+    def _send_body(self, path: str, start: int, end: int) -> None:
+        faults = self.server.faults
+        remaining = end - start + 1
+        drop_at = remaining // 2 if self.server.rng.random() < faults.drop_rate else None
+        with open(path, "rb") as document_file:
+            document_file.seek(start)
+            sent = 0
+            while sent < remaining:
+                chunk = document_file.read(min(_CHUNK_SIZE, remaining - sent))
+                if drop_at is not None and sent + len(chunk) > drop_at:
+                    self.wfile.write(chunk[:drop_at - sent])
+                    self.server.count("drops")
+                    self.close_connection = True
+                    self.connection.shutdown(2)
+                    return
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if faults.bandwidth:
+                    time.sleep(len(chunk) / faults.bandwidth)
+
+    def _send_status(self, status: int, message: str) -> None:
+        body = message.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+class FakeCloudinaryServer(ThreadingHTTPServer):
+    """Threaded HTTP server for a directory of documents, with injectable faults"""
+
+    daemon_threads = True
+
+    def __init__(self, directory: str, host: str = "127.0.0.1", port: int = 0,
+                 faults: Optional[FaultConfig] = None, seed: Optional[int] = None):
+        super().__init__((host, port), _Handler)
+        self.directory = directory
+        self.faults = faults or FaultConfig()
+        self.rng = random.Random(seed)
+        self.counts = {"requests": 0, "errors": 0, "drops": 0}
+        self._counts_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def host_port(self) -> str:
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def url_for(self, filename: str, cloud_name: str = "demo") -> str:
+        resource = "raw" if filename.lower().endswith(".pdf") else "image"
+        return f"http://{self.host_port}/{cloud_name}/{resource}/upload/{filename}"
+
+    def count(self, name: str) -> None:
+        with self._counts_lock:
+            self.counts[name] += 1
+
+    def start(self) -> "FakeCloudinaryServer":
+        """Serve from a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-cloudinary", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Serve a directory like Cloudinary, with latency and faults")
+    parser.add_argument("directory", help="Directory with the documents to serve")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random delay, up to this many seconds")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="Bytes/s per response (0: unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Share of downloads cut off halfway")
+    args = parser.parse_args(argv)
+
+    faults = FaultConfig(args.latency, args.jitter, args.bandwidth, args.error_rate, args.drop_rate)
+    server = FakeCloudinaryServer(args.directory, args.host, args.port, faults)
+    print(f"Serving {args.directory} on http://{server.host_port}/ (set ALLOWED_DOCUMENT_HOSTS={server.host_port})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
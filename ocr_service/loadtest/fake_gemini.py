@@ -0,0 +1,125 @@
+"""
+Stand-in for the Gemini client, for load tests without an API key or quota.
+
+install() swaps google.generativeai in utils.ai_processor for a stub whose
+GenerativeModel answers generate_content_async() after a configurable delay.
+The answer is a structured result built from the "Name: value unit (range)"
+lines of the prompt. A configurable share of calls fails with 429
+(ResourceExhausted), and another share returns JSON cut off partway, as
+Gemini does when it hits max_output_tokens. Everything around the call runs
+as in production: rate limiter, circuit breaker, hedging and JSON repair.
+"""
+import asyncio
+import json
+import random
+import re
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from google.api_core.exceptions import ResourceExhausted
+
+from core.config import settings
+
+_PARAMETER_LINE = re.compile(
+    r"^\s*([A-Za-z][A-Za-z0-9 ]*?)\s*:\s*([0-9.]+)\s*([A-Za-z/%]+)?\s*(?:\((\d+\.?\d*)\s*-\s*(\d+\.?\d*)\))?\s*$",
+    re.MULTILINE,
+)
+_DATE = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+
+
+@dataclass
+class FakeGeminiConfig:
+    latency: float = 1.0  # seconds per call
+    jitter: float = 0.5  # extra random delay, up to this many seconds
+    rate_limit_rate: float = 0.0  # share of calls failing with 429
+    truncate_rate: float = 0.0  # share of calls returning cut-off JSON
+    seed: Optional[int] = None
+
+
+class FakeGenerativeModel:
+    """Mimics genai.GenerativeModel.generate_content_async"""
+
+    def __init__(self, config: FakeGeminiConfig, rng: random.Random, stats: Dict[str, int],
+                 model_name: str = "", generation_config: Optional[Dict[str, Any]] = None):
+        self.config = config
+        self.rng = rng
+        self.stats = stats
+        self.model_name = model_name
+
+    async def generate_content_async(self, contents: List[str], generation_config=None, safety_settings=None):
+        self.stats["calls"] += 1
+        await asyncio.sleep(self.config.latency + self.rng.uniform(0, self.config.jitter))
+        if self.rng.random() < self.config.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            raise ResourceExhausted("429 Resource has been exhausted (fake Gemini)")
+
+        prompt = contents[-1] if contents else ""
+        text = json.dumps(structure_like_gemini(prompt))
+        if self.rng.random() < self.config.truncate_rate:
+            self.stats["truncated"] += 1
+            text = text[:int(len(text) * self.rng.uniform(0.3, 0.95))]
+        tokens = (sum(len(part) for part in contents) + len(text)) // 4
+        return SimpleNamespace(text=text, usage_metadata=SimpleNamespace(total_token_count=tokens))
+
+
+def structure_like_gemini(text: str) -> Dict[str, Any]:
+    """A response in the RESPONSE_SCHEMA shape for the lab report text in a prompt"""
+    lowered = text.lower()
+    test_name = next(
+        (name for name, keywords in settings.TEST_TYPE_KEYWORDS.items() if any(k in lowered for k in keywords)),
+        "General Test",
+    )
+    parameters = []
+    for name, value, unit, low, high in _PARAMETER_LINE.findall(text):
+        number = float(value)
+        parameter = {
+            "name": name.strip(),
+            "code": "".join(word[0] for word in name.split()).upper(),
+            "unit": unit or "",
+            "data_type": "numeric",
+            "value": number,
+            "is_abnormal": bool(low and high and not float(low) <= number <= float(high)),
+        }
+        if low and high:
+            parameter["reference_range"] = {"min": float(low), "max": float(high)}
+        parameters.append(parameter)
+
+    date = _DATE.search(text)
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    # The prompt starts with an instruction line; the report follows
+    lab_name = lines[1] if len(lines) > 1 else None
+    return {
+        "test_type": {
+            "name": test_name,
+            "code": test_name[:4].upper(),
+            "description": f"Results for {test_name}",
+            "category": "General",
+        },
+        "parameters": parameters,
+        "metadata": {"lab_name": lab_name, "test_date": date.group(1) if date else None, "patient_info": {}},
+    }
+
+
+def install(config: FakeGeminiConfig, processor=None) -> Dict[str, int]:
+    """
+    Route the AI processor's Gemini calls to the stub.
+
+    Returns:
+        Dict: Live call counts (calls, rate_limited, truncated)
+    """
+    from utils import ai_processor as ai_module
+
+    processor = processor or ai_module.ai_processor
+    rng = random.Random(config.seed)
+    stats = {"calls": 0, "rate_limited": 0, "truncated": 0}
+    ai_module.genai = SimpleNamespace(
+        configure=lambda **kwargs: None,
+        GenerativeModel=lambda model_name="", generation_config=None: FakeGenerativeModel(
+            config, rng, stats, model_name, generation_config
+        ),
+    )
+    ai_module.GEMINI_AVAILABLE = True
+    if not processor.api_key:
+        processor.api_key = "fake-gemini-key"
+    return stats
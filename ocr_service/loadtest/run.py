@@ -0,0 +1,250 @@
+"""
+End-to-end load test of /api/process_document with local stand-ins.
+
+Serves a corpus of synthetic lab reports (benchmarks.synthetic_reports) from
+the fake Cloudinary server, starts the service with the Gemini stub in a
+subprocess (loadtest.serve), and sends document requests at a fixed rate. The
+load is open-loop: requests go out on schedule however slowly earlier ones
+complete, as real traffic does. The report gives throughput, latency
+percentiles of successful requests, errors by kind and the processing tiers
+of the results.
+
+Usage:
+    python -m loadtest.run --rps 2 --duration 60
+    python -m loadtest.run --rps 5 --duration 120 --cloudinary-latency 0.3 --cloudinary-error-rate 0.02 \
+        --gemini-latency 2 --gemini-429-rate 0.1 --gemini-truncate-rate 0.05 --output load.json
+
+Use --target to load a service that is already running; it must accept the
+fake server's host in ALLOWED_DOCUMENT_HOSTS, so give it a fixed
+--cloudinary-port. Without OCR tools (Tesseract, poppler) every request fails
+with the service's error, so run this where the service's Docker image runs.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from benchmarks.run_benchmarks import percentile_ms
+from benchmarks.synthetic_reports import write_corpus
+from loadtest.fake_cloudinary import FakeCloudinaryServer, FaultConfig
+from loadtest.serve import add_gemini_arguments
+
+STARTUP_TIMEOUT = 60
+
+
+class LoadReport:
+    """Outcomes of the requests of one load test run"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.latencies: List[float] = []
+        self.errors: Counter = Counter()
+        self.tiers: Counter = Counter()
+        self.partial = 0
+        self.started = time.perf_counter()
+        self.finished = self.started
+
+    def record(self, latency: float, error: Optional[str] = None, body: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock:
+            self.finished = time.perf_counter()
+            if error:
+                self.errors[error] += 1
+                return
+            self.latencies.append(latency)
+            self.tiers[body.get("processing_tier", "unknown")] += 1
+            self.partial += bool(body.get("partial"))
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = max(self.finished - self.started, 1e-9)
+        completed = len(self.latencies) + sum(self.errors.values())
+        return {
+            "sent": self.sent,
+            "completed": completed,
+            "succeeded": len(self.latencies),
+            "throughput_rps": round(len(self.latencies) / elapsed, 3),
+            "latency_ms": {
+                "p50": percentile_ms(self.latencies, 50),
+                "p90": percentile_ms(self.latencies, 90),
+                "p99": percentile_ms(self.latencies, 99),
+                "max": percentile_ms(self.latencies, 100),
+            },
+            "errors": dict(self.errors.most_common()),
+            "tiers": dict(self.tiers.most_common()),
+            "partial_results": self.partial,
+        }
+
+
+def run_load(
+    target: str,
+    document_urls: List[str],
+    rps: float,
+    duration: float,
+    timeout: float = 120,
+    max_in_flight: int = 256,
+    deadline_seconds: Optional[float] = None,
+    unique_urls: bool = False,
+    seed: int = 0,
+) -> LoadReport:
+    """
+    Send POST /api/process_document requests at a fixed rate for a while and
+    wait for them to complete.
+
+    Requests that would exceed max_in_flight are not sent and count as
+    "client_saturated" errors, so a stalled service cannot turn the test into
+    a closed loop.
+    """
+    rng = random.Random(seed)
+    report = LoadReport()
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+    sessions = threading.local()
+    endpoint = f"{target.rstrip('/')}/api/process_document"
+
+    def send(url: str) -> None:
+        session = getattr(sessions, "session", None) or requests.Session()
+        sessions.session = session
+        payload: Dict[str, Any] = {"document_url": url}
+        if deadline_seconds:
+            payload["deadline_seconds"] = deadline_seconds
+        started = time.perf_counter()
+        try:
+            response = session.post(endpoint, json=payload, timeout=timeout)
+            latency = time.perf_counter() - started
+            if response.status_code == 200:
+                report.record(latency, body=response.json())
+            else:
+                report.record(latency, error=f"http_{response.status_code}")
+        except requests.Timeout:
+            report.record(time.perf_counter() - started, error="timeout")
+        except requests.ConnectionError:
+            report.record(time.perf_counter() - started, error="connection_error")
+        finally:
+            in_flight.release()
+
+    total = int(rps * duration)
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="load") as pool:
+        report.started = time.perf_counter()
+        for index in range(total):
+            delay = report.started + index / rps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            url = rng.choice(document_urls)
+            if unique_urls:
+                # Defeats request coalescing and checkpoints of the same document
+                url = f"{url}?load={index}"
+            report.sent += 1
+            if not in_flight.acquire(blocking=False):
+                report.record(0.0, error="client_saturated")
+                continue
+            pool.submit(send, url)
+    return report
+
+
+def wait_until_ready(target: str, process: Optional[subprocess.Popen] = None) -> None:
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Service exited with code {process.returncode} during startup")
+        try:
+            if requests.get(f"{target}/health", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Service at {target} not ready after {STARTUP_TIMEOUT}s")
+
+
+def start_service(args: argparse.Namespace, allowed_host: str, work_dir: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        ALLOWED_DOCUMENT_HOSTS=allowed_host,
+        # Keep the stub's calls out of the real Gemini quota ledger
+        GEMINI_RATE_LIMIT_DB=os.path.join(work_dir, "llm_budget.sqlite3"),
+    )
+    command = [
+        sys.executable, "-m", "loadtest.serve", "--port", str(args.service_port),
+        "--gemini-latency", str(args.gemini_latency), "--gemini-jitter", str(args.gemini_jitter),
+        "--gemini-429-rate", str(args.gemini_429_rate), "--gemini-truncate-rate", str(args.gemini_truncate_rate),
+    ]
+    service_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen(command, cwd=service_root, env=env)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the OCR service with local Cloudinary and Gemini stand-ins")
+    parser.add_argument("--rps", type=float, default=1.0, help="Requests per second (default: 1)")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to send requests for (default: 30)")
+    parser.add_argument("--timeout", type=float, default=120, help="Client timeout per request (default: 120)")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Client-side cap on open requests")
+    parser.add_argument("--deadline-seconds", type=float, help="deadline_seconds sent with every request")
+    parser.add_argument("--unique-urls", action="store_true", help="Make every request URL distinct")
+    parser.add_argument("--corpus", help="Directory written by benchmarks.synthetic_reports (default: generate)")
+    parser.add_argument("--documents", type=int, default=20, help="Reports to generate without --corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--target", help="URL of a running service (default: start one with the Gemini stub)")
+    parser.add_argument("--service-port", type=int, default=8765, help="Port of the started service")
+    parser.add_argument("--cloudinary-port", type=int, default=0, help="Port of the fake Cloudinary (default: any)")
+    parser.add_argument("--cloudinary-latency", type=float, default=0.1)
+    parser.add_argument("--cloudinary-jitter", type=float, default=0.1)
+    parser.add_argument("--cloudinary-bandwidth", type=float, default=0.0, help="Bytes/s per download")
+    parser.add_argument("--cloudinary-error-rate", type=float, default=0.0, help="Share of 503 responses")
+    parser.add_argument("--cloudinary-drop-rate", type=float, default=0.0, help="Share of cut-off downloads")
+    add_gemini_arguments(parser)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="ocr-load-") as work_dir:
+        corpus_dir = args.corpus
+        if not corpus_dir:
+            corpus_dir = os.path.join(work_dir, "corpus")
+            print(f"Generating {args.documents} reports...")
+            write_corpus(corpus_dir, args.documents, args.seed)
+        files = sorted(name for name in os.listdir(corpus_dir) if name != "ground_truth.json")
+
+        faults = FaultConfig(
+            args.cloudinary_latency, args.cloudinary_jitter, args.cloudinary_bandwidth,
+            args.cloudinary_error_rate, args.cloudinary_drop_rate,
+        )
+        cloudinary = FakeCloudinaryServer(corpus_dir, port=args.cloudinary_port, faults=faults, seed=args.seed).start()
+        service = None
+        try:
+            target = args.target
+            if target:
+                print(f"Using {target}; it needs ALLOWED_DOCUMENT_HOSTS={cloudinary.host_port}")
+            else:
+                target = f"http://127.0.0.1:{args.service_port}"
+                service = start_service(args, cloudinary.host_port, work_dir)
+            wait_until_ready(target, service)
+
+            print(f"Sending {args.rps} requests/s for {args.duration}s to {target}")
+            report = run_load(
+                target, [cloudinary.url_for(name) for name in files], args.rps, args.duration,
+                timeout=args.timeout, max_in_flight=args.max_in_flight,
+                deadline_seconds=args.deadline_seconds, unique_urls=args.unique_urls, seed=args.seed,
+            )
+        finally:
+            if service is not None:
+                service.terminate()
+                service.wait(timeout=30)
+            cloudinary.stop()
+
+    summary = dict(report.summary(), cloudinary=cloudinary.counts)
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(summary, output_file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
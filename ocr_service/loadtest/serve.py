@@ -0,0 +1,41 @@
+"""
+Run the OCR service with the Gemini stub in place of the real client.
+
+Usage:
+    ALLOWED_DOCUMENT_HOSTS=127.0.0.1:9100 python -m loadtest.serve --port 8000 \
+        --gemini-latency 1.5 --gemini-429-rate 0.05 --gemini-truncate-rate 0.05
+"""
+import argparse
+
+import uvicorn
+
+from loadtest.fake_gemini import FakeGeminiConfig, install
+
+
+def add_gemini_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--gemini-latency", type=float, default=1.0, help="Seconds per Gemini call (default: 1)")
+    parser.add_argument("--gemini-jitter", type=float, default=0.5, help="Extra random delay per call (default: 0.5)")
+    parser.add_argument("--gemini-429-rate", type=float, default=0.0, help="Share of calls failing with 429")
+    parser.add_argument("--gemini-truncate-rate", type=float, default=0.0, help="Share of calls with cut-off JSON")
+
+
+def gemini_config(args: argparse.Namespace) -> FakeGeminiConfig:
+    return FakeGeminiConfig(args.gemini_latency, args.gemini_jitter, args.gemini_429_rate, args.gemini_truncate_rate)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run the OCR service against a fake Gemini")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_gemini_arguments(parser)
+    args = parser.parse_args(argv)
+
+    install(gemini_config(args))
+    from main import app
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
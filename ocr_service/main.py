@@ -1,32 +1,55 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
+import asyncio
+import contextlib
 import logging
 import os
+import time
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+from core.config import settings
+from utils.structured_logging import parse_sample_rates, setup_logging
+
+# Configure logging: queued and written off the request path, as JSON by default
+setup_logging(
+    level=settings.LOG_LEVEL,
+    json_format=settings.LOG_FORMAT == "json",
+    sample_rates=parse_sample_rates(settings.LOG_SAMPLE_RATES),
+    max_field_length=settings.LOG_MAX_FIELD_LENGTH,
 )
 logger = logging.getLogger(__name__)
 
-# Debug: Print environment variables to help diagnose issues
-logger.info("==== DEBUG: Environment Variables ====")
-logger.info(f"GEMINI_API_KEY exists: {'Yes' if 'GEMINI_API_KEY' in os.environ else 'No'}")
-logger.info(f"GEMINI_MODEL: {os.environ.get('GEMINI_MODEL', 'Not found')}")
-logger.info(f"DEBUG setting: {os.environ.get('DEBUG', 'Not found')}")
-logger.info("==== End Environment Debug ====")
-
-# Import API endpoints
+# Import API endpoints. Heavy libraries (Gemini client, pytesseract) are imported
+# on first use or by the warm-up, not here; see `python -X importtime -c "import main"`
+_imports_started = time.perf_counter()
 from api.endpoints.ocr import router as ocr_router
 from api.endpoints.extraction import router as extraction_router
-from core.config import settings
+from api.endpoints.admin import router as admin_router
+from utils.ai_processor import ai_processor
+from utils.document_pipeline import document_pipeline
+from utils.scheduler import ClientIdentityMiddleware
+from utils.metrics import render_metrics
+from utils.server_timing import ServerTimingMiddleware
+from utils.profiling import ProfilingMiddleware
+from utils.warmup import warm_up
+from utils.page_buffers import sweep_stale_buffers
+warm_up.record("import:application", time.perf_counter() - _imports_started)
 
-# Debug: Print settings values
-logger.info("==== DEBUG: Settings Values ====")
-logger.info(f"settings.GEMINI_API_KEY exists: {'Yes' if settings.GEMINI_API_KEY else 'No'}")
-logger.info(f"settings.GEMINI_MODEL: {settings.GEMINI_MODEL}")
-logger.info(f"settings.DEBUG: {settings.DEBUG}")
-logger.info("==== End Settings Debug ====")
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info(
+        f"Starting {settings.APP_NAME}: Gemini {'enabled' if ai_processor.gemini_enabled else 'disabled'} "
+        f"(model {settings.GEMINI_MODEL})"
+    )
+    sweep_stale_buffers()
+    task = None
+    if settings.WARMUP_ENABLED:
+        task = asyncio.create_task(warm_up.run(document_pipeline.ocr, ai_processor))
+    else:
+        warm_up.skip()
+    yield
+    if task is not None:
+        task.cancel()
 
 # Create FastAPI app
 app = FastAPI(
@@ -35,11 +58,20 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
+# OCR work started by a request is scheduled fairly per client
+app.add_middleware(ClientIdentityMiddleware, weights=settings.SCHEDULER_CLIENT_WEIGHTS)
+# Per-stage durations in a Server-Timing header on every response
+app.add_middleware(ServerTimingMiddleware)
+# Outermost, so a profile covers the whole request
+app.add_middleware(ProfilingMiddleware, admin_key=settings.ADMIN_API_KEY, profile_dir=settings.PROFILE_DIR)
+
 # Include routers with API prefix
 app.include_router(ocr_router, prefix=settings.API_PREFIX)
 app.include_router(extraction_router, prefix=settings.API_PREFIX)
+app.include_router(admin_router, prefix=settings.API_PREFIX)
 
 @app.get("/")
 async def root():
@@ -47,7 +79,31 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    try:
+        # Reads the shared SQLite budget, which can wait on other workers' locks
+        llm_budget = await asyncio.to_thread(ai_processor.rate_limiter.usage)
+    except Exception as e:
+        logger.warning(f"Could not read the LLM budget usage: {e}")
+        llm_budget = {"error": str(e)}
+    return {
+        "status": "healthy",
+        "gemini_circuit": ai_processor.circuit_breaker.snapshot(),
+        "llm_budget": llm_budget,
+        "ocr_memory": document_pipeline.admission.snapshot() if document_pipeline.admission else None,
+        "ocr_scheduler": document_pipeline.scheduler.snapshot() if document_pipeline.scheduler else None,
+    }
+
+@app.get("/ready")
+async def readiness_check():
+    """Ready once the startup warm-up has finished (503 until then), even if a step failed"""
+    snapshot = warm_up.snapshot()
+    return JSONResponse(snapshot, status_code=200 if snapshot["ready"] else 503)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics: per-stage latency, fallbacks, cache hits, queue depth"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 if __name__ == "__main__":
     import uvicorn
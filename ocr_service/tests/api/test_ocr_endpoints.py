@@ -1,4 +1,7 @@
+import asyncio
 import pytest
+import json
+import time
 from fastapi.testclient import TestClient
 from main import app
 
@@ -8,10 +11,200 @@ def test_root_endpoint():
     """Test the root endpoint returns the expected message"""
     response = client.get("/")
     assert response.status_code == 200
-    assert response.json() == {"message": "Medical Document OCR Service is online"}
+    assert response.json() == {"status": "online", "service": "OCR Service"}
 
 def test_health_check():
     """Test the health check endpoint returns healthy status"""
     response = client.get("/health")
     assert response.status_code == 200
-    assert response.json()["status"] == "healthy"
\ No newline at end of file
+    assert response.json()["status"] == "healthy"
+
+class FakeOCR:
+    """Stands in for OCRProcessor so the pipeline runs without Cloudinary or Tesseract"""
+
+    PAGES = [
+        "City Medical Laboratory\nLIPID PROFILE\nTotal Cholesterol: 180 mg/dL (0-200)\nTriglycerides: 120 mg/dL (0-150)",
+        "HDL Cholesterol: 55 mg/dL (40-60)\nLDL Cholesterol: 100 mg/dL (0-130)\nVLDL: 24 mg/dL (5-40)",
+    ]
+
+    def download_document(self, url):
+        return b"%PDF-fake", "application/pdf"
+
+    def is_pdf(self, content_type, url):
+        return True
+
+    def inspect_document(self, content, is_pdf):
+        from utils.ocr_processor import DocumentShape
+        return DocumentShape(len(self.PAGES), 1_000_000, 1)
+
+    def estimate_memory(self, content, is_pdf, shape=None):
+        return 1_000_000
+
+    def iter_page_images(self, content, is_pdf):
+        # The "images" are the page texts themselves
+        yield from self.PAGES
+
+    async def ocr_image_async(self, image):
+        return image
+
+
+@pytest.fixture
+def fake_pipeline(monkeypatch):
+    from utils.document_pipeline import document_pipeline
+    monkeypatch.setattr(document_pipeline, "ocr", FakeOCR())
+    return document_pipeline
+
+
+DOCUMENT_URL = "https://res.cloudinary.com/demo/raw/upload/report.pdf"
+
+
+def test_process_document_rejects_non_cloudinary_url():
+    response = client.post("/api/process_document", json={"document_url": "https://example.com/a.pdf"})
+    assert response.status_code == 400
+
+
+def test_process_document_stream_emits_pages_then_result(fake_pipeline):
+    response = client.post("/api/process_document/stream", json={"document_url": DOCUMENT_URL})
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines()]
+    names = [event["event"] for event in events]
+    assert names == ["download", "page", "partial", "page", "partial", "result"]
+    assert len(events[2]["data"]["parameters"]) == 2
+    assert len(events[4]["data"]["parameters"]) == 5
+
+    # The final event carries the same payload as the blocking endpoint
+    blocking = client.post("/api/process_document", json={"document_url": DOCUMENT_URL})
+    assert blocking.status_code == 200
+    assert events[-1]["data"] == blocking.json()
+
+
+def test_upload_document_streams_file_and_cleans_up(fake_pipeline, monkeypatch, tmp_path):
+    from core.config import settings
+    monkeypatch.setattr(settings, "UPLOAD_SPOOL_DIR", str(tmp_path))
+    response = client.post(
+        "/api/upload_document",
+        files={"file": ("scan.png", b"\x89PNG\r\n\x1a\n" + b"\0" * 64, "image/png")},
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert body["processing_tier"] == "rules"
+    assert "HDL Cholesterol" in body["raw_text"]
+    assert len(body["document_hash"]) == 64
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_upload_document_rejects_unsupported_and_oversized_files(fake_pipeline, monkeypatch, tmp_path):
+    from core.config import settings
+    monkeypatch.setattr(settings, "UPLOAD_SPOOL_DIR", str(tmp_path))
+    response = client.post("/api/upload_document", files={"file": ("notes.txt", b"plain text", "text/plain")})
+    assert response.status_code == 400
+
+    monkeypatch.setattr(settings, "MAX_UPLOAD_BYTES", 100)
+    response = client.post("/api/upload_document", files={"file": ("big.pdf", b"%PDF" + b"0" * 200, "application/pdf")})
+    assert response.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_process_document_returns_429_when_memory_budget_is_exhausted(fake_pipeline, monkeypatch):
+    from utils.admission import MemoryAdmissionController
+    admission = MemoryAdmissionController(budget_bytes=1_000_000, max_wait=0, default_retry_after=7)
+    monkeypatch.setattr(fake_pipeline, "admission", admission)
+
+    async def hold_budget():
+        async with admission.reserve(1_000_000):
+            return client.post("/api/process_document", json={"document_url": DOCUMENT_URL})
+
+    # The TestClient runs the app on its own loop, so the budget can be held here
+    response = asyncio.run(hold_budget())
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "7"
+
+
+def test_pipeline_runs_as_the_forwarded_user(fake_pipeline, monkeypatch):
+    from utils.scheduler import current_client
+    seen = []
+
+    async def process_url(document_url, emit=None, deadline=None, patient_id=None):
+        seen.append((current_client.get().name, deadline is not None))
+        return {"raw_text": "text"}
+
+    monkeypatch.setattr(fake_pipeline, "process_url", process_url)
+    response = client.post(
+        "/api/process_document",
+        json={"document_url": DOCUMENT_URL, "deadline_seconds": 5},
+        headers={"X-Forwarded-User": "42"},
+    )
+    assert response.status_code == 200
+    assert seen == [("user:42", True)]
+
+
+def test_metrics_report_stages_and_cache_hits(fake_pipeline):
+    client.post("/api/process_document", json={"document_url": DOCUMENT_URL})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'ocr_stage_duration_seconds_count{stage="download"}' in response.text
+    assert 'ocr_stage_duration_seconds_count{stage="rasterize"}' in response.text
+    assert 'ocr_structured_results_total{tier=' in response.text
+    assert "ocr_downloaded_bytes_total" in response.text
+    assert 'ocr_queue_depth{queue="scheduler"}' in response.text
+
+
+def test_responses_carry_server_timing_per_stage(fake_pipeline):
+    response = client.post("/api/process_document", json={"document_url": DOCUMENT_URL})
+    timing = response.headers["Server-Timing"]
+    assert "download;dur=" in timing
+    assert 'rasterize;desc="3x";dur=' in timing  # two pages and the end of the document
+    assert "total;dur=" in timing
+
+
+def test_profiling_requires_admin_key_and_saves_profile(fake_pipeline, monkeypatch, tmp_path):
+    from utils import profiling
+    monkeypatch.setattr(profiling, "PYINSTRUMENT_AVAILABLE", False)
+    middleware = app.middleware_stack
+    while not isinstance(middleware, profiling.ProfilingMiddleware):
+        middleware = middleware.app
+    monkeypatch.setattr(middleware, "admin_key", "admin-secret")
+    monkeypatch.setattr(middleware, "profile_dir", str(tmp_path))
+
+    denied = client.post(
+        "/api/process_document", json={"document_url": DOCUMENT_URL},
+        headers={"X-Profile": "true", "X-Admin-Key": "wrong"},
+    )
+    assert denied.status_code == 403
+
+    response = client.post(
+        "/api/process_document", json={"document_url": DOCUMENT_URL},
+        headers={"X-Profile": "true", "X-Admin-Key": "admin-secret", "X-Request-ID": "slow-doc-1"},
+    )
+    assert response.status_code == 200
+    assert response.headers["X-Profile-File"] == "slow-doc-1.pstats"
+    assert (tmp_path / "slow-doc-1.pstats").stat().st_size > 0
+
+
+def test_worst_memory_jobs_require_admin_key(fake_pipeline, monkeypatch):
+    from core.config import settings
+    monkeypatch.setattr(settings, "ADMIN_API_KEY", "admin-secret")
+    client.post("/api/process_document", json={"document_url": DOCUMENT_URL})
+
+    assert client.get("/api/admin/memory/jobs").status_code == 403
+    response = client.get("/api/admin/memory/jobs", headers={"X-Admin-Key": "admin-secret"})
+    assert response.status_code == 200
+    jobs = response.json()["jobs"]
+    assert jobs and {"document_hash", "peak_rss_delta_bytes", "peak_image_pixels"} <= set(jobs[0])
+
+
+def test_ready_after_startup_warm_up(fake_pipeline, monkeypatch):
+    import main
+    from utils.warmup import WarmUp
+    monkeypatch.setattr(main, "warm_up", WarmUp())
+    assert client.get("/ready").status_code == 503
+
+    with TestClient(app) as started:
+        for _ in range(100):
+            response = started.get("/ready")
+            if response.status_code == 200:
+                break
+            time.sleep(0.01)
+    assert response.status_code == 200
+    assert "ocr_probe" in response.json()["timings_ms"]
@@ -0,0 +1,74 @@
+import json
+import os
+
+from batch import discover_inputs, load_completed, open_for_append, run_batch
+
+
+def test_discover_inputs_from_directory(tmp_path):
+    (tmp_path / "nested").mkdir()
+    for name in ["b.pdf", "a.JPG", "nested/c.tiff", "notes.txt"]:
+        (tmp_path / name).write_bytes(b"")
+    inputs = discover_inputs(str(tmp_path))
+    assert [path.replace(str(tmp_path), "") for path in inputs] == ["/a.JPG", "/b.pdf", "/nested/c.tiff"]
+
+
+def test_discover_inputs_from_manifest(tmp_path):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(
+        "# backfill 2024\n"
+        "reports/one.pdf\n"
+        "\n"
+        "https://res.cloudinary.com/demo/raw/upload/two.pdf#page=1\n"
+    )
+    assert discover_inputs(str(manifest)) == [
+        str(tmp_path / "reports/one.pdf"),
+        "https://res.cloudinary.com/demo/raw/upload/two.pdf#page=1",
+    ]
+
+
+def test_load_completed_skips_failures_and_torn_lines(tmp_path):
+    output = tmp_path / "results.ndjson"
+    output.write_text(
+        json.dumps({"input": "a.pdf", "status": "ok"}) + "\n"
+        + json.dumps({"input": "b.pdf", "status": "error"}) + "\n"
+        + '{"input": "c.pdf", "sta'
+    )
+    assert load_completed(str(output)) == {"a.pdf"}
+
+
+def test_records_appended_after_a_torn_tail_are_kept(tmp_path):
+    output = tmp_path / "results.ndjson"
+    output.write_text(json.dumps({"input": "a.pdf", "status": "ok"}) + "\n" + '{"input": "c.pdf", "sta')
+    with open_for_append(str(output)) as appended:
+        appended.write(json.dumps({"input": "d.pdf", "status": "ok"}) + "\n")
+    assert load_completed(str(output)) == {"a.pdf", "d.pdf"}
+
+    # A file with only a torn line is emptied; a complete file is left as is
+    output.write_text('{"input": "c.pdf", "sta')
+    open_for_append(str(output)).close()
+    assert output.read_text() == ""
+    output.write_text(json.dumps({"input": "a.pdf", "status": "ok"}) + "\n")
+    open_for_append(str(output)).close()
+    assert load_completed(str(output)) == {"a.pdf"}
+
+
+def crash_on_large(reference):
+    """Stand-in for process_input whose worker is killed on "large" inputs"""
+    if "large" in reference:
+        os._exit(137)
+    return {"input": reference, "status": "ok", "pages": 1, "seconds": 0.0, "result": {}}
+
+
+def test_dead_worker_fails_its_documents_and_the_run_goes_on(tmp_path):
+    output = tmp_path / "results.ndjson"
+    inputs = ["a.pdf", "large.pdf"] + [f"{name}.pdf" for name in "cdefgh"]
+    summary = run_batch(inputs, str(output), 1, "WARNING", job=crash_on_large)
+
+    records = {record["input"]: record for record in map(json.loads, output.read_text().splitlines())}
+    assert sorted(records) == sorted(inputs)
+    assert records["large.pdf"]["status"] == "error"
+    assert "BrokenProcessPool" in records["large.pdf"]["error"]
+    # Inputs submitted after the crash ran on a new pool
+    assert all(records[f"{name}.pdf"]["status"] == "ok" for name in "fgh")
+    assert summary["documents"] == len(inputs)
+    assert summary["failures"] == sum(record["status"] != "ok" for record in records.values())
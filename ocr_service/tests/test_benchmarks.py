@@ -0,0 +1,62 @@
+from benchmarks.run_benchmarks import AccuracyScore, percentile_ms, compare_to_baseline, run_benchmarks
+from benchmarks.synthetic_reports import generate_reports, load_corpus, write_corpus
+from utils.ai_processor import AIProcessor
+
+
+def test_reports_are_reproducible_from_the_seed():
+    first = [report for report, _ in generate_reports(3, seed=5)]
+    second = [report for report, _ in generate_reports(3, seed=5)]
+    assert first == second
+
+
+def test_pdf_reports_spread_results_over_pages(tmp_path):
+    [(report, content)] = generate_reports(1, seed=3, formats=("pdf",))
+    assert content.startswith(b"%PDF")
+    assert len(report.page_texts) == report.pages
+    printed = "\n".join(report.page_texts)
+    assert all(parameter.name in printed for parameter in report.parameters)
+
+    write_corpus(str(tmp_path), 2, seed=3)
+    [(loaded, loaded_content), _] = load_corpus(str(tmp_path))
+    assert loaded == report and loaded_content.startswith(b"%PDF")
+
+
+def test_accuracy_counts_name_and_value_matches():
+    [(report, _)] = generate_reports(1, seed=2, formats=("png",))
+    parameters = {parameter.name: {"value": parameter.value} for parameter in report.parameters}
+    first = report.parameters[0].name
+    parameters[first] = {"value": report.parameters[0].value + 1}
+    parameters["Report Date"] = {"value": 2024.0}
+
+    score = AccuracyScore()
+    score.add(report, {"test_type": report.test_type, "lab_name": report.lab_name, "tests": [{"parameters": parameters}]})
+    summary = score.summary()
+    expected = len(report.parameters)
+    assert summary["parameter_recall"] == round((expected - 1) / expected, 4)
+    assert summary["parameter_precision"] == round((expected - 1) / (expected + 1), 4)
+    assert summary["test_type_accuracy"] == 1.0 and summary["test_date_accuracy"] == 0.0
+
+
+def test_benchmark_runs_on_images_and_flags_accuracy_drops():
+    corpus = generate_reports(3, seed=1, formats=("png", "jpeg"))
+    ai = AIProcessor()
+    results = run_benchmarks(corpus, ai=ai)
+
+    stages = {stage["stage"]: stage for stage in results["stages"]}
+    assert stages["rasterize"]["pages"] == 3 and stages["rasterize"]["p95_ms"] is not None
+    assert stages["structure"]["documents"] == 3
+    printed = results["accuracy"]["printed_text"]
+    assert printed["reports"] == 3 and printed["parameter_recall"] > 0
+
+    better = {"accuracy": {"printed_text": dict(printed, parameter_recall=printed["parameter_recall"] + 0.1)}}
+    assert compare_to_baseline(results, better, tolerance=0.005) == [
+        f"printed_text parameter_recall: {printed['parameter_recall'] + 0.1} -> {printed['parameter_recall']}"
+    ]
+    assert compare_to_baseline(results, results, tolerance=0.005) == []
+
+
+def test_percentiles_use_nearest_rank():
+    latencies = [i / 1000 for i in range(1, 101)]
+    assert percentile_ms(latencies, 50) == 50.0
+    assert percentile_ms(latencies, 95) == 95.0
+    assert percentile_ms([], 95) is None
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from loadtest import fake_gemini
+from loadtest.fake_cloudinary import FakeCloudinaryServer, FaultConfig
+from loadtest.run import run_load
+from utils.ai_processor import AIProcessor
+
+REPORT = "City Medical Laboratory\nReport Date: 2024-05-01\nLIPID PROFILE\n" + "\n".join(
+    f"{name}: {value} mg/dL (0-200)" for name, value in [("Total Cholesterol", 180), ("Triglycerides", 120)]
+)
+
+
+@pytest.fixture
+def cloudinary(tmp_path):
+    (tmp_path / "report.pdf").write_bytes(bytes(range(100)))
+    server = FakeCloudinaryServer(str(tmp_path), seed=0).start()
+    yield server
+    server.stop()
+
+
+def test_fake_cloudinary_serves_files_and_ranges(cloudinary):
+    url = cloudinary.url_for("report.pdf")
+    assert "/demo/raw/upload/report.pdf" in url
+
+    response = requests.get(url + "?fl_attachment=true")
+    assert response.status_code == 200 and response.content == bytes(range(100))
+    assert response.headers["Content-Type"] == "application/pdf"
+    assert requests.head(url).headers["Content-Length"] == "100"
+
+    partial = requests.get(url, headers={"Range": "bytes=10-19"})
+    assert partial.status_code == 206 and partial.content == bytes(range(10, 20))
+    assert partial.headers["Content-Range"] == "bytes 10-19/100"
+    assert requests.get(url, headers={"Range": "bytes=-5"}).content == bytes(range(95, 100))
+    assert requests.get(url, headers={"Range": "bytes=200-"}).status_code == 416
+    assert requests.get(cloudinary.url_for("missing.pdf")).status_code == 404
+
+
+def test_fake_cloudinary_injects_failures(cloudinary):
+    cloudinary.faults = FaultConfig(error_rate=1.0)
+    assert requests.get(cloudinary.url_for("report.pdf")).status_code == 503
+
+    cloudinary.faults = FaultConfig(drop_rate=1.0)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        requests.get(cloudinary.url_for("report.pdf"))
+    assert cloudinary.counts == {"requests": 2, "errors": 1, "drops": 1}
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    processor = AIProcessor()
+    processor.api_key = ""
+    # install() swaps these module globals; restore them after the test
+    monkeypatch.setattr("utils.ai_processor.genai", None)
+    monkeypatch.setattr("utils.ai_processor.GEMINI_AVAILABLE", True)
+    return processor
+
+
+def test_fake_gemini_answers_in_gemini_format(processor):
+    stats = fake_gemini.install(fake_gemini.FakeGeminiConfig(latency=0, jitter=0), processor)
+    result = asyncio.run(processor.process_text_with_ai_async(REPORT))
+    assert stats["calls"] == 1
+    assert result["lab_name"] == "City Medical Laboratory" and result["test_date"] == "2024-05-01"
+    assert result["tests"][0]["parameters"]["Total Cholesterol"]["value"] == 180
+
+
+def test_fake_gemini_rate_limits_and_truncates(processor):
+    config = fake_gemini.FakeGeminiConfig(latency=0, jitter=0, rate_limit_rate=1.0, seed=1)
+    stats = fake_gemini.install(config, processor)
+    with pytest.raises(Exception, match="429"):
+        asyncio.run(processor._extract_with_gemini(REPORT))
+
+    config.rate_limit_rate, config.truncate_rate = 0.0, 1.0
+    result = asyncio.run(processor._extract_with_gemini(REPORT))
+    assert stats == {"calls": 2, "rate_limited": 1, "truncated": 1}
+    assert len(result["tests"][0]["parameters"]) < 2
+
+
+class _FakeService(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        failing = payload["document_url"].endswith("bad.pdf")
+        body = json.dumps({"detail": "boom"} if failing else {"processing_tier": "rules"}).encode()
+        self.send_response(500 if failing else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_run_load_reports_throughput_errors_and_tiers():
+    service = ThreadingHTTPServer(("127.0.0.1", 0), _FakeService)
+    threading.Thread(target=service.serve_forever, daemon=True).start()
+    try:
+        report = run_load(
+            f"http://127.0.0.1:{service.server_address[1]}",
+            ["http://docs/good.pdf", "http://docs/bad.pdf"], rps=50, duration=0.4, seed=1,
+        )
+    finally:
+        service.shutdown()
+    summary = report.summary()
+    assert summary["sent"] == summary["completed"] == 20
+    assert summary["succeeded"] == summary["tiers"]["rules"] == 20 - summary["errors"]["http_500"]
+    assert summary["latency_ms"]["p99"] is not None and summary["throughput_rps"] > 0
@@ -0,0 +1 @@
+# Utils tests package initialization
\ No newline at end of file
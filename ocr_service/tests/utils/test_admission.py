@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+from utils.admission import MemoryAdmissionController, AdmissionRejected
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_waiters_are_admitted_in_order_as_memory_frees():
+    async def scenario():
+        admission = MemoryAdmissionController(budget_bytes=100, max_wait=5)
+        order = []
+
+        async def job(name, cost, hold):
+            async with admission.reserve(cost):
+                order.append(name)
+                await asyncio.sleep(hold)
+
+        await asyncio.gather(job("a", 60, 0.05), job("b", 60, 0), job("c", 10, 0))
+        return order, admission.snapshot()
+
+    order, snapshot = asyncio.run(scenario())
+    # c would fit next to a, but queues behind b so large work is not starved
+    assert order == ["a", "b", "c"]
+    assert snapshot["in_use_bytes"] == 0
+    assert snapshot["queued"] == 0
+
+
+def test_rejects_after_deadline_with_retry_after_from_history():
+    clock = FakeClock()
+    admission = MemoryAdmissionController(budget_bytes=100, max_wait=0.01, clock=clock)
+
+    async def scenario():
+        # One finished reservation teaches the controller 0.1s per byte
+        async with admission.reserve(50):
+            clock.now += 5
+        async with admission.reserve(100):
+            clock.now += 2
+            with pytest.raises(AdmissionRejected) as rejected:
+                async with admission.reserve(40):
+                    pass
+            return rejected.value.retry_after
+
+    # The running reservation started at t=5 and should end at t=15; now is t=7
+    assert asyncio.run(scenario()) == 8
+    assert admission.snapshot()["rejected"] == 1
+
+
+def test_oversized_reservation_runs_alone():
+    admission = MemoryAdmissionController(budget_bytes=100, max_wait=0)
+
+    async def scenario():
+        async with admission.reserve(1_000):
+            return admission.snapshot()["in_use_bytes"]
+
+    assert asyncio.run(scenario()) == 100
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        admission = MemoryAdmissionController(budget_bytes=100, max_wait=5)
+        async with admission.reserve(100):
+            waiter = asyncio.ensure_future(admission.reserve(50).__aenter__())
+            await asyncio.sleep(0)
+            assert admission.snapshot()["queued"] == 1
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            queued = admission.snapshot()["queued"]
+        return queued, admission.snapshot()["in_use_bytes"]
+
+    assert asyncio.run(scenario()) == (0, 0)
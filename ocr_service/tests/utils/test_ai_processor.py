@@ -0,0 +1,241 @@
+import asyncio
+import pytest
+from prometheus_client import REGISTRY
+from core.config import settings
+from utils import ai_processor as ai_module
+from utils.ai_processor import AIProcessor
+
+LIPID_PANEL_TEXT = """
+City Medical Laboratory
+Reported on 2025-03-15
+LIPID PROFILE
+Total Cholesterol: 180 mg/dL (0-200)
+Triglycerides: 120 mg/dL (0-150)
+HDL Cholesterol: 55 mg/dL (40-60)
+LDL Cholesterol: 100 mg/dL (0-130)
+VLDL: 24 mg/dL (5-40)
+"""
+
+UNSTRUCTURED_TEXT = "Patient was seen today. Results attached separately."
+
+AI_RESULT = {
+    "test_date": "2025-03-15",
+    "lab_name": "AI Lab",
+    "test_type": "CBC",
+    "tests": [{"test_type": "CBC", "parameters": {}, "metadata": {}}],
+}
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    """AI processor with a fake Gemini call that records how often it is used"""
+    processor = AIProcessor()
+    processor.api_key = "test-key"
+    processor.ai_calls = 0
+
+    async def fake_extract(text, abandon_at=None):
+        processor.ai_calls += 1
+        return dict(AI_RESULT)
+
+    monkeypatch.setattr(processor, "_extract_with_gemini", fake_extract)
+    monkeypatch.setattr(ai_module, "GEMINI_AVAILABLE", True)
+    monkeypatch.setattr(settings, "USE_AI_PROCESSING", True)
+    monkeypatch.setattr(settings, "AI_FILL_MISSING_FIELDS", [])
+    return processor
+
+
+def test_rule_based_confidence_for_clean_panel(processor):
+    """A clean lipid panel is parsed by the rules with full confidence"""
+    result = asyncio.run(processor.structure_medical_data(LIPID_PANEL_TEXT))
+    assert result["test_type"] == "Lipid Panel"
+    assert len(result["tests"][0]["parameters"]) == 5
+    assert result["confidence"] == 1.0
+
+
+def test_rule_based_confidence_without_parameters(processor):
+    """No parameters means no confidence"""
+    result = asyncio.run(processor.structure_medical_data(UNSTRUCTURED_TEXT))
+    assert result["confidence"] == 0.0
+
+
+def test_tiered_skips_llm_when_rules_are_confident(processor):
+    result = asyncio.run(processor.process_text_tiered(LIPID_PANEL_TEXT))
+    assert result["processing_tier"] == "rules"
+    assert processor.ai_calls == 0
+
+
+def test_tiered_uses_llm_below_threshold(processor):
+    result = asyncio.run(processor.process_text_tiered(UNSTRUCTURED_TEXT))
+    assert result["processing_tier"] == "llm"
+    assert result["lab_name"] == "AI Lab"
+    assert processor.ai_calls == 1
+
+
+def test_tiered_fills_missing_fields_from_llm(processor, monkeypatch):
+    monkeypatch.setattr(settings, "AI_FILL_MISSING_FIELDS", ["lab_name", "test_date"])
+    text = LIPID_PANEL_TEXT.replace("City Medical Laboratory", "")
+    result = asyncio.run(processor.process_text_tiered(text))
+    assert result["processing_tier"] == "rules+llm"
+    assert result["lab_name"] == "AI Lab"
+    assert result["test_type"] == "Lipid Panel"
+    assert processor.ai_calls == 1
+
+
+def test_tiered_falls_back_to_rules_on_llm_error(processor, monkeypatch):
+    async def failing_extract(text, abandon_at=None):
+        raise RuntimeError("quota exceeded")
+
+    monkeypatch.setattr(processor, "_extract_with_gemini", failing_extract)
+    fallbacks_before = REGISTRY.get_sample_value("ocr_rule_fallbacks_total", {"reason": "fallback"}) or 0
+    result = asyncio.run(processor.process_text_tiered(UNSTRUCTURED_TEXT))
+    assert result["processing_tier"] == "rules_fallback"
+    assert REGISTRY.get_sample_value("ocr_rule_fallbacks_total", {"reason": "fallback"}) == fallbacks_before + 1
+
+
+def test_tiered_skips_llm_while_circuit_is_open(processor, monkeypatch):
+    monkeypatch.delattr(processor, "_extract_with_gemini")
+    monkeypatch.setattr(processor.circuit_breaker, "allow_request", lambda: False)
+    result = asyncio.run(processor.process_text_tiered(UNSTRUCTURED_TEXT))
+    assert result["processing_tier"] == "rules_circuit_open"
+
+
+def test_tiered_hedges_slow_llm(processor, monkeypatch):
+    async def slow_extract(text, abandon_at=None):
+        await asyncio.sleep(1)
+        return dict(AI_RESULT)
+
+    monkeypatch.setattr(processor, "_extract_with_gemini", slow_extract)
+    monkeypatch.setattr(settings, "AI_HEDGED_MODE", True)
+    monkeypatch.setattr(settings, "AI_HEDGE_DEADLINE", 0.01)
+    result = asyncio.run(processor.process_text_tiered(UNSTRUCTURED_TEXT))
+    assert result["processing_tier"] == "rules_hedged"
+
+
+def test_tiered_tells_gemini_timeout_from_hedge_deadline(processor, monkeypatch):
+    async def timed_out_extract(text, abandon_at=None):
+        raise ai_module.GeminiTimeoutError("no answer")
+
+    monkeypatch.setattr(processor, "_extract_with_gemini", timed_out_extract)
+    monkeypatch.setattr(settings, "AI_HEDGED_MODE", True)
+    monkeypatch.setattr(settings, "AI_HEDGE_DEADLINE", 5)
+    hedged_before = REGISTRY.get_sample_value("ocr_rule_fallbacks_total", {"reason": "hedged"}) or 0
+    result = asyncio.run(processor.process_text_tiered(UNSTRUCTURED_TEXT))
+    assert result["processing_tier"] == "rules_timeout"
+    assert (REGISTRY.get_sample_value("ocr_rule_fallbacks_total", {"reason": "hedged"}) or 0) == hedged_before
+
+
+def fake_gemini(monkeypatch, generate, model_error=None):
+    """A processor whose Gemini client is a fake answering with generate(); no quota waits"""
+    from types import SimpleNamespace
+
+    class FakeModel:
+        def __init__(self, model_name, generation_config=None):
+            if model_error:
+                raise model_error
+
+        async def generate_content_async(self, contents, **kwargs):
+            return await generate()
+
+    async def no_wait(tokens, timeout):
+        pass
+
+    monkeypatch.setattr(ai_module, "genai", SimpleNamespace(configure=lambda api_key: None, GenerativeModel=FakeModel))
+    monkeypatch.setattr(ai_module, "GEMINI_AVAILABLE", True)
+    processor = AIProcessor()
+    processor.api_key = "test-key"
+    monkeypatch.setattr(processor.rate_limiter, "acquire", no_wait)
+    return processor
+
+
+def open_then_half_open(breaker, monkeypatch):
+    for _ in range(breaker.min_calls):
+        breaker.record_failure(0.1)
+    monkeypatch.setattr(breaker, "open_seconds", 0)
+    assert breaker.state == breaker.HALF_OPEN
+
+
+@pytest.mark.parametrize("response_text", ["Sorry, I cannot help with that.", "[1, 2]"])
+def test_malformed_gemini_responses_are_counted(monkeypatch, response_text):
+    from types import SimpleNamespace
+
+    async def generate():
+        return SimpleNamespace(text=response_text, usage_metadata=None)
+
+    processor = fake_gemini(monkeypatch, generate)
+    failures_before = REGISTRY.get_sample_value("ocr_llm_json_decode_failures_total") or 0
+    with pytest.raises(ValueError):
+        asyncio.run(processor._extract_with_gemini(UNSTRUCTURED_TEXT))
+    assert REGISTRY.get_sample_value("ocr_llm_json_decode_failures_total") == failures_before + 1
+
+
+def test_budget_bookkeeping_failure_keeps_the_gemini_result(monkeypatch):
+    import json
+    import sqlite3
+    from types import SimpleNamespace
+
+    response = {
+        "test_type": {"name": "CBC", "code": "CBC"},
+        "parameters": [{"name": "Hemoglobin", "value": "14.5", "unit": "g/dL", "is_abnormal": False}],
+        "metadata": {"lab_name": "AI Lab", "test_date": "2025-03-15"},
+    }
+
+    async def generate():
+        return SimpleNamespace(text=json.dumps(response), usage_metadata=SimpleNamespace(total_token_count=900))
+
+    def locked(estimated_tokens, actual_tokens):
+        raise sqlite3.OperationalError("database is locked")
+
+    processor = fake_gemini(monkeypatch, generate)
+    monkeypatch.setattr(processor.rate_limiter, "record_actual", locked)
+    result = asyncio.run(processor._extract_with_gemini(UNSTRUCTURED_TEXT))
+    assert result["lab_name"] == "AI Lab"
+    assert "Hemoglobin" in result["tests"][0]["parameters"]
+
+
+def test_call_abandoned_at_the_hedge_deadline_counts_as_slow(monkeypatch):
+    async def hanging():
+        await asyncio.sleep(30)
+
+    processor = fake_gemini(monkeypatch, hanging)
+    monkeypatch.setattr(settings, "USE_AI_PROCESSING", True)
+    monkeypatch.setattr(settings, "AI_FILL_MISSING_FIELDS", [])
+    monkeypatch.setattr(settings, "AI_HEDGED_MODE", True)
+    monkeypatch.setattr(settings, "AI_HEDGE_DEADLINE", 0.05)
+    result = asyncio.run(processor.process_text_tiered(UNSTRUCTURED_TEXT))
+    assert result["processing_tier"] == "rules_hedged"
+    assert processor.circuit_breaker.snapshot()["slow_call_rate"] == 1.0
+
+    # A slow trial call reopens a half-open circuit
+    open_then_half_open(processor.circuit_breaker, monkeypatch)
+    asyncio.run(processor.process_text_tiered(UNSTRUCTURED_TEXT))
+    monkeypatch.setattr(processor.circuit_breaker, "open_seconds", 30)
+    assert processor.circuit_breaker.state == processor.circuit_breaker.OPEN
+
+
+def test_setup_error_gives_back_the_trial_slot(monkeypatch):
+    processor = fake_gemini(monkeypatch, None, model_error=RuntimeError("bad config"))
+    breaker = processor.circuit_breaker
+    open_then_half_open(breaker, monkeypatch)
+    with pytest.raises(RuntimeError):
+        asyncio.run(processor._extract_with_gemini(UNSTRUCTURED_TEXT))
+    assert breaker.state == breaker.HALF_OPEN
+    assert breaker.allow_request()
+
+
+def test_gemini_client_is_built_lazily(monkeypatch):
+    from types import SimpleNamespace
+    calls = []
+    fake_genai = SimpleNamespace(
+        configure=lambda api_key: calls.append(("configure", api_key)),
+        GenerativeModel=lambda model_name, generation_config=None: calls.append(("model", model_name)),
+    )
+    monkeypatch.setattr(ai_module, "genai", fake_genai)
+    monkeypatch.setattr(ai_module, "GEMINI_AVAILABLE", True)
+    monkeypatch.setattr(settings, "USE_AI_PROCESSING", True)
+    processor = AIProcessor()
+    processor.api_key = "test-key"
+    assert calls == []
+
+    processor.warm_up()
+    processor.warm_up()
+    assert calls == [("configure", "test-key"), ("model", processor.model_name), ("model", processor.model_name)]
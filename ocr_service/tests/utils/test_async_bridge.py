@@ -0,0 +1,62 @@
+import asyncio
+import threading
+import pytest
+from utils.async_bridge import BackgroundEventLoop
+from utils.ai_processor import AIProcessor
+
+
+@pytest.fixture
+def bridge():
+    bridge = BackgroundEventLoop(name="test-bridge")
+    yield bridge
+    bridge.stop()
+
+
+async def current_loop():
+    await asyncio.sleep(0)
+    return asyncio.get_running_loop()
+
+
+def test_reuses_one_loop_across_calls(bridge):
+    assert bridge.run(current_loop()) is bridge.run(current_loop())
+
+
+def test_works_from_inside_a_running_loop(bridge):
+    async def caller():
+        # A sync helper called from async code still gets the real result
+        return bridge.run(asyncio.sleep(0, result="done"))
+
+    assert asyncio.run(caller()) == "done"
+
+
+def test_concurrent_threads_share_the_loop(bridge):
+    results = []
+
+    def worker(n):
+        results.append(bridge.run(asyncio.sleep(0.01, result=n)))
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == list(range(8))
+
+
+def test_refuses_to_block_inside_the_background_loop(bridge):
+    async def nested():
+        return bridge.run(asyncio.sleep(0))
+
+    with pytest.raises(RuntimeError):
+        bridge.run(nested())
+
+
+def test_sync_facade_returns_real_result_in_async_context():
+    processor = AIProcessor()
+    processor.api_key = ""
+
+    async def caller():
+        return processor.process_text_with_ai("Hemoglobin: 14.5 g/dL (13-17)")
+
+    result = asyncio.run(caller())
+    assert "Hemoglobin" in result["tests"][0]["parameters"]
@@ -0,0 +1,95 @@
+from utils.circuit_breaker import CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(clock):
+    return CircuitBreaker(
+        name="test",
+        failure_rate_threshold=0.5,
+        slow_call_seconds=2.0,
+        slow_call_rate_threshold=0.5,
+        window_size=4,
+        min_calls=4,
+        open_seconds=10.0,
+        clock=clock,
+    )
+
+
+def test_opens_on_error_rate():
+    breaker = make_breaker(FakeClock())
+    for _ in range(2):
+        breaker.record_success(0.1)
+    for _ in range(2):
+        breaker.record_failure(0.1)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+
+def test_opens_on_slow_calls():
+    breaker = make_breaker(FakeClock())
+    for _ in range(2):
+        breaker.record_success(0.1)
+    for _ in range(2):
+        breaker.record_success(5.0)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_stays_closed_below_min_calls():
+    breaker = make_breaker(FakeClock())
+    for _ in range(3):
+        breaker.record_failure(0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_trial_closes_or_reopens():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for _ in range(4):
+        breaker.record_failure(0.1)
+
+    clock.now = 10.0
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+    # Only one trial call at a time
+    assert not breaker.allow_request()
+    breaker.record_failure(0.1)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now = 20.0
+    assert breaker.allow_request()
+    breaker.record_success(0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_release_frees_half_open_slot():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for _ in range(4):
+        breaker.record_failure(0.1)
+    clock.now = 10.0
+    assert breaker.allow_request()
+    breaker.release()
+    assert breaker.allow_request()
+
+
+def test_abandoned_calls_are_slow_whatever_their_duration():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for _ in range(2):
+        breaker.record_success(0.1)
+    for _ in range(2):
+        breaker.record_abandoned(0.5)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now = 10.0
+    assert breaker.allow_request()
+    breaker.record_abandoned(0.5)
+    assert breaker.state == CircuitBreaker.OPEN
@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import time
+import pytest
+from utils.ai_processor import AIProcessor
+from utils.artifact_store import ArtifactStore
+from utils.document_pipeline import DocumentPipeline, DocumentNotFoundError
+
+PAGES = [
+    "City Medical Laboratory\nLIPID PROFILE\nTotal Cholesterol: 180 mg/dL (0-200)",
+    "HDL Cholesterol: 55 mg/dL (40-60)\nLDL Cholesterol: 100 mg/dL (0-130)",
+]
+CONTENT = b"%PDF-fake report"
+DOCUMENT_HASH = hashlib.sha256(CONTENT).hexdigest()
+
+
+class CountingOCR:
+    """Fake OCRProcessor that counts how often documents are OCRed"""
+
+    stage_version = "fake-ocr-v1"
+
+    def __init__(self):
+        self.ocr_runs = 0
+
+    def download_document(self, url):
+        return CONTENT, "application/pdf"
+
+    def is_pdf(self, content_type, url):
+        return True
+
+    def iter_page_images(self, content, is_pdf):
+        # The "images" are the page texts themselves
+        self.ocr_runs += 1
+        yield from PAGES
+
+    async def ocr_image_async(self, image):
+        return image
+
+
+class VersionedAI(AIProcessor):
+    version = "model-a"
+
+    @property
+    def stage_version(self):
+        return self.version
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    ai = VersionedAI()
+    ai.api_key = ""
+    return DocumentPipeline(CountingOCR(), ai, ArtifactStore(str(tmp_path)))
+
+
+def test_structured_result_is_reused(pipeline):
+    first = asyncio.run(pipeline.process_content(CONTENT, is_pdf=True))
+    second = asyncio.run(pipeline.process_content(CONTENT, is_pdf=True))
+    assert first["document_hash"] == DOCUMENT_HASH
+    assert second == first
+    assert pipeline.ocr.ocr_runs == 1
+
+
+def test_structure_version_change_skips_ocr(pipeline):
+    asyncio.run(pipeline.process_url("https://res.cloudinary.com/demo/raw/upload/report.pdf"))
+    pipeline.ai.version = "model-b"
+    result = asyncio.run(pipeline.reprocess(DOCUMENT_HASH))
+    assert pipeline.ocr.ocr_runs == 1
+    assert "HDL Cholesterol" in result["tests"][0]["parameters"]
+
+
+def test_ocr_version_change_downloads_again(pipeline):
+    asyncio.run(pipeline.process_url("https://res.cloudinary.com/demo/raw/upload/report.pdf"))
+    pipeline.ocr.stage_version = "fake-ocr-v2"
+    asyncio.run(pipeline.reprocess(DOCUMENT_HASH))
+    assert pipeline.ocr.ocr_runs == 2
+
+
+def test_fallback_results_are_not_stored(pipeline):
+    tiered = pipeline.ai.process_text_tiered
+
+    async def gemini_down(text):
+        result = await tiered(text)
+        result["processing_tier"] = "rules_fallback"
+        return result
+
+    pipeline.ai.process_text_tiered = gemini_down
+    first = asyncio.run(pipeline.process_content(CONTENT, is_pdf=True))
+    assert first["processing_tier"] == "rules_fallback"
+    assert pipeline.store.load_structured(DOCUMENT_HASH, "fake-ocr-v1", "model-a") is None
+
+    # Once Gemini is back the stored page text is structured again
+    pipeline.ai.process_text_tiered = tiered
+    second = asyncio.run(pipeline.reprocess(DOCUMENT_HASH))
+    assert second["processing_tier"] != "rules_fallback"
+    assert pipeline.ocr.ocr_runs == 1
+
+
+def test_stored_fallback_results_are_ignored(pipeline):
+    first = asyncio.run(pipeline.process_content(CONTENT, is_pdf=True))
+    pipeline.store.save_structured(DOCUMENT_HASH, "fake-ocr-v1", "model-a", dict(first, processing_tier="rules_hedged"))
+    assert asyncio.run(pipeline.reprocess(DOCUMENT_HASH))["processing_tier"] != "rules_hedged"
+
+
+def test_reprocess_unknown_document(pipeline):
+    with pytest.raises(DocumentNotFoundError):
+        asyncio.run(pipeline.reprocess("0" * 64))
+
+
+class PausingOCR(CountingOCR):
+    """Pages take a moment, so concurrent requests overlap"""
+
+    async def ocr_image_async(self, image):
+        await asyncio.sleep(0.05)
+        return image
+
+
+def test_concurrent_runs_are_shared_per_patient():
+    ai = VersionedAI()
+    ai.api_key = ""
+    pipeline = DocumentPipeline(PausingOCR(), ai)
+
+    async def scenario():
+        return await asyncio.gather(
+            pipeline.process_content(CONTENT, is_pdf=True, patient_id="patient-a"),
+            pipeline.process_content(CONTENT, is_pdf=True, patient_id="patient-a"),
+            pipeline.process_content(CONTENT, is_pdf=True, patient_id="patient-b"),
+        )
+
+    first, same_patient, other_patient = asyncio.run(scenario())
+    assert pipeline.ocr.ocr_runs == 2
+    assert same_patient == first and same_patient is not first
+    assert other_patient["document_hash"] == DOCUMENT_HASH
+
+
+class SlowPageOCR(CountingOCR):
+    """Second page takes far longer than its share of the deadline"""
+
+    def inspect_document(self, content, is_pdf):
+        from utils.ocr_processor import DocumentShape
+        return DocumentShape(len(PAGES), 1_000_000, 1)
+
+    async def ocr_image_async(self, image):
+        if image is PAGES[1]:
+            await asyncio.sleep(5)
+        return image
+
+
+def test_deadline_returns_partial_results_without_storing_them(tmp_path):
+    ai = VersionedAI()
+    ai.api_key = ""
+    pipeline = DocumentPipeline(SlowPageOCR(), ai, ArtifactStore(str(tmp_path)))
+
+    async def scenario():
+        return await pipeline.process_content(CONTENT, is_pdf=True, deadline=time.monotonic() + 0.3)
+
+    result = asyncio.run(scenario())
+    assert result["partial"] is True
+    assert result["skipped_pages"] == [2]
+    assert "Total Cholesterol" in result["raw_text"]
+    assert "HDL" not in result["raw_text"]
+    assert pipeline.store.load_ocr(DOCUMENT_HASH, pipeline.ocr.stage_version) is None
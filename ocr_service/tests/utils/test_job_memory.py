@@ -0,0 +1,47 @@
+import asyncio
+from utils.job_memory import JobMemoryTracker, WorstJobs, note_pages_rasterized, read_rss_bytes
+
+
+def test_rss_is_read():
+    assert read_rss_bytes() > 0
+
+
+def test_track_job_records_pixels_pages_and_rss_growth():
+    tracker = JobMemoryTracker(sample_interval=0.001, keep_worst=5)
+    with tracker.track_job("a" * 64, size_bytes=1234, is_pdf=True) as job:
+        note_pages_rasterized(2, 8_000_000)
+        note_pages_rasterized(1, 4_000_000)
+        ballast = bytearray(50_000_000)
+        ballast[::4096] = b"x" * len(ballast[::4096])  # touch every page so it is resident
+        del ballast
+    assert job.pages == 3
+    assert job.peak_image_pixels == 8_000_000
+    assert job.peak_rss_delta >= 40_000_000
+    [report] = tracker.worst_jobs.snapshot()
+    assert report["document_hash"] == "a" * 64
+    assert report["peak_rss_delta_bytes"] == job.peak_rss_delta
+
+
+def test_pages_outside_a_job_are_ignored():
+    note_pages_rasterized(1, 1_000_000)
+
+
+def test_worst_jobs_keeps_the_largest():
+    worst = WorstJobs(capacity=2)
+    for delta in (5, 30, 10, 20):
+        worst.add({"document_hash": str(delta), "peak_rss_delta_bytes": delta})
+    assert [report["peak_rss_delta_bytes"] for report in worst.snapshot()] == [30, 20]
+
+
+def test_trace_allocations_attaches_top_sites_to_the_job():
+    tracker = JobMemoryTracker(tracemalloc_top=3)
+
+    async def job():
+        with tracker.track_job("b" * 64, size_bytes=1, is_pdf=False) as memory:
+            with tracker.trace_allocations("structure"):
+                kept = [bytes(1000) for _ in range(1000)]
+            return memory, kept
+
+    memory, _ = asyncio.run(job())
+    assert 0 < len(memory.allocations["structure"]) <= 3
+    assert "test_job_memory.py" in memory.allocations["structure"][0]
@@ -0,0 +1,60 @@
+import json
+import pytest
+from utils.json_repair import parse_partial_json
+from utils.model_reference import RESPONSE_SCHEMA
+
+COMPLETE_RESPONSE = {
+    "test_type": {"name": "CBC", "code": "CBC"},
+    "parameters": [
+        {"name": "Hemoglobin", "value": "14.5", "unit": "g/dL", "is_abnormal": False},
+        {"name": "Platelets", "value": "250", "unit": "10^3/uL", "is_abnormal": False},
+    ],
+    "metadata": {"lab_name": "HealthFirst", "test_date": "2025-03-15"},
+}
+
+
+def test_parses_complete_json_with_fences_and_trailing_text():
+    text = "```json\n" + json.dumps(COMPLETE_RESPONSE) + "\n```\nHope this helps!"
+    value, complete = parse_partial_json(text)
+    assert complete
+    assert value == COMPLETE_RESPONSE
+
+
+@pytest.mark.parametrize("cut", range(60, len(json.dumps(COMPLETE_RESPONSE)) - 1, 23))
+def test_truncated_output_keeps_only_complete_parameters(cut):
+    text = json.dumps(COMPLETE_RESPONSE)[:cut]
+    value, complete = parse_partial_json(text)
+    assert not complete
+    assert value["test_type"]["name"] == "CBC"
+    # Every recovered parameter is one that was fully written
+    for parameter in value.get("parameters", []):
+        assert parameter in COMPLETE_RESPONSE["parameters"]
+
+
+def test_truncated_after_first_parameter():
+    text = json.dumps(COMPLETE_RESPONSE)
+    text = text[:text.index('{"name": "Platelets"') + 12]
+    value, complete = parse_partial_json(text)
+    assert not complete
+    assert value["parameters"] == COMPLETE_RESPONSE["parameters"][:1]
+
+
+def test_no_json_raises_decode_error():
+    with pytest.raises(json.JSONDecodeError):
+        parse_partial_json("Sorry, I cannot help with that.")
+
+
+@pytest.mark.parametrize("cut_number", ["14.", "1e", "-", "14", "1e+"])
+def test_number_cut_off_mid_way_is_dropped(cut_number):
+    value, complete = parse_partial_json('{"a": 14.5, "b": [1, ' + cut_number)
+    assert not complete
+    assert value == {"a": 14.5, "b": [1]}
+    assert parse_partial_json('{"a": ' + cut_number) == ({}, False)
+
+
+def test_response_schema_follows_json_format():
+    parameter_schema = RESPONSE_SCHEMA["properties"]["parameters"]["items"]
+    assert parameter_schema["properties"]["is_abnormal"]["type"] == "boolean"
+    assert parameter_schema["properties"]["value"]["type"] == "string"
+    # Empty objects such as patient_info are not allowed by Gemini
+    assert "patient_info" not in RESPONSE_SCHEMA["properties"]["metadata"]["properties"]
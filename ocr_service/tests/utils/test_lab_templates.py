@@ -0,0 +1,230 @@
+import asyncio
+import time
+
+import pytest
+
+from utils.ai_processor import AIProcessor
+from utils.document_pipeline import DeadlineExceededError, DocumentPipeline
+from utils.lab_templates import (
+    TemplateLearningError, TemplateRegistry, anchor_score, fingerprint, learn_template, parse_number,
+)
+from utils.ocr_processor import FULL_PAGE, DocumentShape, WordBox
+
+CHAR_WIDTH, LINE_HEIGHT = 0.012, 0.02
+
+
+class Page:
+    """A fake page image: the words on it, laid out from lines of text"""
+
+    width, height = 1000, 1414
+
+    def __init__(self, lines):
+        self.words = []
+        for line_number, (y, text) in enumerate(lines):
+            x = 0.05
+            for word in text.split():
+                right = x + len(word) * CHAR_WIDTH
+                self.words.append(WordBox(word, x, y, right, y + LINE_HEIGHT, line_number))
+                x = right + CHAR_WIDTH
+
+
+LIPID_ROWS = ("Total Cholesterol {} mg/dL (0-200)", "HDL Cholesterol {} mg/dL (40-60)", "LDL Cholesterol {} mg/dL (0-130)")
+
+
+def report(lab="City Medical Laboratory", patient="John Doe", date="2024-03-05", values=(180, 55, 100),
+           title="Lipid Profile Report", rows=LIPID_ROWS):
+    return Page([
+        (0.03, lab),
+        (0.07, title),
+        (0.11, f"Patient Name: {patient}"),
+        (0.15, f"Collected: {date}"),
+    ] + [(0.30 + 0.04 * index, row.format(value)) for index, (row, value) in enumerate(zip(rows, values))])
+
+
+CONFIRMED = {
+    "lab_name": "City Medical Laboratory",
+    "test_type": "Lipid Profile",
+    "test_date": "2024-03-05",
+    "tests": [{
+        "test_type": "Lipid Profile",
+        "metadata": {"code": "LIPI"},
+        "parameters": {
+            "Total Cholesterol": {"value": 180, "unit": "mg/dL", "normal_range": "0-200"},
+            "HDL Cholesterol": {"value": 55, "unit": "mg/dL", "normal_range": "40-60"},
+            "LDL Cholesterol": {"value": 100, "unit": "mg/dL", "normal_range": "0-130"},
+        },
+    }],
+}
+
+
+class WordOCR:
+    """Fake OCRProcessor whose pages carry their words"""
+
+    stage_version = "fake-ocr-v1"
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.regions_read = []
+        self.full_pages_read = 0
+        self.pages_rasterized = 0
+
+    def iter_page_images(self, document, is_pdf):
+        self.pages_rasterized += len(self.pages)
+        yield from self.pages
+
+    def inspect_document(self, document, is_pdf):
+        return DocumentShape(len(self.pages), Page.width * Page.height, 1)
+
+    def preview_pages(self, document, is_pdf, pages, dpi=50):
+        return self.pages[:pages]
+
+    async def ocr_words_async(self, image, box=FULL_PAGE, single_line=False):
+        return self.ocr_words(image, box, single_line)
+
+    def ocr_words(self, image, box=FULL_PAGE, single_line=False):
+        if box == FULL_PAGE:
+            self.full_pages_read += 1
+        else:
+            self.regions_read.append(box)
+        left, top, right, bottom = box
+        return [
+            word for word in image.words
+            if word.left >= left and word.right <= right and word.top >= top and word.bottom <= bottom
+        ]
+
+    async def ocr_image_async(self, image):
+        self.full_pages_read += 1
+        return "\n".join(word.text for word in image.words)
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = TemplateRegistry(str(tmp_path / "templates"), match_threshold=0.7)
+    registry.learn(WordOCR([report()]), b"first report", True, CONFIRMED, source="a" * 64)
+    return registry
+
+
+def test_parse_number_accepts_flags_and_separators_only():
+    assert parse_number("180") == 180
+    assert parse_number("1,250.5*") == 1250.5
+    assert parse_number("(0-200)") is None
+    assert parse_number("mg/dL") is None
+
+
+def extract(registry, ocr, document):
+    async def match_and_extract():
+        matched = await registry.match_document(ocr, document, True)
+        return matched and await registry.extract(ocr, document, True, *matched)
+
+    return asyncio.run(match_and_extract())
+
+
+def test_learned_template_reads_another_report_from_the_same_lab(registry):
+    ocr = WordOCR([report(patient="Jane Roe", date="2024-04-11", values=(240, 38, 120))])
+    result = extract(registry, ocr, b"second report")
+
+    assert result["processing_tier"] == "template"
+    assert result["lab_name"] == "City Medical Laboratory"
+    assert result["test_date"] == "2024-04-11"
+    parameters = result["tests"][0]["parameters"]
+    assert {name: parameter["value"] for name, parameter in parameters.items()} == {
+        "Total Cholesterol": 240, "HDL Cholesterol": 38, "LDL Cholesterol": 120,
+    }
+    assert parameters["Total Cholesterol"]["is_abnormal"] and not parameters["LDL Cholesterol"]["is_abnormal"]
+    assert parameters["HDL Cholesterol"]["unit"] == "mg/dL"
+    # Only the header band and the four value regions were OCRed
+    assert ocr.full_pages_read == 0 and len(ocr.regions_read) == 5
+
+
+def test_other_lab_does_not_match(registry):
+    ocr = WordOCR([report(lab="Riverside Diagnostic Centre")])
+    assert extract(registry, ocr, b"other lab") is None
+    # Only the preview's header was OCRed: the document was never rasterized in full
+    assert ocr.pages_rasterized == 0
+
+
+def test_other_test_from_the_same_lab_does_not_match(registry):
+    cbc = report(
+        title="Complete Blood Count Report", values=(13.2, 7.5, 250),
+        rows=("Hemoglobin {} g/dL (13-17)", "WBC Count {} K/uL (4-11)", "Platelets {} K/uL (150-400)"),
+    )
+    assert fingerprint(cbc.words, 1.4).key != fingerprint(report().words, 1.4).key
+    assert extract(registry, WordOCR([cbc]), b"cbc") is None
+
+
+def test_value_without_its_label_falls_back(registry):
+    # Same header, so the layout matches, but other parameters in the value places
+    page = report(values=(150, 55, 100), rows=("Triglycerides {} mg/dL (0-150)",) + LIPID_ROWS[1:])
+    assert extract(registry, WordOCR([page]), b"other parameters") is None
+
+
+def test_unreadable_value_falls_back(registry):
+    page = report()
+    page.words = [word for word in page.words if word.text != "55"]
+    assert extract(registry, WordOCR([page]), b"smudged") is None
+
+
+def test_learning_requires_every_value_in_the_document():
+    confirmed = {"tests": [{"parameters": {"Glucose": {"value": 99}}}]}
+    with pytest.raises(TemplateLearningError, match="Glucose"):
+        learn_template([report().words], 1.4, confirmed)
+
+
+def test_anchors_tolerate_a_small_shift():
+    words = report().words
+    shifted = [word._replace(top=word.top + 0.02, bottom=word.bottom + 0.02) for word in words]
+    original, moved = fingerprint(words, 1.4), fingerprint(shifted, 1.4)
+    assert original.key == moved.key
+    assert anchor_score(original.anchors, moved.anchors) == 1.0
+
+
+def test_templates_persist_and_can_be_removed(registry):
+    [template] = registry.templates()
+    reloaded = TemplateRegistry(registry.root_dir)
+    assert [t.summary() for t in reloaded.templates()] == [template.summary()]
+
+    assert reloaded.remove(template.template_id)
+    assert not reloaded.remove(template.template_id)
+    assert len(TemplateRegistry(registry.root_dir)) == 0
+
+
+def test_pipeline_skips_full_ocr_for_a_known_layout(registry):
+    ai = AIProcessor()
+    ai.api_key = ""
+    ocr = WordOCR([report(values=(150, 60, 90))])
+    pipeline = DocumentPipeline(ocr, ai, templates=registry)
+    result = asyncio.run(pipeline.process_content(b"known layout", is_pdf=True))
+    assert result["processing_tier"] == "template"
+    assert result["document_hash"]
+    assert ocr.full_pages_read == 0
+
+    ocr = WordOCR([report(lab="Riverside Diagnostic Centre")])
+    pipeline = DocumentPipeline(ocr, ai, templates=registry)
+    result = asyncio.run(pipeline.process_content(b"unknown layout", is_pdf=True))
+    assert result["processing_tier"] != "template"
+    assert ocr.full_pages_read == 1
+
+
+def test_deadline_cancels_a_slow_template_read(registry):
+    class SlowRegionOCR(WordOCR):
+        cancelled = False
+
+        async def ocr_words_async(self, image, box=FULL_PAGE, single_line=False):
+            if not single_line:
+                return self.ocr_words(image, box)
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                SlowRegionOCR.cancelled = True
+                raise
+
+    ai = AIProcessor()
+    ai.api_key = ""
+    ocr = SlowRegionOCR([report()])
+    pipeline = DocumentPipeline(ocr, ai, templates=registry)
+    started = time.monotonic()
+    # The template read used up the deadline, so nothing was OCRed
+    with pytest.raises(DeadlineExceededError):
+        asyncio.run(pipeline.process_content(b"slow", is_pdf=True, deadline=time.monotonic() + 0.3))
+    assert time.monotonic() - started < 5
+    assert SlowRegionOCR.cancelled
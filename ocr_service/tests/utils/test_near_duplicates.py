@@ -0,0 +1,156 @@
+import asyncio
+import io
+import random
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFont
+
+from utils.ai_processor import AIProcessor
+from utils.artifact_store import ArtifactStore
+from utils.document_pipeline import DocumentPipeline
+from utils.near_duplicates import NearDuplicateIndex, hamming, phash, same_report_text
+
+REPORT_TEXT = "City Medical Laboratory\nLIPID PROFILE\nTotal Cholesterol: {} mg/dL (0-200)\nHDL Cholesterol: 55 mg/dL (40-60)"
+
+
+def draw_page(lines):
+    image = Image.new("L", (850, 1100), 255)
+    draw = ImageDraw.Draw(image)
+    draw.text((60, 60), "City Medical Laboratory", fill=0, font=ImageFont.load_default(size=40))
+    font = ImageFont.load_default(size=22)
+    for index, line in enumerate(lines):
+        draw.text((60 + 40 * (index % 3), 160 + 45 * index), line, fill=0, font=font)
+    return image
+
+
+def rescan(image):
+    """The page photographed again: offset on a grey background, smaller, darker, JPEG"""
+    canvas = Image.new("L", (int(image.width * 1.1), int(image.height * 1.1)), 235)
+    canvas.paste(image, (30, 50))
+    canvas = canvas.resize((canvas.width * 3 // 5, canvas.height * 3 // 5))
+    canvas = ImageEnhance.Brightness(canvas).enhance(0.85)
+    buffer = io.BytesIO()
+    canvas.convert("RGB").save(buffer, "JPEG", quality=35)
+    return Image.open(buffer)
+
+
+def test_rescan_hashes_close_and_other_layouts_far():
+    rng = random.Random(1)
+    page = draw_page(["".join(rng.choice("abcdef 0123") for _ in range(30)) for _ in range(15)])
+    assert hamming(phash(page), phash(rescan(page))) <= 4
+
+    other = draw_page(["".join(rng.choice("abcdef 0123") for _ in range(20)) for _ in range(8)])
+    assert hamming(phash(page), phash(other)) > 10
+
+
+def test_banded_lookup_finds_everything_within_the_distance():
+    rng = random.Random(0)
+    index = NearDuplicateIndex(None, max_distance=6)
+    stored = {f"{n:064x}": rng.getrandbits(64) for n in range(500)}
+    for document_hash, value in stored.items():
+        index.add((value,), document_hash)
+
+    target = next(iter(stored.values()))
+    for flips in (0, 3, 6, 7):
+        probe = target
+        for bit in rng.sample(range(64), flips):
+            probe ^= 1 << bit
+        expected = sorted(h for h, value in stored.items() if hamming(value, probe) <= 6)
+        assert sorted(match.document_hash for match in index.find((probe,))) == expected
+        assert bool(expected) == (flips <= 6)
+
+
+def test_lookups_are_scoped_by_patient(tmp_path):
+    path = str(tmp_path / "index.jsonl")
+    index = NearDuplicateIndex(path, max_distance=4)
+    index.add((0xF0F0,), "a" * 64, scope="patient-1")
+    assert [m.distance for m in index.find((0xF0F1,), "patient-1")] == [1]
+    assert index.find((0xF0F1,), "patient-2") == []
+    assert index.find((0xF0F1,)) == []
+
+    reloaded = NearDuplicateIndex(path, max_distance=4)
+    assert len(reloaded) == 1 and reloaded.find((0xF0F0,), "patient-1")[0].document_hash == "a" * 64
+
+
+def test_same_report_text_requires_the_same_numbers():
+    text = REPORT_TEXT.format(180)
+    assert same_report_text(text.replace("Laboratory", "Laboratcry"), text)
+    assert not same_report_text(text.replace("Laboratory", "Laborat0ry"), text)
+    assert not same_report_text(REPORT_TEXT.format(181), text)
+
+
+class ScanOCR:
+    """Fake OCRProcessor for documents registered as (page image, page text)"""
+
+    stage_version = "fake-ocr-v1"
+
+    def __init__(self):
+        self.documents = {}
+
+    def preview_pages(self, document, is_pdf, pages):
+        return [self.documents[document][0]]
+
+    def iter_page_images(self, document, is_pdf):
+        yield self.documents[document][1]
+
+    async def ocr_image_async(self, image):
+        return image
+
+
+class CountingAI(AIProcessor):
+    def __init__(self):
+        super().__init__()
+        self.api_key = ""
+        self.structured = 0
+        self.tier = None  # overrides the tier of the results, e.g. "rules_fallback"
+
+    async def process_text_tiered(self, text):
+        self.structured += 1
+        result = await super().process_text_tiered(text)
+        if self.tier:
+            result["processing_tier"] = self.tier
+        return result
+
+
+def test_pipeline_reuses_the_result_of_a_rescan_with_the_same_values(tmp_path):
+    ai = CountingAI()
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    ocr = ScanOCR()
+    pipeline = DocumentPipeline(ocr, ai, store, near_duplicates=NearDuplicateIndex(str(tmp_path / "index.jsonl"), 6))
+    page = draw_page([REPORT_TEXT.format(180)] * 6)
+
+    def process(content, image, value, patient_id="patient-1"):
+        ocr.documents[content] = (image, REPORT_TEXT.format(value))
+        return asyncio.run(pipeline.process_content(content, is_pdf=True, patient_id=patient_id))
+
+    first = process(b"scan", page, 180)
+    again = process(b"photo", rescan(page), 180)
+    assert ai.structured == 1
+    assert again["near_duplicate_of"] == first["document_hash"]
+    assert again["near_duplicate_distance"] <= 6
+    assert again["tests"] == first["tests"] and again["document_hash"] != first["document_hash"]
+
+    # A new value in the same layout, or another patient's scan, is structured anew
+    changed = process(b"next month", rescan(page), 240)
+    assert "near_duplicate_of" not in changed
+    other_patient = process(b"other patient", rescan(page), 180, "patient-2")
+    assert "near_duplicate_of" not in other_patient
+    assert ai.structured == 3
+
+
+def test_fallback_results_are_not_reused_for_a_rescan(tmp_path):
+    ai = CountingAI()
+    ocr = ScanOCR()
+    pipeline = DocumentPipeline(
+        ocr, ai, ArtifactStore(str(tmp_path / "artifacts")),
+        near_duplicates=NearDuplicateIndex(str(tmp_path / "index.jsonl"), 6),
+    )
+    page = draw_page([REPORT_TEXT.format(180)] * 6)
+    ocr.documents[b"scan"] = (page, REPORT_TEXT.format(180))
+    ocr.documents[b"photo"] = (rescan(page), REPORT_TEXT.format(180))
+
+    ai.tier = "rules_circuit_open"
+    asyncio.run(pipeline.process_content(b"scan", is_pdf=True, patient_id="patient-1"))
+    ai.tier = None
+    again = asyncio.run(pipeline.process_content(b"photo", is_pdf=True, patient_id="patient-1"))
+    assert "near_duplicate_of" not in again
+    assert ai.structured == 2
@@ -0,0 +1,127 @@
+import asyncio
+import io
+import os
+import stat
+import pytest
+import pytesseract
+from PIL import Image
+from utils.ocr_processor import MAX_IMAGE_SIDE, OCRProcessor
+
+
+def fake_tesseract(tmp_path, monkeypatch, script):
+    path = tmp_path / "tesseract"
+    path.write_text("#!/bin/sh\n" + script)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(pytesseract.pytesseract, "tesseract_cmd", str(path))
+
+
+@pytest.fixture
+def buffer_dir(tmp_path, monkeypatch):
+    from core.config import settings
+    monkeypatch.setattr(settings, "PAGE_BUFFER_DIR", str(tmp_path / "buffers"))
+    (tmp_path / "buffers").mkdir()
+    return tmp_path / "buffers"
+
+
+def test_ocr_image_async_reads_stdout(tmp_path, monkeypatch, buffer_dir):
+    # Tesseract gets the page as a raw greyscale PGM file, removed afterwards
+    fake_tesseract(tmp_path, monkeypatch, f'head -c 2 "$1"\ncp "$1" {tmp_path}/page\necho " Total Cholesterol: 180 mg/dL $2"\n')
+    text = asyncio.run(OCRProcessor().ocr_image_async(Image.new("RGB", (10, 10), "white")))
+    assert text == "P5 Total Cholesterol: 180 mg/dL stdout\n"
+    with Image.open(tmp_path / "page") as page:
+        assert page.mode == "L" and page.size == (10, 10)
+    assert not list(buffer_dir.iterdir())
+
+
+def test_ocr_words_async_reads_tsv(tmp_path, monkeypatch, buffer_dir):
+    tsv = (
+        "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext\n"
+        "1\t1\t0\t0\t0\t0\t0\t0\t50\t20\t-1\t\n"
+        "5\t1\t1\t1\t1\t1\t2\t3\t20\t10\t96.5\tHDL\n"
+        "5\t1\t1\t1\t1\t2\t25\t3\t10\t10\t95.1\t55\n"
+    )
+    (tmp_path / "out.tsv").write_text(tsv)
+    fake_tesseract(tmp_path, monkeypatch, f'[ "${{7}}" = tsv ] || exit 1\ncat {tmp_path}/out.tsv\n')
+    image = Image.new("L", (100, 40), 255)
+    words = asyncio.run(OCRProcessor().ocr_words_async(image, (0.5, 0.5, 1.0, 1.0)))
+    assert [word.text for word in words] == ["HDL", "55"]
+    # Positions are fractions of the whole page, offset by the region
+    assert words[0].left == 0.52 and words[0].top == 23 / 40
+    assert {word.line for word in words} == {0}
+
+
+def test_ocr_image_async_raises_on_failure(tmp_path, monkeypatch):
+    fake_tesseract(tmp_path, monkeypatch, 'echo "bad image" >&2\nexit 1\n')
+    with pytest.raises(pytesseract.TesseractError):
+        asyncio.run(OCRProcessor().ocr_image_async(Image.new("L", (10, 10))))
+
+
+def test_cancelled_ocr_kills_tesseract(tmp_path, monkeypatch, buffer_dir):
+    pid_file = tmp_path / "pid"
+    fake_tesseract(tmp_path, monkeypatch, f'echo $$ > {pid_file}\nexec sleep 30\n')
+
+    async def scenario():
+        task = asyncio.ensure_future(OCRProcessor().ocr_image_async(Image.new("L", (10, 10))))
+        while not pid_file.exists() or not pid_file.read_text().strip():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        pid = int(pid_file.read_text())
+        # The process is killed and reaped
+        for _ in range(100):
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return True
+            await asyncio.sleep(0.01)
+        return False
+
+    assert asyncio.run(scenario())
+    # The page buffer is freed too
+    assert not list(buffer_dir.iterdir())
+
+
+def test_allowed_document_hosts_count_as_cloudinary(monkeypatch):
+    from core.config import settings
+    from utils.ocr_processor import URLHandler
+    assert URLHandler.is_cloudinary_url("https://res.cloudinary.com/demo/raw/upload/a.pdf")
+    assert not URLHandler.is_cloudinary_url("http://127.0.0.1:9100/demo/raw/upload/a.pdf")
+    monkeypatch.setattr(settings, "ALLOWED_DOCUMENT_HOSTS", ["127.0.0.1:9100"])
+    assert URLHandler.is_cloudinary_url("http://127.0.0.1:9100/demo/raw/upload/a.pdf")
+
+
+def test_ocr_image_async_passes_the_page_language(tmp_path, monkeypatch):
+    from core.config import settings
+    from utils.script_detection import record_page_languages
+    fake_tesseract(tmp_path, monkeypatch, 'cat > /dev/null\necho "$3 $4"\n')
+    assert asyncio.run(OCRProcessor().ocr_image_async(Image.new("L", (10, 10)), language="eng+ben")) == "-l eng+ben\n"
+
+    # A blank page has no Bangla headlines: the fast English-only path
+    monkeypatch.setattr(settings, "OCR_LANGUAGES", "auto")
+    with record_page_languages() as languages:
+        assert asyncio.run(OCRProcessor().ocr_image_async(Image.new("L", (10, 10), 255))) == "-l eng\n"
+    assert languages == {"eng": 1}
+
+
+def test_multi_frame_tiff_is_one_page_per_frame():
+    frames = [Image.new("L", (850, 1100), level) for level in (10, 120, 240)]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, "TIFF", save_all=True, append_images=frames[1:])
+    ocr = OCRProcessor()
+
+    assert ocr.inspect_document(buffer.getvalue(), is_pdf=False).pages == 3
+    pages = list(ocr.iter_page_images(buffer.getvalue(), is_pdf=False))
+    assert [page.getpixel((0, 0)) for page in pages] == [10, 120, 240]
+    assert len(ocr.preview_pages(buffer.getvalue(), is_pdf=False, pages=2)) == 2
+
+
+def test_large_jpeg_is_downscaled_while_decoding():
+    buffer = io.BytesIO()
+    Image.new("RGB", (8000, 6000), (200, 180, 160)).save(buffer, "JPEG")
+    ocr = OCRProcessor()
+
+    shape = ocr.inspect_document(buffer.getvalue(), is_pdf=False)
+    [page] = ocr.iter_page_images(buffer.getvalue(), is_pdf=False)
+    assert max(page.size) == MAX_IMAGE_SIDE and page.mode == "L"
+    assert shape.page_pixels == page.width * page.height and shape.bytes_per_pixel == 1
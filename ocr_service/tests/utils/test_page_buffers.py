@@ -0,0 +1,82 @@
+import os
+import subprocess
+
+import pytest
+from PIL import Image
+from prometheus_client import REGISTRY
+
+from core.config import settings
+from utils import page_buffers
+from utils.page_buffers import PageBuffer, sweep_stale_buffers
+
+
+@pytest.fixture
+def buffer_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "PAGE_BUFFER_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_page_is_a_greyscale_pgm_until_released(buffer_dir):
+    image = Image.new("RGB", (30, 20), (255, 0, 0))
+    before = REGISTRY.get_sample_value("ocr_page_buffer_bytes")
+    with PageBuffer.from_image(image) as buffer:
+        assert os.path.dirname(buffer.path) == str(buffer_dir)
+        assert buffer.shape == (20, 30)
+        assert REGISTRY.get_sample_value("ocr_page_buffer_bytes") > before
+        with Image.open(buffer.path) as page:
+            assert page.mode == "L" and page.size == (30, 20)
+            assert page.getpixel((0, 0)) == image.convert("L").getpixel((0, 0))
+    assert not os.path.exists(buffer.path)
+    assert REGISTRY.get_sample_value("ocr_page_buffer_bytes") == before
+    buffer.release()  # releasing twice is harmless
+
+
+def test_falls_back_when_shared_memory_is_full(tmp_path, monkeypatch):
+    full, spare = tmp_path / "shm", tmp_path / "tmp"
+    full.mkdir()
+    spare.mkdir()
+    monkeypatch.setattr(page_buffers, "buffer_dirs", lambda: [str(full), str(spare)])
+    reserve = page_buffers._reserve
+
+    def no_space_in_shm(fd, size):
+        if os.readlink(f"/proc/self/fd/{fd}").startswith(str(full)):
+            raise OSError(28, "No space left on device")
+        reserve(fd, size)
+
+    monkeypatch.setattr(page_buffers, "_reserve", no_space_in_shm)
+    buffer = PageBuffer.from_image(Image.new("L", (10, 10)))
+    try:
+        assert os.path.dirname(buffer.path) == str(spare)
+        assert not list(full.iterdir())
+    finally:
+        buffer.release()
+
+
+def test_falls_back_when_shared_memory_cannot_be_opened(tmp_path, monkeypatch):
+    # e.g. /dev/shm read-only or not writable by the service user
+    spare = tmp_path / "tmp"
+    spare.mkdir()
+    monkeypatch.setattr(page_buffers, "buffer_dirs", lambda: [str(tmp_path / "missing"), str(spare)])
+    with PageBuffer.from_image(Image.new("L", (10, 10))) as buffer:
+        assert os.path.dirname(buffer.path) == str(spare)
+
+
+def test_pixels_are_written_in_bands(buffer_dir, monkeypatch):
+    monkeypatch.setattr(page_buffers, "WRITE_BAND_BYTES", 64)
+    image = Image.linear_gradient("L").resize((50, 37)).convert("P")
+    with PageBuffer.from_image(image) as buffer, Image.open(buffer.path) as page:
+        assert page.tobytes() == image.convert("L").tobytes()
+
+
+def test_sweep_removes_buffers_of_dead_processes(buffer_dir):
+    exited = subprocess.Popen(["true"])
+    exited.wait()
+    stale = buffer_dir / f"ocr-page-{exited.pid}-abc.pgm"
+    stale.write_bytes(b"P5\n1 1\n255\n\0")
+    live = buffer_dir / f"ocr-page-{os.getppid()}-def.pgm"
+    live.write_bytes(b"P5\n1 1\n255\n\0")
+    unrelated = buffer_dir / "other.pgm"
+    unrelated.write_bytes(b"")
+
+    assert sweep_stale_buffers() == 1
+    assert not stale.exists() and live.exists() and unrelated.exists()
@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+from utils.rate_limiter import SharedTokenBucket, RateLimitTimeout
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "budget.sqlite3")
+
+
+def test_budget_is_shared_between_instances(db_path):
+    """Two limiters on the same database behave like two workers sharing a quota"""
+    clock = FakeClock()
+    worker_a = SharedTokenBucket(db_path, requests_per_minute=2, tokens_per_minute=0, clock=clock)
+    worker_b = SharedTokenBucket(db_path, requests_per_minute=2, tokens_per_minute=0, clock=clock)
+    assert worker_a.try_acquire(100) == 0.0
+    assert worker_b.try_acquire(100) == 0.0
+    # Bucket empty: one request refills in 30 seconds at 2 RPM
+    assert worker_a.try_acquire(100) == pytest.approx(30.0)
+
+    clock.now += 30.0
+    assert worker_b.try_acquire(100) == 0.0
+
+
+def test_token_budget_limits_large_calls(db_path):
+    clock = FakeClock()
+    limiter = SharedTokenBucket(db_path, requests_per_minute=0, tokens_per_minute=1000, clock=clock)
+    assert limiter.try_acquire(800) == 0.0
+    assert limiter.try_acquire(400) == pytest.approx(12.0)
+    # Calls larger than the bucket wait for a full bucket instead of forever
+    clock.now += 60.0
+    assert limiter.try_acquire(5000) == 0.0
+
+
+def test_record_actual_refunds_overestimate(db_path):
+    clock = FakeClock()
+    limiter = SharedTokenBucket(db_path, requests_per_minute=0, tokens_per_minute=1000, clock=clock)
+    limiter.try_acquire(1000)
+    limiter.record_actual(estimated_tokens=1000, actual_tokens=300)
+    assert limiter.usage()["tokens"]["available"] == 700.0
+
+
+def test_acquire_times_out_instead_of_failing_later(db_path):
+    limiter = SharedTokenBucket(db_path, requests_per_minute=1, tokens_per_minute=0)
+    asyncio.run(limiter.acquire(10, timeout=1))
+    with pytest.raises(RateLimitTimeout):
+        asyncio.run(limiter.acquire(10, timeout=0.1))
+
+
+def test_disabled_limiter_never_waits(db_path):
+    limiter = SharedTokenBucket(db_path, requests_per_minute=0, tokens_per_minute=0)
+    assert limiter.try_acquire(10**9) == 0.0
+    assert limiter.usage() == {"enabled": False}
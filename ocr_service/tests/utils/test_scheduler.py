@@ -0,0 +1,62 @@
+import asyncio
+from utils.scheduler import FairScheduler, ClientIdentity, identify_client, current_client
+
+PAGE = 1_000_000
+
+
+def run_jobs(scheduler, jobs):
+    """Run (client, pages) jobs page by page and return the order pages were served in"""
+    served = []
+
+    async def job(name, client, pages):
+        for done in range(pages):
+            async with scheduler.slot(PAGE, job_pixels=(pages - done) * PAGE, client=client):
+                served.append(name)
+                await asyncio.sleep(0.001)
+
+    async def scenario():
+        await asyncio.gather(*(job(name, client, pages) for name, client, pages in jobs))
+
+    asyncio.run(scenario())
+    return served
+
+
+def test_small_job_is_not_stuck_behind_a_large_one():
+    backfill = ClientIdentity("backfill")
+    interactive = ClientIdentity("interactive")
+    served = run_jobs(FairScheduler(workers=1), [("large", backfill, 20), ("photo", interactive, 1)])
+    # The photo waits for at most the page already running
+    assert served.index("photo") <= 1
+    assert served.count("large") == 20
+
+
+def test_clients_get_fair_shares_regardless_of_job_count():
+    busy = ClientIdentity("busy")
+    quiet = ClientIdentity("quiet")
+    jobs = [("busy", busy, 20)] * 3 + [("quiet", quiet, 20)]
+    served = run_jobs(FairScheduler(workers=1), jobs)
+    # Fair per client, not per job: about half each rather than 3:1
+    assert 9 <= served[:20].count("quiet") <= 11
+
+
+def test_weights_share_workers_between_clients():
+    heavy = ClientIdentity("heavy", weight=3.0)
+    light = ClientIdentity("light", weight=1.0)
+    jobs = [("heavy", heavy, 20)] * 3 + [("light", light, 20)] * 3
+    served = run_jobs(FairScheduler(workers=1), jobs)
+    assert 14 <= served[:20].count("heavy") <= 16
+
+
+def test_shortest_job_first_within_a_client():
+    client = ClientIdentity("clinic")
+    served = run_jobs(FairScheduler(workers=1), [("long", client, 10), ("short", client, 2)])
+    assert served.index("short") <= 1
+    assert served[:4].count("short") == 2
+
+
+def test_identify_client_prefers_forwarded_user():
+    weights = {"secret-key": 0.5}
+    assert identify_client({"x-api-key": "secret-key", "x-forwarded-user": "42"}, weights) == ClientIdentity("user:42", 0.5)
+    by_key = identify_client({"x-api-key": "secret-key"}, weights)
+    assert by_key.name.startswith("key:") and "secret" not in by_key.name
+    assert identify_client({}) == current_client.get()
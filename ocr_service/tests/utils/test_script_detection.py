@@ -0,0 +1,64 @@
+import random
+
+from PIL import Image, ImageDraw, ImageFont
+
+from utils.script_detection import detect_script, note_page_language, record_page_languages
+
+FONT_SIZE = 36
+
+
+def page(lines, rules=False, seed=0):
+    """
+    An A4 page at 200 DPI with a line of random words per entry of `lines`.
+    No Bangla font is installed, so "ben" lines are Latin words with a
+    headline drawn along their tops, the feature the detector looks for.
+    """
+    rng = random.Random(seed)
+    image = Image.new("L", (1654, 2339), 255)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.truetype("DejaVuSerif.ttf", FONT_SIZE)
+    y = 100
+    for script in lines:
+        x = 100
+        for _ in range(rng.randint(3, 7)):
+            word = "".join(rng.choice("abcdefghiklmnoprstuTEHL") for _ in range(rng.randint(3, 9)))
+            left, top, right, _ = draw.textbbox((x, y), word, font=font)
+            draw.text((x, y), word, fill=0, font=font)
+            if script == "ben":
+                draw.rectangle((left, top + 6, right, top + 9), fill=0)
+            x = right + FONT_SIZE
+        if rules:
+            draw.line((80, y - 15, 1570, y - 15), fill=0, width=3)
+        y += int(FONT_SIZE * 1.8)
+    return image
+
+
+def test_english_page_keeps_the_single_language_path():
+    detection = detect_script(page(["eng"] * 20))
+    assert detection.language == "eng"
+    assert detection.lines == 20 and detection.bangla_lines == 0
+
+
+def test_table_rules_are_not_headlines():
+    assert detect_script(page(["eng"] * 20, rules=True)).language == "eng"
+
+
+def test_bangla_and_mixed_pages():
+    assert detect_script(page(["ben"] * 20)).language == "ben"
+    mixed = detect_script(page(["eng", "ben"] * 10, rules=True))
+    assert mixed.language == "eng+ben"
+    assert mixed.bangla_lines == 10
+
+
+def test_blank_page_is_english():
+    assert detect_script(Image.new("L", (100, 100), 255)).language == "eng"
+
+
+def test_page_languages_are_counted_in_the_block_only():
+    note_page_language("ben")
+    with record_page_languages() as languages:
+        note_page_language("eng")
+        note_page_language("eng")
+        note_page_language("eng+ben")
+    note_page_language("eng")
+    assert languages == {"eng": 2, "eng+ben": 1}
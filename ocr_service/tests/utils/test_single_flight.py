@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from utils.single_flight import SingleFlight, normalize_document_url
+
+
+def test_concurrent_callers_share_one_call():
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def scenario():
+        flights = SingleFlight("test")
+        return await asyncio.gather(*(flights.do("doc", work) for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert calls == 1
+    assert [result for result, _ in results] == ["result"] * 5
+    assert [shared for _, shared in results] == [False, True, True, True, True]
+
+
+def test_errors_reach_every_caller():
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("OCR failed")
+
+    async def scenario():
+        flights = SingleFlight("test")
+        return await asyncio.gather(*(flights.do("doc", failing) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelled_caller_does_not_cancel_shared_call():
+    async def scenario():
+        flights = SingleFlight("test")
+        first = asyncio.ensure_future(flights.do("doc", lambda: asyncio.sleep(0.05, result="done")))
+        second = asyncio.ensure_future(flights.do("doc", lambda: asyncio.sleep(0.05, result="other")))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == ("done", True)
+
+
+def test_call_is_cancelled_when_all_callers_leave():
+    finished = []
+
+    async def work():
+        await asyncio.sleep(0.05)
+        finished.append(True)
+
+    async def scenario():
+        flights = SingleFlight("test")
+        caller = asyncio.ensure_future(flights.do("doc", work))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.sleep(0.1)
+        return flights.in_flight("doc")
+
+    assert asyncio.run(scenario()) is False
+    assert finished == []
+
+
+def test_finished_calls_are_not_cached():
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    async def scenario():
+        flights = SingleFlight("test")
+        await flights.do("doc", work)
+        return await flights.do("doc", work)
+
+    assert asyncio.run(scenario()) == (2, False)
+
+
+def test_normalize_document_url():
+    assert normalize_document_url(
+        "HTTPS://Res.Cloudinary.com/demo/raw/upload/a.pdf?b=2&a=1&fl_attachment=true#page=2"
+    ) == "https://res.cloudinary.com/demo/raw/upload/a.pdf?a=1&b=2"
@@ -0,0 +1,109 @@
+import io
+import json
+import logging
+import sys
+import threading
+
+from utils.structured_logging import JsonFormatter, QueueingStreamHandler, SamplingFilter, parse_sample_rates
+
+
+def make_logger(handler, name="test.structured"):
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+def test_parse_sample_rates_clamps_and_skips_blank_entries():
+    assert parse_sample_rates("uvicorn.access=0.1, utils=2,,bad=") == {"uvicorn.access": 0.1, "utils": 1.0}
+    assert parse_sample_rates("") == {}
+
+
+def test_json_formatter_includes_extras_and_truncates_long_fields():
+    formatter = JsonFormatter(max_field_length=10)
+    record = logging.LogRecord("svc", logging.INFO, "f.py", 3, "x" * 25, None, None)
+    record.document_hash = "abc"
+    record.payload = "y" * 30
+
+    entry = json.loads(formatter.format(record))
+
+    assert entry["level"] == "INFO" and entry["logger"] == "svc" and entry["line"] == 3
+    assert entry["message"] == "x" * 10 + "... [15 more chars]"
+    assert entry["document_hash"] == "abc"
+    assert entry["payload"].startswith("y" * 10 + "...")
+
+
+def test_json_formatter_includes_the_exception():
+    formatter = JsonFormatter()
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord("svc", logging.ERROR, "f.py", 1, "failed", None, None)
+        record.exc_info = sys.exc_info()
+
+    entry = json.loads(formatter.format(record))
+
+    assert "ValueError: boom" in entry["exception"]
+
+
+def test_sampling_filter_uses_the_nearest_configured_logger_and_keeps_warnings(monkeypatch):
+    sampling = SamplingFilter({"uvicorn": 0.0, "uvicorn.error": 1.0})
+
+    def record(name, level=logging.INFO):
+        return logging.LogRecord(name, level, "f.py", 1, "m", None, None)
+
+    assert not sampling.filter(record("uvicorn.access"))
+    assert sampling.filter(record("uvicorn.error"))
+    assert sampling.filter(record("uvicorn.access", logging.WARNING))
+    assert sampling.filter(record("utils.ocr_processor"))
+
+    monkeypatch.setattr("utils.structured_logging.random.random", lambda: 0.3)
+    half = SamplingFilter({"svc": 0.5})
+    assert half.filter(record("svc"))
+    monkeypatch.setattr("utils.structured_logging.random.random", lambda: 0.7)
+    assert not half.filter(record("svc"))
+
+
+def test_queueing_handler_writes_json_lines_from_its_listener_thread():
+    stream = io.StringIO()
+    handler = QueueingStreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    logger = make_logger(handler)
+    try:
+        logger.info("processed %s pages", 3, extra={"document_hash": "abc"})
+        handler.flush()
+    finally:
+        handler.close()
+
+    entry = json.loads(stream.getvalue())
+    assert entry["message"] == "processed 3 pages"
+    assert entry["document_hash"] == "abc"
+
+
+class BlockingStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, text):
+        self.release.wait(5)
+        return super().write(text)
+
+
+def test_queueing_handler_drops_records_instead_of_blocking_when_full():
+    stream = BlockingStream()
+    handler = QueueingStreamHandler(stream, queue_size=2)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger = make_logger(handler, "test.structured.full")
+    try:
+        # The listener takes the first record and blocks writing it; two more
+        # fill the queue and the rest are dropped without waiting
+        for index in range(10):
+            logger.info("record %d", index)
+        assert handler.dropped >= 7
+    finally:
+        stream.release.set()
+        handler.close()
+
+    assert stream.getvalue().startswith("record 0\n")
@@ -0,0 +1,56 @@
+import asyncio
+from utils.warmup import PROBE_TEXT, WarmUp, probe_image
+
+
+class ProbeOCR:
+    def __init__(self, error=None):
+        self.error = error
+        self.images = []
+
+    async def ocr_image_async(self, image):
+        if self.error:
+            raise self.error
+        self.images.append(image)
+        return PROBE_TEXT
+
+
+class FakeAI:
+    gemini_enabled = False
+
+    def __init__(self):
+        self.warmed = False
+
+    def warm_up(self):
+        self.warmed = True
+
+
+def test_warm_up_times_each_step_then_reports_ready():
+    warm_up, ocr, ai = WarmUp(), ProbeOCR(), FakeAI()
+    assert not warm_up.ready
+    asyncio.run(warm_up.run(ocr, ai))
+    assert warm_up.snapshot()["ready"] and warm_up.state == "ready"
+    assert set(warm_up.timings) == {"import:pytesseract", "import:pdf2image", "ocr_probe", "llm_client"}
+    assert ocr.images[0].size == probe_image().size and ai.warmed
+
+
+def test_failed_ocr_probe_leaves_service_ready_but_degraded():
+    warm_up, ai = WarmUp(), FakeAI()
+    asyncio.run(warm_up.run(ProbeOCR(error=FileNotFoundError("tesseract")), ai))
+    assert warm_up.snapshot() == {
+        "ready": True, "state": "degraded", "error": "ocr_probe: tesseract", "timings_ms": warm_up.timings,
+    }
+    # The other steps still ran
+    assert "ocr_probe" not in warm_up.timings and ai.warmed
+
+
+def test_probe_image_without_sized_default_font(monkeypatch):
+    from PIL import ImageFont
+    load_default = ImageFont.load_default
+
+    def old_pillow(**kwargs):
+        if kwargs:
+            raise TypeError("load_default() got an unexpected keyword argument 'size'")
+        return load_default()
+
+    monkeypatch.setattr(ImageFont, "load_default", old_pillow)
+    assert probe_image().getextrema()[0] < 128  # the text was drawn
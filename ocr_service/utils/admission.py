@@ -0,0 +1,193 @@
+"""
+Memory-budget admission control for OCR work.
+
+Rasterized pages are by far the largest allocations in the service, so every
+document reserves its estimated rasterization cost from a process-wide memory
+budget before OCR starts. When the budget is used up, new work waits in a FIFO
+queue for up to a deadline and is then rejected with a suggested retry delay,
+instead of the process being OOM-killed with every in-flight request lost.
+"""
+import asyncio
+import contextlib
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest observation in the seconds-per-byte moving average
+_RATE_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """Raised when work cannot be admitted within the memory budget in time"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, loop: asyncio.AbstractEventLoop, cost: int):
+        self.loop = loop
+        self.cost = cost
+        self.future = loop.create_future()
+        self.granted = False
+        self.reservation_id: Optional[int] = None
+
+
+class MemoryAdmissionController:
+    """
+    FIFO admission against a fixed memory budget, usable from several event loops.
+
+    Reservations are in bytes. A single reservation larger than the whole
+    budget is clamped to the budget, so it still runs, just on its own.
+    """
+
+    def __init__(
+        self,
+        budget_bytes: int,
+        max_wait: float = 10.0,
+        default_retry_after: int = 5,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.budget_bytes = budget_bytes
+        self.max_wait = max_wait
+        self.default_retry_after = default_retry_after
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._waiters: Deque[_Waiter] = deque()
+        # Active reservations: id -> (start time, cost)
+        self._active: Dict[int, tuple] = {}
+        self._next_id = 0
+        # Moving average of how long work holds memory per reserved byte
+        self._seconds_per_byte: Optional[float] = None
+        self.rejected = 0
+
+    def _clamp(self, cost: int) -> int:
+        return max(0, min(int(cost), self.budget_bytes))
+
+    def would_wait(self, cost: int) -> bool:
+        """Whether a reservation of this size would have to queue right now"""
+        with self._lock:
+            return bool(self._waiters) or self._in_use + self._clamp(cost) > self.budget_bytes
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, cost: int) -> AsyncIterator[None]:
+        """
+        Hold cost bytes of the budget for the duration of the block.
+
+        Raises:
+            AdmissionRejected: If the reservation is not granted within max_wait
+        """
+        cost = self._clamp(cost)
+        reservation_id = await self._acquire(cost)
+        try:
+            yield
+        finally:
+            self._release(reservation_id)
+
+    async def _acquire(self, cost: int) -> int:
+        with self._lock:
+            # Queue behind earlier waiters even if this one would fit, so large
+            # documents are not starved by a stream of small ones
+            if not self._waiters and self._in_use + cost <= self.budget_bytes:
+                return self._grant(cost)
+            if self.max_wait <= 0:
+                self.rejected += 1
+                raise AdmissionRejected("Memory budget exhausted", self._retry_after(cost))
+            waiter = _Waiter(asyncio.get_running_loop(), cost)
+            self._waiters.append(waiter)
+            queued = len(self._waiters)
+
+        logger.info(f"Queued OCR work needing {cost / 1_000_000:.1f}MB ({queued} waiting)")
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+            return waiter.reservation_id
+        except asyncio.TimeoutError:
+            with self._lock:
+                if waiter.granted:
+                    # Granted just as the deadline passed
+                    return waiter.reservation_id
+                self._waiters.remove(waiter)
+                self.rejected += 1
+                retry_after = self._retry_after(cost)
+            # A large waiter leaving may let the ones behind it in
+            self._wake_waiters()
+            raise AdmissionRejected(f"Memory budget exhausted for {self.max_wait:g}s", retry_after) from None
+        except BaseException:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._waiters.remove(waiter)
+            if granted:
+                self._release(waiter.reservation_id)
+            else:
+                self._wake_waiters()
+            raise
+
+    def _grant(self, cost: int) -> int:
+        # Called with the lock held
+        self._in_use += cost
+        self._next_id += 1
+        self._active[self._next_id] = (self._clock(), cost)
+        return self._next_id
+
+    def _release(self, reservation_id: int) -> None:
+        with self._lock:
+            started, cost = self._active.pop(reservation_id)
+            self._in_use -= cost
+            if cost:
+                rate = (self._clock() - started) / cost
+                self._seconds_per_byte = rate if self._seconds_per_byte is None else (
+                    _RATE_SMOOTHING * rate + (1 - _RATE_SMOOTHING) * self._seconds_per_byte
+                )
+        self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        with self._lock:
+            while self._waiters and self._in_use + self._waiters[0].cost <= self.budget_bytes:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.reservation_id = self._grant(waiter.cost)
+                waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+
+    def _retry_after(self, cost: int) -> int:
+        """
+        Seconds until enough memory should be free for this request and
+        everything queued before it, from how long reservations usually last.
+        Called with the lock held.
+        """
+        if self._seconds_per_byte is None or not self._active:
+            return self.default_retry_after
+        needed = self._in_use + sum(waiter.cost for waiter in self._waiters) + cost - self.budget_bytes
+        now = self._clock()
+        expected_ends = sorted(
+            (started + self._seconds_per_byte * reserved, reserved) for started, reserved in self._active.values()
+        )
+        freed = 0
+        end = now
+        for end, reserved in expected_ends:
+            freed += reserved
+            if freed >= needed:
+                break
+        return max(1, math.ceil(end - now))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "budget_bytes": self.budget_bytes,
+                "in_use_bytes": self._in_use,
+                "active": len(self._active),
+                "queued": len(self._waiters),
+                "rejected": self.rejected,
+            }
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
@@ -2,67 +2,46 @@ import logging
 import json
 import re
 import os
-from typing import Dict, Any
+import hashlib
+import importlib.util
+import time
+from typing import Dict, Any, Optional
 import asyncio
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-# Try to import Google's Generative AI library
+# Google's Generative AI library takes about half a second to import, so it is
+# only looked up here and imported on first use (see _genai)
 try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
+    GEMINI_AVAILABLE = importlib.util.find_spec("google.generativeai") is not None
 except ImportError:
-    logger.warning("Google Generative AI (Gemini) not available. Install with: pip install google-generativeai")
     GEMINI_AVAILABLE = False
+if not GEMINI_AVAILABLE:
+    logger.warning("Google Generative AI (Gemini) not available. Install with: pip install google-generativeai")
+genai = None
+
+
+def _genai():
+    """The google.generativeai module, imported on first use"""
+    global genai
+    if genai is None:
+        import google.generativeai
+        genai = google.generativeai
+    return genai
 
 # Import settings
 from core.config import settings
-from utils.model_reference import JSON_FORMAT
-
-class AIProcessor:
-    """Class for processing extracted text with AI models"""
-    
-    def __init__(self):
-        """Initialize AI processor with settings"""
-        self.api_key = os.environ.get('GEMINI_API_KEY', settings.GEMINI_API_KEY)
-        self.model_name = settings.GEMINI_MODEL
-        
-        # Configure Google Generative AI if available
-        if GEMINI_AVAILABLE and self.api_key:
-            genai.configure(api_key=self.api_key)
-    
-    def _print_debug_response(self, title, content):
-        """Print debug response if debug mode is enabled."""
-        if settings.DEBUG:
-            print("\n" + "=" * 80)
-            print(f"DEBUG - {title}")
-            print("=" * 80)
-            print(content)
-            print("=" * 80 + "\n")
+from utils.model_reference import RESPONSE_SCHEMA
+from utils.json_repair import parse_partial_json
+from utils.async_bridge import run_sync
+from utils.metrics import track_stage, JSON_DECODE_FAILURES, RULE_FALLBACKS
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from utils.rate_limiter import SharedTokenBucket, RateLimitTimeout, estimate_tokens
 
-    async def process_text_with_ai_async(self, text: str) -> Dict[str, Any]:
-        """
-        Process extracted text with Gemini AI model to structure medical data (async version)
-        
-        Args:
-            text: Raw text extracted from document
-            
-        Returns:
-            Dict: Structured JSON data matching Django model format
-        """
-        if not self.api_key or not GEMINI_AVAILABLE:
-            logger.error("Gemini API key not found or library not available. Using fallback text processing.")
-            # Fallback to non-AI processing
-            return await self.structure_medical_data(text)
-        
-        try:
-            # Debug print - input text
-            self._print_debug_response("INPUT TEXT", text[:500] + "..." if len(text) > 500 else text)
-            
-            # Prepare system prompt for medical data extraction
-            # This now includes specific formatting to match the Django models
-            system_prompt = """
+# Prepare system prompt for medical data extraction
+# This now includes specific formatting to match the Django models
+SYSTEM_PROMPT = """
             You are a medical document analyzer specialized in extracting structured information from lab test results.
             
             Your task is to analyze medical test results and structure the data to match a specific Django model format.
@@ -108,6 +87,146 @@ class AIProcessor:
             
             Make sure to return only valid JSON without any markdown formatting, explanations, or additional text.
             """
+
+# Rule-based confidence scoring: number of parameters at which the parameter
+# score saturates, and the weight of each signal (weights sum to 1.0)
+RULE_EXPECTED_PARAMETERS = 5
+RULE_PARAMETER_WEIGHT = 0.4
+RULE_RANGE_WEIGHT = 0.3
+RULE_TEST_TYPE_WEIGHT = 0.3
+
+def is_out_of_range(value: float, range_value: str) -> bool:
+    """Whether a value falls outside a reference range like "0-100", "< 100" or "> 0" """
+    range_parts = re.findall(r'([<>]?)\s*(\d+\.?\d*)(?:\s*-\s*(\d+\.?\d*))?', range_value)
+    for comparison, min_val, max_val in range_parts:
+        if comparison == "<" and value >= float(min_val):
+            return True
+        elif comparison == ">" and value <= float(min_val):
+            return True
+        elif max_val and (value < float(min_val) or value > float(max_val)):
+            return True
+    return False
+
+
+class GeminiTimeoutError(Exception):
+    """Raised when a Gemini call exceeds settings.GEMINI_TIMEOUT (not the hedge deadline)"""
+
+
+class AIProcessor:
+    """Class for processing extracted text with AI models"""
+    
+    def __init__(self):
+        """Initialize AI processor with settings"""
+        self.api_key = os.environ.get('GEMINI_API_KEY', settings.GEMINI_API_KEY)
+        self.model_name = settings.GEMINI_MODEL
+        
+        # The Gemini client is configured on first use or by warm_up()
+        self._client_configured = False
+        
+        # Skip Gemini entirely while it is failing or slow
+        self.circuit_breaker = CircuitBreaker(
+            name="gemini",
+            failure_rate_threshold=settings.GEMINI_CIRCUIT_FAILURE_RATE,
+            slow_call_seconds=settings.GEMINI_CIRCUIT_SLOW_CALL_SECONDS,
+            slow_call_rate_threshold=settings.GEMINI_CIRCUIT_SLOW_CALL_RATE,
+            window_size=settings.GEMINI_CIRCUIT_WINDOW,
+            min_calls=settings.GEMINI_CIRCUIT_MIN_CALLS,
+            open_seconds=settings.GEMINI_CIRCUIT_OPEN_SECONDS,
+        )
+        
+        # Requests and tokens per minute, shared with the other workers on this host
+        self.rate_limiter = SharedTokenBucket(
+            db_path=settings.GEMINI_RATE_LIMIT_DB,
+            requests_per_minute=settings.GEMINI_RPM_LIMIT,
+            tokens_per_minute=settings.GEMINI_TPM_LIMIT,
+        )
+    
+    def _client(self):
+        """The google.generativeai module, configured with the API key"""
+        client = _genai()
+        if not self._client_configured:
+            client.configure(api_key=self.api_key)
+            self._client_configured = True
+        return client
+    
+    @property
+    def gemini_enabled(self) -> bool:
+        """Whether documents the rules are not confident about go to Gemini"""
+        return bool(self.api_key and GEMINI_AVAILABLE and settings.USE_AI_PROCESSING)
+    
+    def warm_up(self) -> None:
+        """Import and configure the Gemini client ahead of the first request, without calling the API"""
+        if self.gemini_enabled:
+            self._client().GenerativeModel(model_name=self.model_name)
+    
+    @property
+    def stage_version(self) -> str:
+        """
+        Identifies everything that changes the structuring output: model, prompt,
+        response schema and tiering settings. Stored structured results from a
+        different version are considered stale.
+        """
+        prompt_digest = hashlib.sha256(
+            (SYSTEM_PROMPT + json.dumps(RESPONSE_SCHEMA, sort_keys=True)).encode("utf-8")
+        ).hexdigest()[:12]
+        ai_tier = self.model_name if settings.USE_AI_PROCESSING else "rules-only"
+        return f"{ai_tier}:{prompt_digest}:{settings.RULE_CONFIDENCE_THRESHOLD}"
+
+    def _log_debug_response(self, title, content):
+        """Log Gemini input or output at DEBUG level if debug mode is enabled (it is patient data)."""
+        if settings.DEBUG:
+            logger.debug(f"{title}:\n{content}")
+
+    async def process_text_with_ai_async(self, text: str) -> Dict[str, Any]:
+        """
+        Process extracted text with Gemini AI model to structure medical data (async version)
+        
+        Args:
+            text: Raw text extracted from document
+            
+        Returns:
+            Dict: Structured JSON data matching Django model format
+        """
+        if not self.api_key or not GEMINI_AVAILABLE:
+            logger.error("Gemini API key not found or library not available. Using fallback text processing.")
+            # Fallback to non-AI processing
+            RULE_FALLBACKS.labels(reason="fallback").inc()
+            return await self.structure_medical_data(text)
+        
+        try:
+            return await self._extract_with_gemini(text)
+        except Exception as e:
+            # The failure has already been logged, fall back to non-AI processing
+            RULE_FALLBACKS.labels(reason="circuit_open" if isinstance(e, CircuitOpenError) else "fallback").inc()
+            return await self.structure_medical_data(text)
+
+    async def _extract_with_gemini(self, text: str, abandon_at: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Call Gemini and convert its response to the backend format.
+        
+        Unlike process_text_with_ai_async this never falls back to rule-based
+        processing: errors are logged and re-raised so the caller can decide.
+        
+        Args:
+            text: Raw text extracted from document
+            abandon_at: time.monotonic() time at which the caller gives up on the
+                call (the hedge deadline); a call cancelled then counts as slow
+            
+        Returns:
+            Dict: Structured JSON data matching Django model format
+            
+        Raises:
+            CircuitOpenError: If Gemini is currently skipped by the circuit breaker
+        """
+        if not self.circuit_breaker.allow_request():
+            raise CircuitOpenError("Gemini circuit is open")
+        
+        # Every path up to the call's outcome gives the trial slot back if it
+        # ends without recording one (setup errors, quota waits, cancellation)
+        outcome_recorded = False
+        try:
+            # Debug log - input text
+            self._log_debug_response("INPUT TEXT", text[:500] + "..." if len(text) > 500 else text)
             
             # Initialize Gemini model
             generation_config = {
@@ -115,10 +234,11 @@ class AIProcessor:
                 "top_p": 0.8,
                 "top_k": 40,
                 "response_mime_type": "application/json",
+                "response_schema": RESPONSE_SCHEMA,
                 "max_output_tokens": 2048,
             }
             
-            model = genai.GenerativeModel(
+            model = self._client().GenerativeModel(
                 model_name=self.model_name,
                 generation_config=generation_config
             )
@@ -143,39 +263,77 @@ class AIProcessor:
                 },
             ]
             
-            # Call the Gemini API with both system prompt and user content
-            response = model.generate_content(
-                [system_prompt, f"Extract structured medical data from this text:\n\n{text}"],
-                generation_config=generation_config,
-                safety_settings=safety_settings,
+            # Wait for our share of the provider quota before calling
+            contents = [SYSTEM_PROMPT, f"Extract structured medical data from this text:\n\n{text}"]
+            estimated_tokens = estimate_tokens(
+                "".join(contents), generation_config["max_output_tokens"]
             )
+            await self.rate_limiter.acquire(estimated_tokens, timeout=settings.GEMINI_RATE_LIMIT_WAIT)
             
-            # Extract response content
-            response_content = response.text
-            
-            # Debug print - raw response from Gemini
-            self._print_debug_response("RAW GEMINI RESPONSE", response_content)
+            # Call the Gemini API with both system prompt and user content
+            call_started = time.monotonic()
+            try:
+                with track_stage("llm"):
+                    response = await asyncio.wait_for(
+                        model.generate_content_async(
+                            contents,
+                            generation_config=generation_config,
+                            safety_settings=safety_settings,
+                        ),
+                        timeout=settings.GEMINI_TIMEOUT,
+                    )
+            except asyncio.CancelledError:
+                if abandon_at is not None and time.monotonic() >= abandon_at:
+                    # Given up on at the hedge deadline: Gemini was too slow, even if
+                    # under settings.GEMINI_CIRCUIT_SLOW_CALL_SECONDS
+                    self.circuit_breaker.record_abandoned(time.monotonic() - call_started)
+                    outcome_recorded = True
+                # Otherwise cancelled by the caller (e.g. a disconnect), not a Gemini
+                # failure: the slot is released below
+                raise
+            except asyncio.TimeoutError:
+                # A distinct type, so callers can tell it from their own deadlines
+                self.circuit_breaker.record_failure(time.monotonic() - call_started)
+                outcome_recorded = True
+                raise GeminiTimeoutError(f"Gemini did not answer within {settings.GEMINI_TIMEOUT}s") from None
+            except Exception:
+                self.circuit_breaker.record_failure(time.monotonic() - call_started)
+                outcome_recorded = True
+                raise
+            self.circuit_breaker.record_success(time.monotonic() - call_started)
+            outcome_recorded = True
             
-            # Clean up the response to ensure it's valid JSON
-            # Remove code block markers if present
-            response_content = re.sub(r'```(?:json)?\s*|\s*```', '', response_content)
+            try:
+                usage_metadata = getattr(response, "usage_metadata", None)
+                if usage_metadata and usage_metadata.total_token_count:
+                    # SQLite transaction that may wait on other workers' locks: off the event loop
+                    await asyncio.to_thread(
+                        self.rate_limiter.record_actual, estimated_tokens, usage_metadata.total_token_count
+                    )
+            except Exception as e:
+                # Only bookkeeping: the response is already paid for, so it is still used
+                logger.warning(f"Could not record Gemini token usage: {e}")
             
-            # Remove any non-JSON text before or after the JSON object
-            response_content = response_content.strip()
+            # Extract response content
+            response_content = response.text
             
-            # If response doesn't start with {, try to find the JSON object
-            if not response_content.startswith('{'):
-                match = re.search(r'(\{.*\})', response_content, re.DOTALL)
-                if match:
-                    response_content = match.group(1)
-                else:
-                    raise ValueError("Could not find valid JSON in response")
+            # Debug log - raw response from Gemini
+            self._log_debug_response("RAW GEMINI RESPONSE", response_content)
             
-            # Parse the JSON response
-            structured_data = json.loads(response_content)
+            # Parse the JSON response, keeping every complete entry if the output
+            # was truncated or followed by stray text
+            structured_data, complete = parse_partial_json(response_content)
+            if not isinstance(structured_data, dict):
+                # Counted and logged with the other malformed responses below
+                raise json.JSONDecodeError("No JSON object in response", response_content, 0)
+            if not complete:
+                logger.warning(
+                    f"Gemini response was incomplete, recovered "
+                    f"{len(structured_data.get('parameters', []))} complete parameters"
+                )
             
-            # Debug print - parsed JSON
-            self._print_debug_response("PARSED JSON RESPONSE", json.dumps(structured_data, indent=2))
+            # Debug log - parsed JSON
+            self._log_debug_response("PARSED JSON RESPONSE", json.dumps(structured_data, indent=2))
             
             # Convert to format for backend if needed
             backend_format = self._convert_to_backend_format(structured_data)
@@ -183,26 +341,115 @@ class AIProcessor:
             return backend_format
             
         except json.JSONDecodeError as json_err:
+            JSON_DECODE_FAILURES.inc()
             error_msg = f"Error parsing Gemini AI response as JSON: {str(json_err)}"
             logger.error(error_msg)
-            logger.error(f"Raw response received: {response_content[:500]}...")
+            logger.error(f"Raw response had {len(response_content)} characters (logged at DEBUG in debug mode)")
             
-            # Debug print - JSON error
-            self._print_debug_response("JSON DECODE ERROR", 
+            # Debug log - JSON error
+            self._log_debug_response("JSON DECODE ERROR", 
                                 f"Error: {str(json_err)}\n\nRaw response: {response_content}")
-            
-            # Fallback to non-AI processing
-            return await self.structure_medical_data(text)
+            raise
             
         except Exception as e:
             error_msg = f"Error processing text with Gemini AI: {str(e)}"
             logger.exception(error_msg)
             
-            # Debug print - general error
-            self._print_debug_response("PROCESSING ERROR", str(e))
+            # Debug log - general error
+            self._log_debug_response("PROCESSING ERROR", str(e))
+            raise
             
-            # Fallback to non-AI processing
-            return await self.structure_medical_data(text)
+        finally:
+            if not outcome_recorded:
+                self.circuit_breaker.release()
+
+    @staticmethod
+    def _rule_fallback(rule_result: Dict[str, Any], reason: str) -> Dict[str, Any]:
+        """Return the rule-based result where Gemini was needed, recording why"""
+        RULE_FALLBACKS.labels(reason=reason).inc()
+        rule_result["processing_tier"] = f"rules_{reason}"
+        return rule_result
+
+    async def process_text_tiered(self, text: str) -> Dict[str, Any]:
+        """
+        Structure medical data using the cheapest tier that gives a confident result.
+        
+        The rule-based parser always runs first. Gemini is only called when the
+        rule-based confidence is below settings.RULE_CONFIDENCE_THRESHOLD, or when
+        the result is confident but leaves any of settings.AI_FILL_MISSING_FIELDS
+        empty. The tier that produced the result is recorded in "processing_tier":
+        
+        - "rules": rule-based result used as-is
+        - "llm": Gemini result (rule-based confidence too low)
+        - "rules+llm": rule-based result with missing fields filled by Gemini
+        - "rules_fallback": Gemini was needed but failed or is unavailable
+        - "rules_circuit_open": Gemini was needed but skipped by the circuit breaker
+        - "rules_hedged": Gemini missed settings.AI_HEDGE_DEADLINE in hedged mode
+        - "rules_timeout": the Gemini call exceeded settings.GEMINI_TIMEOUT
+        - "rules_rate_limited": no Gemini budget within settings.GEMINI_RATE_LIMIT_WAIT
+        
+        Args:
+            text: Raw text extracted from document
+            
+        Returns:
+            Dict: Structured JSON data matching Django model format
+        """
+        rule_result = await self.structure_medical_data(text)
+        confidence = rule_result["confidence"]
+        
+        if not settings.USE_AI_PROCESSING:
+            rule_result["processing_tier"] = "rules"
+            return rule_result
+        
+        missing_fields = [field for field in settings.AI_FILL_MISSING_FIELDS if not rule_result.get(field)]
+        if confidence >= settings.RULE_CONFIDENCE_THRESHOLD and not missing_fields:
+            logger.info(f"Rule-based confidence {confidence:.2f} meets threshold, skipping AI processing")
+            rule_result["processing_tier"] = "rules"
+            return rule_result
+        
+        if not self.api_key or not GEMINI_AVAILABLE:
+            logger.error("Gemini API key not found or library not available. Using rule-based result.")
+            return self._rule_fallback(rule_result, "fallback")
+        
+        try:
+            if settings.AI_HEDGED_MODE:
+                # The rule-based result is already available, so only wait for
+                # Gemini until the hedge deadline
+                abandon_at = time.monotonic() + settings.AI_HEDGE_DEADLINE
+                ai_result = await asyncio.wait_for(
+                    self._extract_with_gemini(text, abandon_at), timeout=settings.AI_HEDGE_DEADLINE
+                )
+            else:
+                ai_result = await self._extract_with_gemini(text)
+        except CircuitOpenError:
+            logger.info("Gemini circuit is open, using rule-based result")
+            return self._rule_fallback(rule_result, "circuit_open")
+        except RateLimitTimeout:
+            logger.warning("No Gemini budget available in time, using rule-based result")
+            return self._rule_fallback(rule_result, "rate_limited")
+        except GeminiTimeoutError:
+            logger.warning("Gemini call timed out, using rule-based result")
+            return self._rule_fallback(rule_result, "timeout")
+        except asyncio.TimeoutError:
+            # Only the hedge deadline's wait_for raises this; Gemini's own timeout is GeminiTimeoutError
+            logger.warning("Gemini missed the hedge deadline, using rule-based result")
+            return self._rule_fallback(rule_result, "hedged")
+        except Exception:
+            return self._rule_fallback(rule_result, "fallback")
+        
+        if confidence >= settings.RULE_CONFIDENCE_THRESHOLD:
+            # Rules were confident, only take the fields they could not find
+            logger.info(f"Filling missing fields with AI result: {', '.join(missing_fields)}")
+            for field in missing_fields:
+                if ai_result.get(field):
+                    rule_result[field] = ai_result[field]
+            rule_result["processing_tier"] = "rules+llm"
+            return rule_result
+        
+        logger.info(f"Rule-based confidence {confidence:.2f} below threshold, using AI result")
+        ai_result["confidence"] = confidence
+        ai_result["processing_tier"] = "llm"
+        return ai_result
 
     def _convert_to_backend_format(self, ai_output: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -245,7 +492,7 @@ class AIProcessor:
                         param_name = param.get("name")
                         if param_name:
                             test_entry["parameters"][param_name] = {
-                                "value": param.get("value"),
+                                "value": self._coerce_parameter_value(param.get("value"), param.get("data_type")),
                                 "unit": param.get("unit", ""),
                                 "normal_range": param.get("reference_range", ""),
                                 "is_abnormal": param.get("is_abnormal", False),
@@ -261,6 +508,23 @@ class AIProcessor:
             logger.exception(f"Error converting AI output to backend format: {str(e)}")
             return ai_output  # Return the original format if conversion fails
 
+    @staticmethod
+    def _coerce_parameter_value(value: Any, data_type: str) -> Any:
+        """
+        Convert values returned as strings by the response schema back to
+        numbers or booleans according to the parameter's data type.
+        """
+        if not isinstance(value, str):
+            return value
+        if data_type == "numeric":
+            try:
+                return float(value.replace(",", "").strip())
+            except ValueError:
+                return value
+        if data_type == "boolean" and value.strip().lower() in ("true", "false"):
+            return value.strip().lower() == "true"
+        return value
+
     async def structure_medical_data(self, text: str) -> Dict[str, Any]:
         """
         Simple rule-based approach to structure medical data from text
@@ -345,18 +609,7 @@ class AIProcessor:
                 is_numeric = False
             
             # Try to determine if the value is abnormal
-            is_abnormal = False
-            if range_value and is_numeric:
-                # Try to parse range like "0-100" or "< 100" or "> 0"
-                range_parts = re.findall(r'([<>]?)\s*(\d+\.?\d*)(?:\s*-\s*(\d+\.?\d*))?', range_value)
-                if range_parts:
-                    for comparison, min_val, max_val in range_parts:
-                        if comparison == "<" and numeric_value >= float(min_val):
-                            is_abnormal = True
-                        elif comparison == ">" and numeric_value <= float(min_val):
-                            is_abnormal = True
-                        elif max_val and (numeric_value < float(min_val) or numeric_value > float(max_val)):
-                            is_abnormal = True
+            is_abnormal = bool(range_value and is_numeric and is_out_of_range(numeric_value, range_value))
             
             # Create parameter entry
             param_entry = {
@@ -371,13 +624,42 @@ class AIProcessor:
             # Add to the first test (assuming single test for simplicity)
             result["tests"][0]["parameters"][param_name] = param_entry
         
-        logger.info(f"Rule-based processing identified {len(result['tests'][0]['parameters'])} parameters")
+        result["confidence"] = self._score_rule_based_result(result)
+        
+        logger.info(
+            f"Rule-based processing identified {len(result['tests'][0]['parameters'])} parameters "
+            f"(confidence {result['confidence']:.2f})"
+        )
         return result
     
+    @staticmethod
+    def _score_rule_based_result(result: Dict[str, Any]) -> float:
+        """
+        Estimate how trustworthy a rule-based result is, from 0.0 to 1.0.
+        
+        Combines the number of parameters found, the share of parameters with a
+        reference range, and whether a known test type was identified.
+        """
+        parameters = result["tests"][0]["parameters"] if result["tests"] else {}
+        if not parameters:
+            return 0.0
+        
+        parameter_score = min(len(parameters) / RULE_EXPECTED_PARAMETERS, 1.0)
+        range_coverage = sum(1 for param in parameters.values() if param["normal_range"]) / len(parameters)
+        test_type_hit = 1.0 if result["test_type"] in settings.TEST_TYPE_KEYWORDS else 0.0
+        
+        score = (
+            RULE_PARAMETER_WEIGHT * parameter_score
+            + RULE_RANGE_WEIGHT * range_coverage
+            + RULE_TEST_TYPE_WEIGHT * test_type_hit
+        )
+        return round(score, 3)
+    
     def process_text_with_ai(self, text: str) -> Dict[str, Any]:
         """
         Process extracted text with Gemini AI model to structure medical data
-        This function automatically determines if it's in an async context and handles appropriately
+        Synchronous facade for callers without an event loop (Django views, Celery tasks, scripts);
+        the coroutine runs on the shared background event loop
         
         Args:
             text: Raw text extracted from document
@@ -386,31 +668,7 @@ class AIProcessor:
             Dict: Structured JSON data matching Django model format
         """
         try:
-            # Try to get the running event loop
-            import asyncio
-            
-            try:
-                loop = asyncio.get_running_loop()
-                # We're in an async context, so we need to use the async version
-                logger.info("Detected async context, using process_text_with_ai_async")
-                
-                # Since we can't await here directly (this is a sync function),
-                # return a minimal structure
-                logger.warning("Called sync function in async context - returning minimal structure")
-                return {
-                    "test_date": None,
-                    "lab_name": "Warning: AI processing not available in this context",
-                    "test_type": "Unknown",
-                    "tests": []
-                }
-                
-            except RuntimeError:
-                # No running event loop, we're in a sync context
-                # Create a new event loop and run the async function
-                logger.info("No running event loop detected, creating new one")
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                return loop.run_until_complete(self.process_text_with_ai_async(text))
+            return run_sync(self.process_text_with_ai_async(text))
         
         except Exception as e:
             logger.exception(f"Error in process_text_with_ai: {e}")
@@ -432,5 +690,8 @@ async def process_text_with_ai_async(text: str) -> Dict[str, Any]:
 async def structure_medical_data(text: str) -> Dict[str, Any]:
     return await ai_processor.structure_medical_data(text)
 
+async def process_text_tiered(text: str) -> Dict[str, Any]:
+    return await ai_processor.process_text_tiered(text)
+
 def process_text_with_ai(text: str) -> Dict[str, Any]:
     return ai_processor.process_text_with_ai(text)
\ No newline at end of file
@@ -0,0 +1,117 @@
+"""
+Per-stage artifacts of the document pipeline, keyed by document hash.
+
+Each document (SHA-256 of its bytes) gets a directory holding:
+
+- source.json: metadata about the raw bytes (size, type, where they came from)
+- ocr-<version>.json: per-page OCR text for one OCR stage version
+- structured-<ocr version>-<structure version>.json: structured output
+
+A stage is only reused when its stored version matches the current one, so
+changing the Gemini model or prompt re-runs structuring from the stored page
+text without downloading or OCRing the document again.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _version_slug(version: str) -> str:
+    """Short filesystem-safe name for a stage version string"""
+    return hashlib.sha1(version.encode("utf-8")).hexdigest()[:16]
+
+
+class ArtifactStore:
+    """Filesystem store for pipeline stage artifacts"""
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+
+    def _document_dir(self, document_hash: str) -> str:
+        if not all(char in "0123456789abcdef" for char in document_hash) or len(document_hash) != 64:
+            raise ValueError(f"Invalid document hash: {document_hash!r}")
+        return os.path.join(self.root_dir, document_hash[:2], document_hash)
+
+    def _write_json(self, document_hash: str, name: str, payload: Dict[str, Any]) -> None:
+        directory = self._document_dir(document_hash)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial artifact
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as temp_file:
+                json.dump(payload, temp_file)
+            os.replace(temp_path, os.path.join(directory, name))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _read_json(self, document_hash: str, name: str) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self._document_dir(document_hash), name)
+        try:
+            with open(path, encoding="utf-8") as artifact:
+                return json.load(artifact)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable artifact {path}: {e}")
+            return None
+
+    def save_source(self, document_hash: str, metadata: Dict[str, Any]) -> None:
+        """Record metadata about a document's raw bytes (the bytes are not stored)"""
+        self._write_json(document_hash, "source.json", dict(metadata, stored_at=time.time()))
+
+    def load_source(self, document_hash: str) -> Optional[Dict[str, Any]]:
+        return self._read_json(document_hash, "source.json")
+
+    def save_ocr(self, document_hash: str, version: str, pages: List[str]) -> None:
+        self._write_json(document_hash, f"ocr-{_version_slug(version)}.json", {"version": version, "pages": pages})
+
+    def load_ocr(self, document_hash: str, version: str) -> Optional[List[str]]:
+        """Stored page texts for this OCR version, or None if missing or stale"""
+        artifact = self._read_json(document_hash, f"ocr-{_version_slug(version)}.json")
+        if artifact is None or artifact.get("version") != version:
+            return None
+        return artifact["pages"]
+
+    def _structured_name(self, ocr_version: str, structure_version: str) -> str:
+        return f"structured-{_version_slug(ocr_version)}-{_version_slug(structure_version)}.json"
+
+    def save_structured(
+        self, document_hash: str, ocr_version: str, structure_version: str, result: Dict[str, Any]
+    ) -> None:
+        self._write_json(document_hash, self._structured_name(ocr_version, structure_version), {
+            "ocr_version": ocr_version,
+            "structure_version": structure_version,
+            "result": result,
+        })
+
+    def load_structured(
+        self, document_hash: str, ocr_version: str, structure_version: str
+    ) -> Optional[Dict[str, Any]]:
+        """Stored structured output for these stage versions, or None if missing or stale"""
+        artifact = self._read_json(document_hash, self._structured_name(ocr_version, structure_version))
+        if (
+            artifact is None
+            or artifact.get("ocr_version") != ocr_version
+            or artifact.get("structure_version") != structure_version
+        ):
+            return None
+        return artifact["result"]
+
+    def iter_document_hashes(self) -> Iterator[str]:
+        """All documents with stored source metadata"""
+        if not os.path.isdir(self.root_dir):
+            return
+        for prefix in sorted(os.listdir(self.root_dir)):
+            prefix_dir = os.path.join(self.root_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for document_hash in sorted(os.listdir(prefix_dir)):
+                if os.path.exists(os.path.join(prefix_dir, document_hash, "source.json")):
+                    yield document_hash
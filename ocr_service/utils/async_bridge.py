@@ -0,0 +1,98 @@
+"""
+Sync/async bridge backed by a process-wide background event loop.
+
+Synchronous callers (Django views, Celery tasks, scripts) submit coroutines to
+a single event loop running in a daemon thread and block on the result, so no
+event loop has to be created per call and calls from code that already runs
+inside an event loop still get real results.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+from typing import Any, Coroutine, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundEventLoop:
+    """An event loop running forever in a daemon thread, started on first use"""
+
+    def __init__(self, name: str = "async-bridge"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # Threads do not survive fork (e.g. prefork Celery workers), so each
+            # process gets its own loop thread
+            if self._loop is None or self._pid != os.getpid() or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._run_loop, args=(loop,), name=self.name, daemon=True)
+                thread.start()
+                self._loop, self._thread, self._pid = loop, thread, os.getpid()
+                logger.info(f"Started background event loop '{self.name}'")
+            return self._loop
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop) -> None:
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """Schedule a coroutine on the background loop and return a thread-safe future"""
+        loop = self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """
+        Run a coroutine on the background loop and wait for its result.
+
+        Args:
+            coro: Coroutine to run
+            timeout: Seconds to wait before cancelling the coroutine (None waits forever)
+
+        Raises:
+            RuntimeError: If called from the background loop itself, which would deadlock
+            concurrent.futures.TimeoutError: If the coroutine did not finish in time
+        """
+        if self._thread is not None and threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("Cannot block on the background event loop from inside it; await the coroutine instead")
+
+        try:
+            asyncio.get_running_loop()
+            logger.warning("Sync call made from a running event loop; it blocks that loop until the result is ready")
+        except RuntimeError:
+            pass
+
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self) -> None:
+        """Stop the background loop (mainly for tests and shutdown hooks)"""
+        with self._lock:
+            if self._loop is not None and self._pid == os.getpid():
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join(timeout=5)
+            self._loop = self._thread = self._pid = None
+
+
+# Process-wide background loop shared by all sync facades
+background_loop = BackgroundEventLoop()
+
+
+def run_sync(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+    """Run a coroutine from synchronous code on the shared background loop"""
+    return background_loop.run(coro, timeout)
@@ -0,0 +1,171 @@
+"""
+Circuit breaker for calls to slow or failing external services (e.g. Gemini).
+
+The breaker keeps a rolling window of recent call outcomes. It opens when the
+error rate or the share of slow calls in that window crosses a threshold, so
+callers can skip the service and use their fallback right away. After a
+cool-down it goes half-open and lets a few trial calls through to decide
+whether to close again.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is refused because the circuit is open"""
+
+
+class CircuitBreaker:
+    """Error-rate and latency based circuit breaker with closed, open and half-open states"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 10.0,
+        slow_call_rate_threshold: float = 0.5,
+        window_size: int = 20,
+        min_calls: int = 5,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Each outcome is a (failed, slow) tuple
+        self._outcomes = deque(maxlen=window_size)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh_state()
+            return self._state
+
+    def allow_request(self) -> bool:
+        """Return True if a call may go through, reserving a trial slot when half-open"""
+        with self._lock:
+            self._refresh_state()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and self._half_open_in_flight < self.half_open_max_calls:
+                self._half_open_in_flight += 1
+                return True
+            return False
+
+    def record_success(self, duration: float) -> None:
+        """Record a completed call; calls slower than slow_call_seconds count against the service"""
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._half_open_in_flight = max(self._half_open_in_flight - 1, 0)
+                if slow:
+                    self._trip(f"slow trial call ({duration:.1f}s)")
+                    return
+                self._half_open_successes += 1
+                if self._half_open_successes >= self.half_open_max_calls:
+                    self._close()
+                return
+            self._outcomes.append((False, slow))
+            self._evaluate()
+
+    def record_failure(self, duration: float) -> None:
+        """Record a failed call (error, quota rejection or timeout)"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._half_open_in_flight = max(self._half_open_in_flight - 1, 0)
+                self._trip("failed trial call")
+                return
+            self._outcomes.append((True, duration >= self.slow_call_seconds))
+            self._evaluate()
+
+    def record_abandoned(self, duration: float) -> None:
+        """
+        Record a call its caller gave up on for taking too long (e.g. a hedge
+        deadline): a slow call, whatever its duration
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._half_open_in_flight = max(self._half_open_in_flight - 1, 0)
+                self._trip(f"abandoned trial call ({duration:.1f}s)")
+                return
+            self._outcomes.append((False, True))
+            self._evaluate()
+
+    def release(self) -> None:
+        """Give back a trial slot for a call that was cancelled before it finished"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._half_open_in_flight = max(self._half_open_in_flight - 1, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current state and window statistics, for health reporting"""
+        with self._lock:
+            self._refresh_state()
+            calls = len(self._outcomes)
+            snapshot = {
+                "state": self._state,
+                "calls_in_window": calls,
+                "failure_rate": round(self._failure_rate(), 3) if calls else 0.0,
+                "slow_call_rate": round(self._slow_call_rate(), 3) if calls else 0.0,
+            }
+            if self._state == self.OPEN:
+                snapshot["retry_in_seconds"] = round(
+                    max(self._opened_at + self.open_seconds - self._clock(), 0.0), 1
+                )
+            return snapshot
+
+    def _failure_rate(self) -> float:
+        return sum(1 for failed, _ in self._outcomes if failed) / len(self._outcomes)
+
+    def _slow_call_rate(self) -> float:
+        return sum(1 for _, slow in self._outcomes if slow) / len(self._outcomes)
+
+    def _refresh_state(self) -> None:
+        """Move from open to half-open once the cool-down has passed (lock must be held)"""
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            logger.info(f"Circuit '{self.name}' half-open, allowing trial calls")
+            self._state = self.HALF_OPEN
+            self._half_open_in_flight = 0
+            self._half_open_successes = 0
+
+    def _evaluate(self) -> None:
+        """Open the circuit if the window crosses a threshold (lock must be held)"""
+        if len(self._outcomes) < self.min_calls:
+            return
+        failure_rate = self._failure_rate()
+        slow_call_rate = self._slow_call_rate()
+        if failure_rate >= self.failure_rate_threshold:
+            self._trip(f"failure rate {failure_rate:.0%}")
+        elif slow_call_rate >= self.slow_call_rate_threshold:
+            self._trip(f"slow call rate {slow_call_rate:.0%}")
+
+    def _trip(self, reason: str) -> None:
+        logger.warning(f"Circuit '{self.name}' opened: {reason}")
+        self._state = self.OPEN
+        self._opened_at = self._clock()
+        self._outcomes.clear()
+
+    def _close(self) -> None:
+        logger.info(f"Circuit '{self.name}' closed")
+        self._state = self.CLOSED
+        self._outcomes.clear()
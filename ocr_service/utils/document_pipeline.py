@@ -0,0 +1,679 @@
+"""
+Document processing pipeline shared by the blocking and streaming endpoints.
+
+A document goes through three stages: download, page-by-page OCR and
+structuring. When an artifact store is configured, the output of each stage is
+stored per document hash and reused while its stage version is current. A
+document whose layout matches a lab template skips the last two stages.
+Callers can pass an ``emit`` coroutine to receive progress events as each
+stage finishes; without it the pipeline just returns the final result.
+"""
+import asyncio
+import contextlib
+import copy
+import hashlib
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils.ocr_processor import OCRProcessor, Document, DocumentShape, ocr_processor
+from utils.ai_processor import AIProcessor, ai_processor
+from utils.single_flight import SingleFlight, normalize_document_url
+from utils.artifact_store import ArtifactStore
+from utils.admission import AdmissionRejected, MemoryAdmissionController
+from utils.scheduler import FairScheduler
+from utils.job_memory import JobMemoryTracker, job_memory
+from utils.lab_templates import LabTemplate, TemplateRegistry
+from utils.near_duplicates import NearDuplicate, NearDuplicateIndex, hash_document, same_report_text
+from utils.script_detection import record_page_languages
+from utils.metrics import (
+    track_stage, register_queue_depth, CACHE_HITS, DOWNLOADED_BYTES, JOBS_IN_FLIGHT, RULE_FALLBACKS,
+    STRUCTURED_RESULTS,
+)
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Progress callback: emit(event_name, event_data)
+EmitCallback = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+# Tiers whose results are stored and reused. The fallback tiers (rules_*) stand
+# in for a Gemini result that was needed; storing them would keep serving the
+# rule-based result after a short outage until the stage versions change
+STORED_TIERS = frozenset({"rules", "llm", "rules+llm", "template"})
+
+
+class NoTextExtractedError(Exception):
+    """Raised when OCR produced no text for a document"""
+
+
+class DocumentNotFoundError(Exception):
+    """Raised when a document cannot be reprocessed from stored artifacts"""
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a request's deadline passes before any text was extracted"""
+
+
+class _PageTimeout(Exception):
+    """A page's OCR overran its share of the request deadline"""
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left until a time.monotonic() deadline, or None without one"""
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class DocumentPipeline:
+    """Runs download, OCR and structuring for a document"""
+
+    def __init__(
+        self,
+        ocr: OCRProcessor,
+        ai: AIProcessor,
+        store: Optional[ArtifactStore] = None,
+        admission: Optional[MemoryAdmissionController] = None,
+        scheduler: Optional[FairScheduler] = None,
+        memory: Optional[JobMemoryTracker] = None,
+        templates: Optional[TemplateRegistry] = None,
+        near_duplicates: Optional[NearDuplicateIndex] = None,
+    ):
+        self.ocr = ocr
+        self.ai = ai
+        # Optional per-stage checkpoints, so unchanged stages are not re-run
+        self.store = store
+        # Optional memory budget that OCR work must reserve from before rasterizing
+        self.admission = admission
+        # Optional worker slots that each page must hold while it is OCRed, shared
+        # fairly between clients with small jobs first
+        self.scheduler = scheduler
+        # Optional per-job memory instrumentation (peak RSS, image pixels held)
+        self.memory = memory
+        # Optional lab templates: documents in a known layout skip full-page OCR
+        # and structuring, only their value regions are OCRed
+        self.templates = templates
+        # Optional perceptual-hash index: a re-scan of a stored document reuses its
+        # structured result (needs the artifact store)
+        self.near_duplicates = near_duplicates if store else None
+        # Concurrent requests for the same document and patient share one
+        # pipeline run, matched by URL before download and by content hash after
+        # it (the patient scopes near-duplicate lookups, so it is part of the key)
+        self.url_flights = SingleFlight("document URL")
+        self.content_flights = SingleFlight("document content")
+
+    async def process_url(
+        self,
+        document_url: str,
+        emit: Optional[EmitCallback] = None,
+        deadline: Optional[float] = None,
+        patient_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Download a document and extract structured data from it.
+
+        Args:
+            document_url: Cloudinary URL of a PDF or image
+            emit: Optional coroutine receiving progress events
+            deadline: Optional time.monotonic() time by which to return; see
+                _ocr_pages for how it is spread across pages
+            patient_id: Optional patient the document belongs to; near-duplicate
+                lookups only match that patient's earlier documents
+
+        Returns:
+            Dict: Structured data in the OCRResponse format, including raw_text
+        """
+        if deadline is not None:
+            # Results cut short by a deadline are not shared with other callers
+            return await self._download_and_process(document_url, emit, deadline, patient_id)
+        key = normalize_document_url(document_url)
+        if emit and self.url_flights.in_flight((key, patient_id)):
+            await emit("coalesced", {"key": key})
+        result, shared = await self.url_flights.do(
+            (key, patient_id), lambda: self._download_and_process(document_url, emit, patient_id=patient_id)
+        )
+        return self._own_copy(result, shared)
+
+    @staticmethod
+    def _own_copy(result: Dict[str, Any], shared: bool) -> Dict[str, Any]:
+        if not shared:
+            return result
+        # Every caller gets its own copy of a shared result
+        CACHE_HITS.labels(kind="coalesced").inc()
+        return copy.deepcopy(result)
+
+    async def _download_and_process(
+        self,
+        document_url: str,
+        emit: Optional[EmitCallback],
+        deadline: Optional[float] = None,
+        patient_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        try:
+            with track_stage("download"):
+                content, content_type = await asyncio.wait_for(
+                    asyncio.to_thread(self.ocr.download_document, document_url), _remaining(deadline)
+                )
+        except asyncio.TimeoutError:
+            raise DeadlineExceededError("Deadline expired while downloading the document")
+        DOWNLOADED_BYTES.inc(len(content))
+        if emit:
+            await emit("download", {"bytes": len(content), "content_type": content_type})
+
+        return await self.process_content(
+            content, is_pdf=self.ocr.is_pdf(content_type, document_url), emit=emit, source=document_url,
+            deadline=deadline, patient_id=patient_id,
+        )
+
+    async def process_content(
+        self,
+        content: bytes,
+        is_pdf: bool,
+        emit: Optional[EmitCallback] = None,
+        source: Optional[str] = None,
+        deadline: Optional[float] = None,
+        patient_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        OCR document content page by page and structure the extracted text.
+
+        Args:
+            content: Raw PDF or image bytes
+            is_pdf: Whether the content should be processed as a PDF
+            emit: Optional coroutine receiving progress events
+            source: Where the content came from (URL or file name), kept with
+                the stored artifacts so the document can be fetched again
+            deadline: Optional time.monotonic() time by which to return
+            patient_id: Optional patient the document belongs to
+
+        Returns:
+            Dict: Structured data in the OCRResponse format, including raw_text
+        """
+        key = hashlib.sha256(content).hexdigest()
+        if deadline is not None:
+            return await self._process_content(content, is_pdf, key, source, emit, deadline, patient_id)
+        if emit and self.content_flights.in_flight((key, patient_id)):
+            await emit("coalesced", {"key": key})
+        result, shared = await self.content_flights.do(
+            (key, patient_id), lambda: self._process_content(content, is_pdf, key, source, emit, patient_id=patient_id)
+        )
+        return self._own_copy(result, shared)
+
+    async def process_file(
+        self,
+        path: str,
+        is_pdf: bool,
+        document_hash: str,
+        emit: Optional[EmitCallback] = None,
+        source: Optional[str] = None,
+        deadline: Optional[float] = None,
+        patient_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Like process_content, for a document already on disk (e.g. a spooled
+        upload). OCR reads the file directly instead of a copy in memory.
+
+        Args:
+            path: Path of the PDF or image file
+            is_pdf: Whether the file should be processed as a PDF
+            document_hash: SHA-256 of the file, computed while it was written
+            emit: Optional coroutine receiving progress events
+            source: Where the file came from (e.g. the uploaded file name)
+            deadline: Optional time.monotonic() time by which to return
+            patient_id: Optional patient the document belongs to
+
+        Returns:
+            Dict: Structured data in the OCRResponse format, including raw_text
+        """
+        if deadline is not None:
+            return await self._process_content(path, is_pdf, document_hash, source, emit, deadline, patient_id)
+        if emit and self.content_flights.in_flight((document_hash, patient_id)):
+            await emit("coalesced", {"key": document_hash})
+        result, shared = await self.content_flights.do(
+            (document_hash, patient_id),
+            lambda: self._process_content(path, is_pdf, document_hash, source, emit, patient_id=patient_id),
+        )
+        return self._own_copy(result, shared)
+
+    def release_file(
+        self, document_hash: str, cleanup: Callable[[], None], patient_id: Optional[str] = None
+    ) -> None:
+        """
+        Clean up a document file once no pipeline run for its hash and patient
+        is in flight.
+
+        A coalesced run may be reading another caller's copy of the same file,
+        so deleting it must wait until that run has finished.
+        """
+        self.content_flights.call_when_idle((document_hash, patient_id), cleanup)
+
+    async def _process_content(
+        self,
+        document: Document,
+        is_pdf: bool,
+        document_hash: str,
+        source: Optional[str],
+        emit: Optional[EmitCallback],
+        deadline: Optional[float] = None,
+        patient_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        memory = contextlib.nullcontext()
+        if self.memory:
+            size = os.path.getsize(document) if isinstance(document, str) else len(document)
+            memory = self.memory.track_job(document_hash, size, is_pdf)
+        with JOBS_IN_FLIGHT.track_inprogress(), memory:
+            return await self._run_stages(document, is_pdf, document_hash, source, emit, deadline, patient_id)
+
+    async def _run_stages(
+        self,
+        document: Document,
+        is_pdf: bool,
+        document_hash: str,
+        source: Optional[str],
+        emit: Optional[EmitCallback],
+        deadline: Optional[float],
+        patient_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        if self.store:
+            size = os.path.getsize(document) if isinstance(document, str) else len(document)
+            self.store.save_source(document_hash, {"source": source, "size": size, "is_pdf": is_pdf})
+            stored = self._load_structured(document_hash)
+            if stored is not None:
+                logger.info(f"Reusing stored structured result for document {document_hash[:12]}")
+                CACHE_HITS.labels(kind="structured_checkpoint").inc()
+                if emit:
+                    await emit("checkpoint", {"stage": "structured"})
+                return stored
+
+            page_texts = self.store.load_ocr(document_hash, self.ocr.stage_version)
+            if page_texts is not None:
+                logger.info(f"Reusing stored OCR text for document {document_hash[:12]}")
+                CACHE_HITS.labels(kind="ocr_checkpoint").inc()
+                if emit:
+                    await emit("checkpoint", {"stage": "ocr", "pages": len(page_texts)})
+                return await self._structure(document_hash, page_texts, deadline)
+
+        page_hashes, near_duplicates = None, []
+        if self.near_duplicates is not None:
+            page_hashes, near_duplicates = await self._near_duplicate_candidates(
+                document, is_pdf, document_hash, patient_id
+            )
+
+        # An empty registry has nothing to match, so the header is not OCRed
+        if self.templates:
+            structured_data = await self._structure_from_template(document, is_pdf, document_hash, emit, deadline)
+            if structured_data is not None:
+                self._remember_page_hashes(page_hashes, document_hash, patient_id)
+                return structured_data
+
+        with self._trace_allocations("ocr"), record_page_languages() as page_languages:
+            page_texts, skipped_pages, complete = await self._ocr_within_budget(document, is_pdf, emit, deadline)
+        if not complete:
+            if not any(text.strip() for text in page_texts):
+                raise DeadlineExceededError("Deadline expired before any page was OCRed")
+            logger.info(
+                f"Deadline expired for document {document_hash[:12]}: returning partial results "
+                f"({len(page_texts)} pages OCRed, skipped {skipped_pages})"
+            )
+        elif self.store:
+            self.store.save_ocr(document_hash, self.ocr.stage_version, page_texts)
+            if near_duplicates:
+                # Perceptual hashes cannot tell two reports in one layout apart when
+                # only values differ, so the OCR text decides; structuring is skipped
+                structured_data = await self._reuse_near_duplicate(document_hash, page_texts, near_duplicates, emit)
+                if structured_data is not None:
+                    return structured_data
+        structured_data = await self._structure(
+            document_hash, page_texts, deadline, save=complete, page_languages=dict(page_languages)
+        )
+        if not complete:
+            structured_data["partial"] = True
+            structured_data["skipped_pages"] = skipped_pages
+        elif structured_data["processing_tier"] in STORED_TIERS:
+            self._remember_page_hashes(page_hashes, document_hash, patient_id)
+        return structured_data
+
+    async def _near_duplicate_candidates(
+        self, document: Document, is_pdf: bool, document_hash: str, patient_id: Optional[str]
+    ) -> Tuple[Optional[Tuple[int, ...]], List[NearDuplicate]]:
+        """Perceptual hashes of the document's first pages, and earlier documents of the same patient close to them"""
+        try:
+            with track_stage("phash"):
+                page_hashes = await asyncio.to_thread(
+                    hash_document, self.ocr, document, is_pdf, settings.NEAR_DUPLICATE_PAGES
+                )
+        except Exception as e:
+            logger.warning(f"Could not hash document {document_hash[:12]} for near-duplicate lookup: {e}")
+            return None, []
+        candidates = [
+            match for match in self.near_duplicates.find(page_hashes, patient_id)
+            if match.document_hash != document_hash
+        ]
+        return page_hashes, candidates
+
+    async def _reuse_near_duplicate(
+        self,
+        document_hash: str,
+        page_texts: List[str],
+        candidates: List[NearDuplicate],
+        emit: Optional[EmitCallback],
+    ) -> Optional[Dict[str, Any]]:
+        """
+        The stored result of the closest candidate whose OCR text matches this
+        document's (same numbers, nearly the same words), or None
+        """
+        extracted_text = "".join(f"{text}\n" for text in page_texts)
+        for match in candidates:
+            earlier_pages = self.store.load_ocr(match.document_hash, self.ocr.stage_version)
+            stored = self._load_structured(match.document_hash)
+            if earlier_pages is None or stored is None:
+                continue
+            if not same_report_text(extracted_text, "".join(f"{text}\n" for text in earlier_pages)):
+                continue
+            logger.info(
+                f"Document {document_hash[:12]} is a near-duplicate of {match.document_hash[:12]} "
+                f"(distance {match.distance}), reusing its structured result"
+            )
+            CACHE_HITS.labels(kind="near_duplicate").inc()
+            if emit:
+                await emit("near_duplicate", {"document_hash": match.document_hash, "distance": match.distance})
+            structured_data = dict(
+                stored,
+                raw_text=extracted_text,
+                document_hash=document_hash,
+                near_duplicate_of=match.document_hash,
+                near_duplicate_distance=match.distance,
+            )
+            self.store.save_structured(document_hash, self.ocr.stage_version, self.ai.stage_version, structured_data)
+            return structured_data
+        return None
+
+    def _load_structured(self, document_hash: str) -> Optional[Dict[str, Any]]:
+        """The stored structured result of a document, unless it is stale or came from a fallback tier"""
+        stored = self.store.load_structured(document_hash, self.ocr.stage_version, self.ai.stage_version)
+        if stored is None or stored.get("processing_tier") not in STORED_TIERS:
+            # Results stored before fallback tiers were excluded are ignored too
+            return None
+        return stored
+
+    def _remember_page_hashes(
+        self, page_hashes: Optional[Tuple[int, ...]], document_hash: str, patient_id: Optional[str]
+    ) -> None:
+        if page_hashes:
+            self.near_duplicates.add(page_hashes, document_hash, patient_id)
+
+    async def _structure_from_template(
+        self,
+        document: Document,
+        is_pdf: bool,
+        document_hash: str,
+        emit: Optional[EmitCallback],
+        deadline: Optional[float],
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Result through a matching lab template, or None to run the full pipeline.
+
+        The header is matched on a low-resolution preview. Only after a match is
+        the document rasterized in full, under the same memory admission and
+        OCR worker slots as full OCR. Tesseract runs in killed-on-cancel
+        subprocesses, so a deadline or disconnect stops it.
+        """
+        try:
+            with track_stage("template"):
+                matched = await asyncio.wait_for(
+                    self.templates.match_document(self.ocr, document, is_pdf), _remaining(deadline)
+                )
+                if matched is None:
+                    return None
+                template, score = matched
+                structured_data = await asyncio.wait_for(
+                    self._within_budget(
+                        document, is_pdf, emit, deadline,
+                        lambda shape: self.templates.extract(
+                            self.ocr, document, is_pdf, template, score,
+                            page_slot=lambda page: self._worker_slot(shape, page),
+                        ),
+                    ),
+                    _remaining(deadline),
+                )
+        except asyncio.TimeoutError:
+            return None
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.warning(f"Lab template lookup failed, running the full pipeline: {e}")
+            return None
+        if structured_data is None:
+            return None
+
+        STRUCTURED_RESULTS.labels(tier="template").inc()
+        if emit:
+            await emit("template", {"template_id": structured_data["template_id"]})
+        structured_data["document_hash"] = document_hash
+        if self.store:
+            self.store.save_structured(document_hash, self.ocr.stage_version, self.ai.stage_version, structured_data)
+        return structured_data
+
+    async def learn_template(self, document_url: str, confirmed: Dict[str, Any]) -> LabTemplate:
+        """
+        Download a document and learn a lab template from its confirmed extraction
+        (OCRResponse format), so later documents in the same layout take the fast path.
+
+        Raises:
+            TemplateLearningError: If the confirmed values cannot be found in the document
+        """
+        content, content_type = await asyncio.to_thread(self.ocr.download_document, document_url)
+        is_pdf = self.ocr.is_pdf(content_type, document_url)
+        document_hash = hashlib.sha256(content).hexdigest()
+        return await asyncio.to_thread(self.templates.learn, self.ocr, content, is_pdf, confirmed, document_hash)
+
+    async def _ocr_within_budget(
+        self, document: Document, is_pdf: bool, emit: Optional[EmitCallback], deadline: Optional[float] = None
+    ) -> Tuple[List[str], List[int], bool]:
+        return await self._within_budget(
+            document, is_pdf, emit, deadline, lambda shape: self._ocr_pages(document, is_pdf, emit, shape, deadline)
+        )
+
+    async def _within_budget(
+        self,
+        document: Document,
+        is_pdf: bool,
+        emit: Optional[EmitCallback],
+        deadline: Optional[float],
+        work: Callable[[Optional[DocumentShape]], Awaitable[Any]],
+    ) -> Any:
+        """Run work that rasterizes the document, given its shape, within its memory admission reservation"""
+        shape = None
+        if self.admission or self.scheduler or deadline is not None:
+            # Page count and size, read from metadata without rasterizing
+            shape = await asyncio.to_thread(self.ocr.inspect_document, document, is_pdf)
+        if self.admission is None:
+            return await work(shape)
+
+        # Reserve the estimated rasterization memory first; raises AdmissionRejected
+        # if the budget stays exhausted past the admission deadline
+        cost = self.ocr.estimate_memory(document, is_pdf, shape)
+        if emit and self.admission.would_wait(cost):
+            await emit("queued", {"memory_bytes": cost})
+        async with self.admission.reserve(cost):
+            return await work(shape)
+
+    def _trace_allocations(self, stage: str):
+        return self.memory.trace_allocations(stage) if self.memory else contextlib.nullcontext()
+
+    def _worker_slot(self, shape: Optional[DocumentShape], done: int):
+        if self.scheduler is None or shape is None:
+            return contextlib.nullcontext()
+        remaining = max(shape.pages - done, 1)
+        return self.scheduler.slot(shape.page_pixels, job_pixels=remaining * shape.page_pixels)
+
+    async def _next_page(
+        self, images: Iterator[Any], shape: Optional[DocumentShape], done: int, deadline: Optional[float]
+    ) -> Optional[str]:
+        async with self._worker_slot(shape, done):
+            # Rasterizing runs in a worker thread so the event loop stays responsive;
+            # it is bounded by the overall deadline (asyncio.TimeoutError)
+            with track_stage("rasterize"):
+                image = await asyncio.wait_for(asyncio.to_thread(next, images, None), _remaining(deadline))
+            if image is None:
+                return None
+            # Tesseract is a subprocess that is killed on cancellation or when
+            # the page overruns its share of the remaining time
+            pages_left = max(shape.pages - done, 1) if shape else 1
+            page_budget = None if deadline is None else max(_remaining(deadline) / pages_left, 0)
+            try:
+                return await asyncio.wait_for(self.ocr.ocr_image_async(image), page_budget)
+            except asyncio.TimeoutError:
+                raise _PageTimeout() from None
+
+    async def _ocr_pages(
+        self,
+        document: Document,
+        is_pdf: bool,
+        emit: Optional[EmitCallback],
+        shape: Optional[DocumentShape] = None,
+        deadline: Optional[float] = None,
+    ) -> Tuple[List[str], List[int], bool]:
+        """
+        OCR a document page by page.
+
+        With a deadline, each page's OCR may use the remaining time divided by
+        the pages left; a page that overruns its share is skipped (its text is
+        empty) and the next page gets a larger share. Once the deadline itself
+        passes, OCR stops and the pages done so far are returned.
+
+        Returns:
+            Tuple: (page texts, skipped page numbers, True if every page was OCRed)
+        """
+        page_texts: List[str] = []
+        skipped_pages: List[int] = []
+        complete = True
+        images = self.ocr.iter_page_images(document, is_pdf)
+        try:
+            while True:
+                if deadline is not None and _remaining(deadline) <= 0:
+                    complete = False
+                    break
+                page_number = len(page_texts) + 1
+                try:
+                    text = await self._next_page(images, shape, len(page_texts), deadline)
+                except _PageTimeout:
+                    logger.warning(f"Page {page_number} exceeded its share of the deadline, skipping it")
+                    skipped_pages.append(page_number)
+                    page_texts.append("")
+                    if emit:
+                        await emit("page_skipped", {"page": page_number})
+                    continue
+                except asyncio.TimeoutError:
+                    complete = False
+                    break
+                if text is None:
+                    break
+                page_texts.append(text)
+                if emit:
+                    await emit("page", {"page": len(page_texts), "text": text})
+                    # Cheap rule-based pass so clients can render parameters early
+                    partial = await self.ai.structure_medical_data("\n".join(page_texts))
+                    await emit("partial", {
+                        "test_type": partial["test_type"],
+                        "parameters": partial["tests"][0]["parameters"],
+                    })
+        finally:
+            try:
+                images.close()
+            except ValueError:
+                # Cancelled while a worker thread is still inside the generator;
+                # it is released once that page is rasterized
+                pass
+        if not complete and emit:
+            await emit("deadline", {"pages": len(page_texts)})
+        return page_texts, skipped_pages, complete and not skipped_pages
+
+    async def _structure(
+        self,
+        document_hash: str,
+        page_texts: List[str],
+        deadline: Optional[float] = None,
+        save: bool = True,
+        page_languages: Optional[Dict[str, int]] = None,
+    ) -> Dict[str, Any]:
+        extracted_text = "".join(f"{text}\n" for text in page_texts)
+        logger.info(f"Text extraction successful, {len(page_texts)} pages, text length: {len(extracted_text)}")
+        if not extracted_text.strip():
+            raise NoTextExtractedError("Failed to extract any text from the provided document")
+
+        # Rule-based extraction first, AI only when the rules are not confident.
+        # Past the deadline only the rule-based result is used ("rules_deadline")
+        with self._trace_allocations("structure"):
+            try:
+                remaining = _remaining(deadline)
+                if remaining is not None and remaining <= 0:
+                    raise asyncio.TimeoutError()
+                structured_data = await asyncio.wait_for(self.ai.process_text_tiered(extracted_text), remaining)
+            except asyncio.TimeoutError:
+                structured_data = await self.ai.structure_medical_data(extracted_text)
+                structured_data["processing_tier"] = "rules_deadline"
+                RULE_FALLBACKS.labels(reason="deadline").inc()
+        STRUCTURED_RESULTS.labels(tier=structured_data["processing_tier"]).inc()
+        logger.info(f"Structured data produced by tier: {structured_data['processing_tier']}")
+
+        # Add raw text to the response
+        structured_data["raw_text"] = extracted_text
+        structured_data["document_hash"] = document_hash
+        if page_languages:
+            structured_data["ocr_languages"] = page_languages
+        if self.store and save and structured_data["processing_tier"] in STORED_TIERS:
+            self.store.save_structured(document_hash, self.ocr.stage_version, self.ai.stage_version, structured_data)
+        return structured_data
+
+    async def reprocess(self, document_hash: str, emit: Optional[EmitCallback] = None) -> Dict[str, Any]:
+        """
+        Bring a previously processed document up to the current stage versions,
+        resuming from the earliest stage whose stored artifact is stale.
+
+        Structuring is re-run from stored page text when only the structuring
+        stage changed; the document is downloaded again only when the OCR stage
+        changed too.
+
+        Raises:
+            DocumentNotFoundError: If nothing is stored for this document, or it
+                must be re-OCRed but did not come from a URL
+        """
+        source = self.store.load_source(document_hash) if self.store else None
+        if source is None:
+            raise DocumentNotFoundError(f"No stored artifacts for document {document_hash}")
+
+        stored = self._load_structured(document_hash)
+        if stored is not None:
+            return stored
+
+        page_texts = self.store.load_ocr(document_hash, self.ocr.stage_version)
+        if page_texts is not None:
+            logger.info(f"Re-structuring document {document_hash[:12]} from stored OCR text")
+            return await self._structure(document_hash, page_texts)
+
+        document_url = source.get("source") or ""
+        if not document_url.startswith(("http://", "https://")):
+            raise DocumentNotFoundError(f"Document {document_hash} needs OCR but its source cannot be fetched again")
+        logger.info(f"Re-running OCR for document {document_hash[:12]}")
+        return await self.process_url(document_url, emit=emit)
+
+
+# Create a singleton instance of the document pipeline
+document_pipeline = DocumentPipeline(
+    ocr_processor,
+    ai_processor,
+    ArtifactStore(settings.ARTIFACT_DIR) if settings.ARTIFACT_DIR else None,
+    MemoryAdmissionController(settings.OCR_MEMORY_BUDGET_BYTES, max_wait=settings.ADMISSION_MAX_WAIT)
+    if settings.OCR_MEMORY_BUDGET_BYTES > 0 else None,
+    FairScheduler(settings.OCR_WORKERS) if settings.OCR_WORKERS > 0 else None,
+    job_memory,
+    TemplateRegistry(settings.TEMPLATE_DIR, settings.TEMPLATE_MATCH_THRESHOLD) if settings.TEMPLATE_DIR else None,
+    NearDuplicateIndex(
+        os.path.join(settings.ARTIFACT_DIR, "near_duplicates.jsonl"), settings.NEAR_DUPLICATE_MAX_DISTANCE
+    ) if settings.ARTIFACT_DIR and settings.NEAR_DUPLICATE_MAX_DISTANCE > 0 else None,
+)
+if document_pipeline.admission:
+    register_queue_depth("admission", lambda: document_pipeline.admission.snapshot()["queued"])
+if document_pipeline.scheduler:
+    register_queue_depth("scheduler", lambda: document_pipeline.scheduler.snapshot()["queued"])
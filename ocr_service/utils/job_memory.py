@@ -0,0 +1,222 @@
+"""
+Per-job memory instrumentation for the OCR pipeline.
+
+Each document job records:
+
+- peak RSS delta: the highest resident set size seen while the job ran, minus
+  RSS when it started. A background thread samples RSS while jobs are active,
+  so short peaks inside rasterization are caught. Jobs overlap in one process,
+  so a job's delta also includes memory used by concurrent jobs.
+- peak image pixels held: the most rasterized page pixels held at once, as
+  reported by the OCR stage (all pages of small PDFs, one page otherwise).
+- optionally, the top allocation sites per stage from tracemalloc
+  (MEMORY_TRACEMALLOC_TOP). Tracing slows everything down and snapshots are
+  process-wide, so concurrent jobs show up in each other's; debugging only.
+
+Figures are logged and exported as metrics, and the worst jobs by RSS delta are
+kept in a small in-memory buffer for the admin API.
+"""
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, List, Optional
+
+from utils.metrics import JOB_PEAK_IMAGE_PIXELS, JOB_PEAK_RSS_DELTA
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def read_rss_bytes() -> int:
+    """Current resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        # Not Linux: fall back to the lifetime peak (KB on Linux, bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class JobMemory:
+    """Memory figures of one pipeline job"""
+
+    def __init__(self, document_hash: str, size_bytes: int, is_pdf: bool):
+        self.document_hash = document_hash
+        self.size_bytes = size_bytes
+        self.is_pdf = is_pdf
+        self.pages = 0
+        self.started = time.monotonic()
+        self.start_rss = read_rss_bytes()
+        self.peak_rss = self.start_rss
+        self.peak_image_pixels = 0
+        self.allocations: Dict[str, List[str]] = {}
+        self.duration_seconds = 0.0
+
+    @property
+    def peak_rss_delta(self) -> int:
+        return max(self.peak_rss - self.start_rss, 0)
+
+    def observe_rss(self, rss: int) -> None:
+        if rss > self.peak_rss:
+            self.peak_rss = rss
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "document_hash": self.document_hash,
+            "size_bytes": self.size_bytes,
+            "is_pdf": self.is_pdf,
+            "pages": self.pages,
+            "peak_rss_delta_bytes": self.peak_rss_delta,
+            "peak_image_pixels": self.peak_image_pixels,
+            "duration_seconds": round(self.duration_seconds, 3),
+            "allocations": self.allocations,
+        }
+
+
+_current_job: contextvars.ContextVar[Optional[JobMemory]] = contextvars.ContextVar("current_job", default=None)
+
+
+def note_pages_rasterized(pages: int, pixels_held: int) -> None:
+    """
+    Report pages rasterized for the current job, if there is one, and how many
+    page pixels it holds now that they are in memory
+    """
+    job = _current_job.get()
+    if job is not None:
+        job.pages += pages
+        job.peak_image_pixels = max(job.peak_image_pixels, pixels_held)
+
+
+class _RssSampler:
+    """Daemon thread sampling RSS into every active job while there are any"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._jobs: set = set()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def add(self, job: JobMemory) -> None:
+        with self._lock:
+            self._jobs.add(job)
+            # Threads do not survive fork (batch worker processes), so each
+            # process starts its own sampler
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, job: JobMemory) -> None:
+        with self._lock:
+            self._jobs.discard(job)
+        job.observe_rss(read_rss_bytes())
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                jobs = list(self._jobs)
+            if not jobs:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            rss = read_rss_bytes()
+            for job in jobs:
+                job.observe_rss(rss)
+            time.sleep(self.interval)
+
+
+class WorstJobs:
+    """The N jobs with the largest peak RSS delta seen so far"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._heap: List[tuple] = []
+        self._order = itertools.count()
+
+    def add(self, report: Dict[str, Any]) -> None:
+        entry = (report["peak_rss_delta_bytes"], next(self._order), dict(report, finished_at=time.time()))
+        with self._lock:
+            if len(self._heap) < self.capacity:
+                heapq.heappush(self._heap, entry)
+            elif entry[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [report for _, _, report in sorted(self._heap, reverse=True)]
+
+
+class JobMemoryTracker:
+    """Tracks the memory of pipeline jobs, exporting and retaining the results"""
+
+    def __init__(self, sample_interval: float = 0.05, keep_worst: int = 20, tracemalloc_top: int = 0):
+        self._sampler = _RssSampler(sample_interval)
+        self.worst_jobs = WorstJobs(keep_worst)
+        # Top-N allocation sites per stage; 0 disables tracemalloc
+        self.tracemalloc_top = tracemalloc_top
+
+    @contextlib.contextmanager
+    def track_job(self, document_hash: str, size_bytes: int, is_pdf: bool) -> Iterator[JobMemory]:
+        """Record the memory of the job run inside the block"""
+        job = JobMemory(document_hash, size_bytes, is_pdf)
+        token = _current_job.set(job)
+        self._sampler.add(job)
+        try:
+            yield job
+        finally:
+            self._sampler.remove(job)
+            _current_job.reset(token)
+            job.duration_seconds = time.monotonic() - job.started
+            JOB_PEAK_RSS_DELTA.observe(job.peak_rss_delta)
+            JOB_PEAK_IMAGE_PIXELS.observe(job.peak_image_pixels)
+            self.worst_jobs.add(job.report())
+            logger.info(
+                f"Job {document_hash[:12]} memory: peak RSS +{job.peak_rss_delta / 1_000_000:.1f}MB, "
+                f"peak image pixels {job.peak_image_pixels / 1_000_000:.1f}M, {job.pages} pages, "
+                f"{job.size_bytes / 1_000_000:.1f}MB input"
+            )
+
+    @contextlib.contextmanager
+    def trace_allocations(self, stage: str) -> Iterator[None]:
+        """
+        With tracemalloc enabled, log the top allocation sites that grew during
+        the block and attach them to the current job. A no-op otherwise.
+        """
+        if not self.tracemalloc_top:
+            yield
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        try:
+            yield
+        finally:
+            after = tracemalloc.take_snapshot()
+            top = [
+                str(stat) for stat in after.compare_to(before, "lineno")[:self.tracemalloc_top] if stat.size_diff > 0
+            ]
+            logger.info(f"Top allocations during {stage}:\n" + "\n".join(top))
+            job = _current_job.get()
+            if job is not None:
+                job.allocations[stage] = top
+
+
+# Create a singleton instance of the memory tracker
+job_memory = JobMemoryTracker(
+    sample_interval=settings.MEMORY_SAMPLE_INTERVAL,
+    keep_worst=settings.MEMORY_WORST_JOBS,
+    tracemalloc_top=settings.MEMORY_TRACEMALLOC_TOP,
+)
@@ -0,0 +1,173 @@
+"""
+Tolerant JSON parsing for LLM output.
+
+LLM responses are sometimes truncated at the output token limit, wrapped in
+code fences or followed by stray text. Instead of discarding the whole response
+when json.loads fails, this parser recovers every value that was completely
+written: objects keep the members read so far, arrays keep their complete
+elements and drop a trailing partial one (e.g. a half-written parameter entry).
+"""
+import json
+import re
+from typing import Any, List, Tuple
+
+_NUMBER_RE = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?')
+_LITERALS = {"true": True, "false": False, "null": None}
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class _Incomplete(Exception):
+    """Internal signal: the input ended (or broke) in the middle of a value"""
+
+    def __init__(self, partial: Any = None):
+        self.partial = partial
+
+
+class _PartialParser:
+    """Recursive-descent JSON parser that returns what it could read on truncation"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def _skip_whitespace(self) -> None:
+        while self.pos < len(self.text) and self.text[self.pos] in ' \t\r\n':
+            self.pos += 1
+
+    def _peek(self) -> str:
+        self._skip_whitespace()
+        if self.pos >= len(self.text):
+            raise _Incomplete()
+        return self.text[self.pos]
+
+    def parse_value(self) -> Any:
+        char = self._peek()
+        if char == '{':
+            return self._parse_object()
+        if char == '[':
+            return self._parse_array()
+        if char == '"':
+            return self._parse_string()
+        return self._parse_scalar()
+
+    def _parse_object(self) -> dict:
+        result = {}
+        self.pos += 1
+        try:
+            while True:
+                char = self._peek()
+                if char == '}':
+                    self.pos += 1
+                    return result
+                if char == ',':
+                    # Tolerate leading and trailing commas
+                    self.pos += 1
+                    continue
+                if char != '"':
+                    raise _Incomplete()
+                key = self._parse_string()
+                if self._peek() != ':':
+                    raise _Incomplete()
+                self.pos += 1
+                try:
+                    result[key] = self.parse_value()
+                except _Incomplete as incomplete:
+                    # Keep partially read containers, drop partial scalars
+                    if isinstance(incomplete.partial, (dict, list)):
+                        result[key] = incomplete.partial
+                    raise
+        except _Incomplete:
+            raise _Incomplete(result)
+
+    def _parse_array(self) -> list:
+        result: List[Any] = []
+        self.pos += 1
+        try:
+            while True:
+                char = self._peek()
+                if char == ']':
+                    self.pos += 1
+                    return result
+                if char == ',':
+                    self.pos += 1
+                    continue
+                # A partially written element is dropped
+                result.append(self.parse_value())
+        except _Incomplete:
+            raise _Incomplete(result)
+
+    def _parse_string(self) -> str:
+        chars = []
+        self.pos += 1
+        text = self.text
+        while self.pos < len(text):
+            char = text[self.pos]
+            if char == '"':
+                self.pos += 1
+                return ''.join(chars)
+            if char == '\\':
+                if self.pos + 1 >= len(text):
+                    break
+                escape = text[self.pos + 1]
+                if escape == 'u':
+                    code = text[self.pos + 2:self.pos + 6]
+                    if len(code) < 4:
+                        break
+                    try:
+                        chars.append(chr(int(code, 16)))
+                    except ValueError:
+                        raise _Incomplete()
+                    self.pos += 6
+                    continue
+                chars.append(_ESCAPES.get(escape, escape))
+                self.pos += 2
+                continue
+            chars.append(char)
+            self.pos += 1
+        raise _Incomplete()
+
+    def _parse_scalar(self) -> Any:
+        text = self.text
+        for literal, value in _LITERALS.items():
+            if text.startswith(literal, self.pos):
+                self.pos += len(literal)
+                return value
+            if literal.startswith(text[self.pos:]):
+                # Literal cut off at the end of the input
+                raise _Incomplete()
+        match = _NUMBER_RE.match(text, self.pos)
+        if not match:
+            raise _Incomplete()
+        self.pos = match.end()
+        if self.pos >= len(text) or text[self.pos] not in ',}] \t\r\n':
+            # Cut off at the end ("14" of "14.5") or mid-number ("14." or "1e")
+            raise _Incomplete()
+        number = match.group(0)
+        if any(marker in number for marker in '.eE'):
+            return float(number)
+        return int(number)
+
+
+def parse_partial_json(text: str) -> Tuple[Any, bool]:
+    """
+    Parse the first JSON object or array in text, recovering from truncation.
+
+    Args:
+        text: Raw model output, possibly with code fences or trailing text
+
+    Returns:
+        Tuple: (parsed value, True if the value was complete)
+
+    Raises:
+        json.JSONDecodeError: If the text contains no JSON object or array at all
+    """
+    starts = [index for index in (text.find('{'), text.find('[')) if index >= 0]
+    if not starts:
+        raise json.JSONDecodeError("No JSON object found", text, 0)
+    parser = _PartialParser(text)
+    parser.pos = min(starts)
+    try:
+        return parser.parse_value(), True
+    except _Incomplete as incomplete:
+        return incomplete.partial, False
+
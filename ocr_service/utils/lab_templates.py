@@ -0,0 +1,547 @@
+"""
+Lab templates: a fast path for reports in a layout seen before.
+
+Most documents come from a few labs whose reports all share one layout. A
+template records where the values sit in such a layout. When a document
+matches a template, only those value regions are OCRed. The values are mapped
+straight into tests[].parameters, with no full-page OCR and no Gemini call.
+
+- Fingerprint: the words of the first page's header band (HEADER_BAND), each
+  with its cell on a GRID x GRID grid. The registry key is the lab name line
+  (the first header line with a lab keyword), the test title line (the first
+  header line with a test type keyword) and the page's aspect ratio.
+  The positioned words are the anchors that a document must share with a
+  template. Only the header band of a low-resolution (HEADER_DPI) preview of
+  the first page is OCRed to compute it.
+- Learning: from a document and its confirmed extraction. Each confirmed
+  value is looked up among the words OCRed from the document, preferably on
+  a line with its parameter's name. The template keeps a region around it
+  and its label (the words left of it on its line).
+- Matching: a template matches when at least `match_threshold` of its
+  anchors are in the document, within one grid cell. Header words that vary
+  (patient name, sample id) are anchors too, so the threshold must stay
+  below 1. Only then is the document rasterized in full to read the value
+  regions. A value is only used if its label is on its line, since other
+  reports from the same lab share the header. If any value cannot be read
+  this way, the document goes through the full pipeline.
+
+Templates are stored as JSON files in a directory (TEMPLATE_DIR).
+"""
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, AsyncContextManager, Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+from core.config import settings
+from utils.ai_processor import is_out_of_range
+from utils.metrics import TEMPLATE_LOOKUPS
+from utils.ocr_processor import Box, Document, WordBox
+
+logger = logging.getLogger(__name__)
+
+HEADER_BAND: Box = (0.0, 0.0, 1.0, 0.25)
+# Resolution of the first-page preview whose header band is OCRed for matching
+HEADER_DPI = 150
+GRID = 40
+LAB_KEYWORDS = ("lab", "laboratory", "clinic", "hospital", "medical", "healthcare", "diagnostic")
+# A value region extends this many word heights above and below the learned value
+REGION_PAD_Y = 0.6
+# ... and this many word heights (at least one value width) to each side
+REGION_PAD_X = 3.0
+
+_NUMBER = re.compile(r"[<>]?(\d+(?:\.\d+)?)")
+_DATE = re.compile(r"\d{4}[-/]\d{1,2}[-/]\d{1,2}")
+_EDGE_PUNCTUATION = "()[]:;,*"
+_TEST_TITLE = re.compile(
+    r"\b(?:" + "|".join(
+        re.escape(keyword) for keywords in settings.TEST_TYPE_KEYWORDS.values() for keyword in keywords
+    ) + r")\b"
+)
+
+Anchor = Tuple[str, int, int]
+
+
+class TemplateLearningError(Exception):
+    """Raised when a confirmed extraction cannot be located in its document"""
+
+
+class LayoutFingerprint(NamedTuple):
+    key: str
+    anchors: FrozenSet[Anchor]
+
+
+@dataclass
+class ValueRegion:
+    """Where one value sits on the page, and what the template knows about it"""
+    name: str
+    page: int  # 0-based
+    box: Box  # region that is OCRed
+    center: Tuple[float, float]  # position of the learned value
+    label: List[str] = field(default_factory=list)  # anchor tokens left of the value on its line
+    test: int = 0  # index in tests[]
+    unit: str = ""
+    normal_range: str = ""
+    code: str = ""
+
+
+@dataclass
+class LabTemplate:
+    template_id: str
+    key: str
+    anchors: List[Anchor]
+    lab_name: Optional[str]
+    test_type: Optional[str]
+    tests: List[Dict[str, Any]]  # test_type and metadata of each entry in tests[]
+    regions: List[ValueRegion]
+    date_region: Optional[ValueRegion] = None
+    source: Optional[str] = None  # document the template was learned from
+    created_at: float = field(default_factory=time.time)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LabTemplate":
+        def region(entry):
+            return ValueRegion(**dict(entry, box=tuple(entry["box"]), center=tuple(entry["center"])))
+
+        return cls(**dict(
+            data,
+            anchors=[tuple(anchor) for anchor in data["anchors"]],
+            regions=[region(entry) for entry in data["regions"]],
+            date_region=region(data["date_region"]) if data.get("date_region") else None,
+        ))
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "template_id": self.template_id,
+            "lab_name": self.lab_name,
+            "test_type": self.test_type,
+            "parameters": [region.name for region in self.regions],
+            "pages": max(region.page for region in self.regions) + 1,
+            "source": self.source,
+            "created_at": self.created_at,
+        }
+
+
+def parse_number(text: str) -> Optional[float]:
+    """The value of a word that is a number (thousands separators and flags like "*" allowed)"""
+    match = _NUMBER.fullmatch(text.strip(_EDGE_PUNCTUATION).replace(",", ""))
+    return float(match.group(1)) if match else None
+
+
+def _parse_date(text: str) -> Optional[str]:
+    text = text.strip(_EDGE_PUNCTUATION)
+    return text.replace("/", "-") if _DATE.fullmatch(text) else None
+
+
+def _anchor_token(text: str) -> Optional[str]:
+    """Lower-cased letters of a word, for words without digits and of three letters or more"""
+    if any(char.isdigit() for char in text):
+        return None
+    token = re.sub(r"[^\w]|_", "", text.lower())
+    return token if len(token) >= 3 else None
+
+
+def _cell(x: float, y: float) -> Tuple[int, int]:
+    return min(int(x * GRID), GRID - 1), min(int(y * GRID), GRID - 1)
+
+
+def _center(word: WordBox) -> Tuple[float, float]:
+    return (word.left + word.right) / 2, (word.top + word.bottom) / 2
+
+
+def _lines(words: Iterable[WordBox]) -> List[List[WordBox]]:
+    """Words grouped by text line, top to bottom"""
+    lines: Dict[int, List[WordBox]] = {}
+    for word in words:
+        lines.setdefault(word.line, []).append(word)
+    return sorted(lines.values(), key=lambda line: min(word.top for word in line))
+
+
+def fingerprint(words: Iterable[WordBox], aspect_ratio: float) -> LayoutFingerprint:
+    """
+    Layout fingerprint of a page from its words (those outside HEADER_BAND
+    are ignored) and its height / width ratio
+    """
+    header = [word for word in words if word.top < HEADER_BAND[3]]
+    anchors = set()
+    for word in header:
+        token = _anchor_token(word.text)
+        if token:
+            anchors.add((token, *_cell(*_center(word))))
+
+    lines = _lines(header)
+    lab_line = next(
+        (line for line in lines if any(keyword in word.text.lower() for word in line for keyword in LAB_KEYWORDS)),
+        lines[0] if lines else [],
+    )
+    # Reports of different tests from one lab share the lab line, not the title
+    title_line = next(
+        (
+            line for line in lines
+            if line is not lab_line and _TEST_TITLE.search(" ".join(word.text.lower() for word in line))
+        ),
+        [],
+    )
+    lab_tokens, title_tokens = (
+        " ".join(token for token in map(_anchor_token, (word.text for word in line)) if token)
+        for line in (lab_line, title_line)
+    )
+    key = hashlib.sha1(f"{aspect_ratio:.1f}|{lab_tokens}|{title_tokens}".encode("utf-8")).hexdigest()[:16]
+    return LayoutFingerprint(key, frozenset(anchors))
+
+
+def anchor_score(template_anchors: Iterable[Anchor], document_anchors: FrozenSet[Anchor]) -> float:
+    """Share of a template's anchors found in a document, within one grid cell"""
+    cells: Dict[str, List[Tuple[int, int]]] = {}
+    for token, x, y in document_anchors:
+        cells.setdefault(token, []).append((x, y))
+    template_anchors = list(template_anchors)
+    if not template_anchors:
+        return 0.0
+    found = sum(
+        any(abs(x - cx) <= 1 and abs(y - cy) <= 1 for cx, cy in cells.get(token, ()))
+        for token, x, y in template_anchors
+    )
+    return found / len(template_anchors)
+
+
+def _region_around(word: WordBox, page: int, name: str, label: Iterable[WordBox] = ()) -> ValueRegion:
+    """Region around a value word, widened to the left to take in its label words"""
+    label = list(label)
+    width, height = word.right - word.left, word.bottom - word.top
+    pad_x, pad_y = max(width, REGION_PAD_X * height), REGION_PAD_Y * height
+    left = min([word.left - pad_x] + [label_word.left for label_word in label])
+    box = (
+        max(left, 0.0), max(word.top - pad_y, 0.0),
+        min(word.right + pad_x, 1.0), min(word.bottom + pad_y, 1.0),
+    )
+    tokens = [token for token in map(_anchor_token, (label_word.text for label_word in label)) if token]
+    return ValueRegion(name, page, box, _center(word), label=tokens)
+
+
+def _label_words(word: WordBox, words: List[WordBox]) -> List[WordBox]:
+    """The words left of a value on its line that have an anchor token"""
+    return [
+        other for other in words
+        if other.line == word.line and other.right <= word.left and _anchor_token(other.text)
+    ]
+
+
+def _locate_value(name: str, value: float, page_words: List[List[WordBox]]) -> Optional[ValueRegion]:
+    """Region of the word holding a value, preferring one on a line with the parameter's name"""
+    name_tokens = {token for token in map(_anchor_token, name.split()) if token}
+    fallback = None
+    for page, words in enumerate(page_words):
+        line_tokens: Dict[int, set] = {}
+        for word in words:
+            line_tokens.setdefault(word.line, set()).add(_anchor_token(word.text))
+        for word in words:
+            number = parse_number(word.text)
+            if number is None or not math.isclose(number, value, abs_tol=1e-9):
+                continue
+            if name_tokens & line_tokens[word.line]:
+                return _region_around(word, page, name, _label_words(word, words))
+            fallback = fallback or _region_around(word, page, name, _label_words(word, words))
+    return fallback
+
+
+def learn_template(
+    page_words: List[List[WordBox]],
+    aspect_ratio: float,
+    confirmed: Dict[str, Any],
+    source: Optional[str] = None,
+) -> LabTemplate:
+    """
+    Build a template from the words OCRed on each page of a document and the
+    confirmed extraction of that document (in the OCRResponse format).
+
+    Raises:
+        TemplateLearningError: If the extraction has no numeric parameters, or a
+            value cannot be found among the words
+    """
+    regions, missing = [], []
+    for test_index, test in enumerate(confirmed.get("tests") or []):
+        for name, parameter in (test.get("parameters") or {}).items():
+            value = parameter.get("value")
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                missing.append(f"{name} (not numeric)")
+                continue
+            region = _locate_value(name, float(value), page_words)
+            if region is None:
+                missing.append(name)
+                continue
+            if not region.label:
+                # Without a label, a value cannot be told apart from another
+                # report's value in the same place
+                missing.append(f"{name} (no label on its line)")
+                continue
+            region.test = test_index
+            region.unit = parameter.get("unit") or ""
+            region.normal_range = parameter.get("normal_range") or ""
+            region.code = parameter.get("code") or "".join(word[0] for word in name.split()).upper()
+            regions.append(region)
+    if missing:
+        raise TemplateLearningError(f"Parameters not found in the document: {', '.join(missing)}")
+    if not regions:
+        raise TemplateLearningError("The confirmed extraction has no parameters")
+
+    date_region = None
+    if confirmed.get("test_date"):
+        date_words = (
+            (page, word) for page, words in enumerate(page_words) for word in words
+            if _parse_date(word.text) == confirmed["test_date"]
+        )
+        page, word = next(date_words, (None, None))
+        if word is not None:
+            date_region = _region_around(word, page, "test_date")
+
+    layout = fingerprint(page_words[0], aspect_ratio)
+    template_id = hashlib.sha1(
+        f"{layout.key}|{sorted(layout.anchors)}|{[region.name for region in regions]}".encode("utf-8")
+    ).hexdigest()[:16]
+    return LabTemplate(
+        template_id=template_id,
+        key=layout.key,
+        anchors=sorted(layout.anchors),
+        lab_name=confirmed.get("lab_name"),
+        test_type=confirmed.get("test_type"),
+        tests=[
+            {"test_type": test.get("test_type"), "metadata": test.get("metadata") or {}}
+            for test in confirmed["tests"]
+        ],
+        regions=regions,
+        date_region=date_region,
+        source=source,
+    )
+
+
+def _read_nearest(
+    words: List[WordBox], center: Tuple[float, float], parse, label: Iterable[str] = ()
+) -> Tuple[Any, Optional[str]]:
+    """
+    The parsed value of the readable word nearest to where the learned value
+    was, if every token of `label` is on that word's line
+    """
+    readable = [(word, parse(word.text)) for word in words]
+    readable = [(word, value) for word, value in readable if value is not None]
+    if not readable:
+        return None, None
+    word, value = min(readable, key=lambda item: math.dist(_center(item[0]), center))
+    line_tokens = {_anchor_token(other.text) for other in words if other.line == word.line}
+    if not set(label) <= line_tokens:
+        return None, None
+    return value, word.text
+
+
+def build_result(template: LabTemplate, readings: Dict[str, List[WordBox]], score: float) -> Optional[Dict[str, Any]]:
+    """
+    Structured result from the words OCRed in each of a template's regions
+    (keyed by region name), or None if a value could not be read or its label
+    is not on its line
+    """
+    tests = [
+        {"test_type": test["test_type"], "parameters": {}, "metadata": test["metadata"]}
+        for test in template.tests
+    ]
+    lines = []
+    for region in template.regions:
+        if not region.label:
+            # Learned before labels were stored
+            logger.info(f"Template {template.template_id}: no label for {region.name}, relearn the template")
+            return None
+        value, text = _read_nearest(readings.get(region.name, []), region.center, parse_number, region.label)
+        if value is None:
+            logger.info(f"Template {template.template_id}: no labelled value read for {region.name}")
+            return None
+        tests[region.test]["parameters"][region.name] = {
+            "value": value,
+            "unit": region.unit,
+            "normal_range": region.normal_range,
+            "is_abnormal": bool(region.normal_range and is_out_of_range(value, region.normal_range)),
+            "code": region.code,
+            "data_type": "numeric",
+        }
+        lines.append(f"{region.name}: {text} {region.unit}".rstrip())
+
+    test_date = None
+    if template.date_region:
+        test_date, text = _read_nearest(
+            readings.get(template.date_region.name, []), template.date_region.center, _parse_date
+        )
+        if test_date:
+            lines.insert(0, f"Date: {text}")
+    return {
+        "test_date": test_date,
+        "lab_name": template.lab_name,
+        "test_type": template.test_type,
+        "tests": tests,
+        "confidence": round(score, 3),
+        "processing_tier": "template",
+        "template_id": template.template_id,
+        # Only the value regions were OCRed, so this is their text, not the page's
+        "raw_text": "".join(f"{line}\n" for line in lines),
+    }
+
+
+@contextlib.asynccontextmanager
+async def _no_slot():
+    yield
+
+
+class TemplateRegistry:
+    """Lab templates stored as JSON files in a directory, indexed by fingerprint key"""
+
+    def __init__(self, root_dir: str, match_threshold: float = 0.7):
+        self.root_dir = root_dir
+        self.match_threshold = match_threshold
+        self._lock = threading.Lock()
+        self._templates: Dict[str, LabTemplate] = {}
+        self._by_key: Dict[str, List[LabTemplate]] = {}
+        if os.path.isdir(root_dir):
+            for name in sorted(os.listdir(root_dir)):
+                if name.endswith(".json"):
+                    self._load(os.path.join(root_dir, name))
+
+    def _load(self, path: str) -> None:
+        try:
+            with open(path, encoding="utf-8") as template_file:
+                self._index(LabTemplate.from_dict(json.load(template_file)))
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable lab template {path}: {e}")
+
+    def _index(self, template: LabTemplate) -> None:
+        self._unindex(template.template_id)
+        self._templates[template.template_id] = template
+        self._by_key.setdefault(template.key, []).append(template)
+
+    def _unindex(self, template_id: str) -> Optional[LabTemplate]:
+        template = self._templates.pop(template_id, None)
+        if template is not None:
+            self._by_key[template.key].remove(template)
+        return template
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def templates(self) -> List[LabTemplate]:
+        with self._lock:
+            return list(self._templates.values())
+
+    def add(self, template: LabTemplate) -> None:
+        """Store a template, replacing one with the same id"""
+        os.makedirs(self.root_dir, exist_ok=True)
+        # Write to a temp file and rename so a restart never loads a partial template
+        fd, temp_path = tempfile.mkstemp(dir=self.root_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as temp_file:
+                json.dump(asdict(template), temp_file)
+            os.replace(temp_path, os.path.join(self.root_dir, f"{template.template_id}.json"))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        with self._lock:
+            self._index(template)
+
+    def remove(self, template_id: str) -> bool:
+        with self._lock:
+            template = self._unindex(template_id)
+        if template is None:
+            return False
+        try:
+            os.unlink(os.path.join(self.root_dir, f"{template_id}.json"))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def match(self, layout: LayoutFingerprint) -> Optional[Tuple[LabTemplate, float]]:
+        """The best template with the layout's key and its anchor score, if it reaches the threshold"""
+        with self._lock:
+            candidates = list(self._by_key.get(layout.key, ()))
+        scored = [(template, anchor_score(template.anchors, layout.anchors)) for template in candidates]
+        best = max(scored, key=lambda item: item[1], default=None)
+        return best if best and best[1] >= self.match_threshold else None
+
+    def learn(self, ocr, document: Document, is_pdf: bool, confirmed: Dict[str, Any],
+              source: Optional[str] = None) -> LabTemplate:
+        """OCR a document's pages with word positions, learn a template from its confirmed extraction and store it"""
+        page_words, aspect_ratio = [], None
+        for image in ocr.iter_page_images(document, is_pdf):
+            aspect_ratio = aspect_ratio or image.height / image.width
+            page_words.append(ocr.ocr_words(image))
+        if not page_words:
+            raise TemplateLearningError("The document has no pages")
+        template = learn_template(page_words, aspect_ratio, confirmed, source)
+        self.add(template)
+        logger.info(
+            f"Learned lab template {template.template_id} with {len(template.regions)} value regions "
+            f"from document {(source or '')[:12]}"
+        )
+        return template
+
+    async def match_document(self, ocr, document: Document, is_pdf: bool) -> Optional[Tuple[LabTemplate, float]]:
+        """
+        The template a document's layout matches, with its anchor score. Only a
+        HEADER_DPI preview of the first page is rasterized and only its header
+        band is OCRed, so a miss (the common case) costs little.
+        """
+        previews = await asyncio.to_thread(ocr.preview_pages, document, is_pdf, 1, HEADER_DPI)
+        if not previews:
+            return None
+        first = previews[0]
+        words = await ocr.ocr_words_async(first, HEADER_BAND)
+        matched = self.match(fingerprint(words, first.height / first.width))
+        if matched is None:
+            TEMPLATE_LOOKUPS.labels(outcome="miss").inc()
+        return matched
+
+    async def extract(
+        self,
+        ocr,
+        document: Document,
+        is_pdf: bool,
+        template: LabTemplate,
+        score: float,
+        page_slot: Optional[Callable[[int], AsyncContextManager]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Structured result of a document through a template it matched, OCRing
+        only the value regions. None if a value could not be read.
+
+        Pages are rasterized one at a time, each inside page_slot(page index)
+        when given (e.g. an OCR worker slot).
+        """
+        regions_by_page: Dict[int, List[ValueRegion]] = {}
+        for region in list(template.regions) + ([template.date_region] if template.date_region else []):
+            regions_by_page.setdefault(region.page, []).append(region)
+
+        readings: Dict[str, List[WordBox]] = {}
+        images = ocr.iter_page_images(document, is_pdf)
+        try:
+            for page in range(max(regions_by_page, default=-1) + 1):
+                async with (page_slot(page) if page_slot else _no_slot()):
+                    image = await asyncio.to_thread(next, images, None)
+                    if image is None:
+                        # The document is shorter than the template
+                        break
+                    for region in regions_by_page.get(page, ()):
+                        readings[region.name] = await ocr.ocr_words_async(image, region.box, single_line=True)
+        finally:
+            try:
+                images.close()
+            except ValueError:
+                # Cancelled while a worker thread is still inside the generator
+                pass
+
+        result = build_result(template, readings, score)
+        TEMPLATE_LOOKUPS.labels(outcome="hit" if result else "unreadable").inc()
+        if result:
+            logger.info(f"Document matched lab template {template.template_id} (anchor score {score:.2f})")
+        return result
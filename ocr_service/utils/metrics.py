@@ -0,0 +1,103 @@
+"""
+Prometheus metrics for the document pipeline, exposed on /metrics.
+
+Label values come from small fixed sets (stage names, processing tiers, cache
+kinds), never from URLs, document hashes or client ids, so the number of time
+series stays bounded.
+"""
+import contextlib
+import time
+from typing import Callable, Iterator
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+from utils.server_timing import record_stage
+
+# Stages: download, rasterize, preprocess, ocr_page, llm
+STAGE_SECONDS = Histogram(
+    "ocr_stage_duration_seconds",
+    "Time spent in each pipeline stage (ocr_page and rasterize are per page)",
+    ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+RULE_FALLBACKS = Counter(
+    "ocr_rule_fallbacks_total",
+    "Results that fell back to the rule-based parser when Gemini was needed, by reason",
+    ["reason"],
+)
+STRUCTURED_RESULTS = Counter(
+    "ocr_structured_results_total",
+    "Structured results by the tier that produced them",
+    ["tier"],
+)
+TEMPLATE_LOOKUPS = Counter(
+    "ocr_template_lookups_total",
+    "Lab template lookups by outcome (hit, miss, unreadable: matched but a value could not be read)",
+    ["outcome"],
+)
+OCR_PAGE_LANGUAGES = Counter(
+    "ocr_page_languages_total",
+    "Pages OCRed by Tesseract language (eng, ben, eng+ben, or OCR_LANGUAGES when fixed)",
+    ["language"],
+)
+JSON_DECODE_FAILURES = Counter(
+    "ocr_llm_json_decode_failures_total",
+    "Gemini responses that contained no parseable JSON",
+)
+CACHE_HITS = Counter(
+    "ocr_cache_hits_total",
+    "Work avoided by reusing a checkpoint or joining an in-flight run",
+    ["kind"],
+)
+DOWNLOADED_BYTES = Counter(
+    "ocr_downloaded_bytes_total",
+    "Bytes of documents downloaded",
+)
+JOBS_IN_FLIGHT = Gauge(
+    "ocr_jobs_in_flight",
+    "Documents currently being OCRed or structured",
+)
+PAGE_BUFFER_BYTES = Gauge(
+    "ocr_page_buffer_bytes",
+    "Bytes of page images held in shared-memory buffers for tesseract",
+)
+QUEUE_DEPTH = Gauge(
+    "ocr_queue_depth",
+    "Work waiting for capacity, by queue (admission: memory budget, scheduler: OCR workers)",
+    ["queue"],
+)
+JOB_PEAK_RSS_DELTA = Histogram(
+    "ocr_job_peak_rss_delta_bytes",
+    "Peak growth of the process RSS while a job ran (includes concurrent jobs)",
+    buckets=(10e6, 25e6, 50e6, 100e6, 250e6, 500e6, 1e9, 2e9, 4e9),
+)
+JOB_PEAK_IMAGE_PIXELS = Histogram(
+    "ocr_job_peak_image_pixels",
+    "Most rasterized page pixels a job held at once",
+    buckets=(1e6, 5e6, 10e6, 25e6, 50e6, 100e6, 250e6, 500e6, 1e9),
+)
+
+
+@contextlib.contextmanager
+def track_stage(stage: str) -> Iterator[None]:
+    """
+    Record the wall time of a block (sync or async code) as a pipeline stage,
+    in the stage histogram and in the current request's Server-Timing header
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage=stage).observe(elapsed)
+        record_stage(stage, elapsed)
+
+
+def register_queue_depth(queue: str, depth: Callable[[], float]) -> None:
+    """Report a queue's depth from a callback evaluated at scrape time"""
+    QUEUE_DEPTH.labels(queue=queue).set_function(depth)
+
+
+def render_metrics() -> tuple:
+    """Metrics in the Prometheus text format, as (body, content type)"""
+    return generate_latest(), CONTENT_TYPE_LATEST
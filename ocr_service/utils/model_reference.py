@@ -117,4 +117,53 @@ JSON_FORMAT = {
         "test_date": "2025-04-27",
         "patient_info": {}
     }
-}
\ No newline at end of file
+}
+
+# Fields whose type cannot be inferred from the JSON_FORMAT example because the
+# model may return different types (numeric, text, boolean or categorical values)
+RESPONSE_SCHEMA_OVERRIDES = {
+    "parameters.value": {
+        "type": "string",
+        "nullable": True,
+        "description": "Measured value; numbers are written as plain decimals (e.g. 14.5)",
+    },
+    "parameters.reference_range": {
+        "type": "object",
+        "nullable": True,
+        "properties": {
+            "min": {"type": "number", "nullable": True},
+            "max": {"type": "number", "nullable": True},
+            "text": {"type": "string", "nullable": True},
+        },
+    },
+}
+
+
+def build_response_schema(example, path=""):
+    """
+    Derive a Gemini response schema (OpenAPI subset) from an example structure.
+    
+    Empty objects are left out because Gemini rejects objects without properties.
+    """
+    if path in RESPONSE_SCHEMA_OVERRIDES:
+        return RESPONSE_SCHEMA_OVERRIDES[path]
+    if isinstance(example, dict):
+        properties = {}
+        for key, value in example.items():
+            if isinstance(value, dict) and not value:
+                continue
+            properties[key] = build_response_schema(value, f"{path}.{key}" if path else key)
+        return {"type": "object", "properties": properties}
+    if isinstance(example, list):
+        return {"type": "array", "items": build_response_schema(example[0], path)}
+    if isinstance(example, bool):
+        return {"type": "boolean", "nullable": True}
+    if isinstance(example, int):
+        return {"type": "integer", "nullable": True}
+    if isinstance(example, float):
+        return {"type": "number", "nullable": True}
+    return {"type": "string", "nullable": True}
+
+
+# Schema passed to Gemini so its output is constrained to the JSON_FORMAT structure
+RESPONSE_SCHEMA = build_response_schema(JSON_FORMAT)
@@ -0,0 +1,206 @@
+"""
+Near-duplicate detection for documents uploaded again as a new scan or photo.
+
+A re-scan has different bytes, so the exact-hash checkpoints miss it. Each
+document therefore gets a perceptual hash (pHash) of each of its first pages:
+
+1. The page is turned upright (EXIF), converted to greyscale,
+   auto-contrasted, cropped to its content (ignoring scan margins) and
+   shrunk to 32x32.
+2. Its 2D DCT is computed with NumPy.
+3. Each of the 64 lowest-frequency coefficients (top-left 8x8) gives one bit,
+   set when the coefficient is above their median.
+
+The hash barely changes with resolution, JPEG compression, brightness or
+noise. Two documents are near-duplicates when every hashed page differs in
+at most max_distance bits (Hamming distance).
+
+Lookups do not compare a hash with every entry. A 64-bit hash is split into
+max_distance + 1 bands. Two hashes within max_distance bits agree on at
+least one band (pigeonhole), so only entries sharing a band with the first
+page are compared.
+
+Reports from the same lab that differ only in their values hash just as
+close as a re-scan (a few bits), and no image comparison tells them apart
+reliably once scanning noise is added. A hash match therefore only names
+candidates. The document is still OCRed. The earlier result is reused, saving
+structuring and the Gemini call, only if same_report_text() finds the same
+numbers in both OCR texts.
+
+Entries are scoped by patient. A lookup with a patient id only sees that
+patient's documents. A lookup without one only sees unscoped documents. One
+patient therefore never gets another patient's result.
+
+The index is an append-only JSON lines file next to the stored artifacts.
+"""
+import difflib
+import functools
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+# Share of words two OCR texts of the same report must have in common
+MIN_TEXT_SIMILARITY = 0.9
+
+HASH_SIZE = 8  # bits per side of the hash: 64 bits
+DCT_SIZE = 32  # side of the shrunk page the DCT runs on
+HASH_BITS = HASH_SIZE * HASH_SIZE
+CONTENT_LEVEL = 160  # pixels darker than this (after auto-contrast) are page content
+
+
+class NearDuplicate(NamedTuple):
+    document_hash: str
+    distance: int
+
+
+@functools.lru_cache(maxsize=None)
+def _dct_matrix(size: int) -> np.ndarray:
+    """Orthonormal DCT-II matrix: coefficients = M @ signal"""
+    k = np.arange(size)[:, None]
+    i = np.arange(size)[None, :]
+    matrix = np.sqrt(2 / size) * np.cos(np.pi * (2 * i + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+def normalize_page(image: Image.Image) -> Image.Image:
+    """Upright, auto-contrasted greyscale page cropped to its dark content"""
+    image = ImageOps.autocontrast(ImageOps.exif_transpose(image).convert("L"))
+    content = image.point(lambda value: 255 if value < CONTENT_LEVEL else 0).getbbox()
+    return image.crop(content) if content else image
+
+
+def phash(image: Image.Image) -> int:
+    """64-bit perceptual hash of a page image"""
+    image = normalize_page(image).resize((DCT_SIZE, DCT_SIZE), Image.Resampling.LANCZOS)
+    pixels = np.asarray(image, dtype=np.float64)
+    dct = _dct_matrix(DCT_SIZE)
+    low = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE]
+    bits = (low > np.median(low)).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def document_distance(a: Sequence[int], b: Sequence[int]) -> Optional[int]:
+    """Largest page distance between two documents' hashes; None if they hashed a different number of pages"""
+    if len(a) != len(b) or not a:
+        return None
+    return max(hamming(x, y) for x, y in zip(a, b))
+
+
+def _bands(max_distance: int) -> List[Tuple[int, int]]:
+    """(shift, mask) of each band, max_distance + 1 bands covering the 64 bits"""
+    count = min(max_distance + 1, HASH_BITS)
+    bands, start = [], 0
+    for index in range(count):
+        width = HASH_BITS // count + (1 if index < HASH_BITS % count else 0)
+        bands.append((start, (1 << width) - 1))
+        start += width
+    return bands
+
+
+class _Entry(NamedTuple):
+    hashes: Tuple[int, ...]
+    document_hash: str
+    scope: Optional[str]
+
+
+class NearDuplicateIndex:
+    """Perceptual hashes of processed documents, searchable by Hamming distance"""
+
+    def __init__(self, path: Optional[str], max_distance: int = 6):
+        self.path = path
+        self.max_distance = max_distance
+        self._bands = _bands(max_distance)
+        self._lock = threading.Lock()
+        self._entries: List[_Entry] = []
+        self._known = set()
+        # One dict per band: band value -> indexes of entries with it
+        self._band_index: List[Dict[int, List[int]]] = [{} for _ in self._bands]
+        if path and os.path.exists(path):
+            self._load(path)
+
+    def _load(self, path: str) -> None:
+        with open(path, encoding="utf-8") as index_file:
+            for line in index_file:
+                try:
+                    record = json.loads(line)
+                    self._insert(_Entry(tuple(int(h, 16) for h in record["hashes"]),
+                                        record["document_hash"], record.get("scope")))
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.warning(f"Ignoring bad near-duplicate index line in {path}: {e}")
+
+    def _insert(self, entry: _Entry) -> bool:
+        key = (entry.document_hash, entry.scope)
+        if key in self._known:
+            return False
+        self._known.add(key)
+        self._entries.append(entry)
+        for (shift, mask), index in zip(self._bands, self._band_index):
+            index.setdefault((entry.hashes[0] >> shift) & mask, []).append(len(self._entries) - 1)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, hashes: Sequence[int], document_hash: str, scope: Optional[str] = None) -> None:
+        """Remember a processed document's page hashes (once per document and scope)"""
+        entry = _Entry(tuple(hashes), document_hash, scope)
+        if not entry.hashes:
+            return
+        with self._lock:
+            if not self._insert(entry) or not self.path:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as index_file:
+                index_file.write(json.dumps({
+                    "hashes": [f"{h:016x}" for h in entry.hashes],
+                    "document_hash": document_hash,
+                    "scope": scope,
+                }) + "\n")
+
+    def find(self, hashes: Sequence[int], scope: Optional[str] = None) -> List[NearDuplicate]:
+        """Documents in the same scope within max_distance of these hashes, closest first"""
+        if not hashes:
+            return []
+        with self._lock:
+            candidates = set()
+            for (shift, mask), index in zip(self._bands, self._band_index):
+                candidates.update(index.get((hashes[0] >> shift) & mask, ()))
+            entries = [self._entries[i] for i in candidates]
+        matches = []
+        for entry in entries:
+            if entry.scope != scope:
+                continue
+            distance = document_distance(hashes, entry.hashes)
+            if distance is not None and distance <= self.max_distance:
+                matches.append(NearDuplicate(entry.document_hash, distance))
+        return sorted(matches, key=lambda match: (match.distance, match.document_hash))
+
+
+def hash_document(ocr, document, is_pdf: bool, pages: int) -> Tuple[int, ...]:
+    """Perceptual hashes of a document's first pages, from low-resolution previews"""
+    return tuple(phash(image) for image in ocr.preview_pages(document, is_pdf, pages)[:pages])
+
+
+def same_report_text(text: str, earlier_text: str) -> bool:
+    """
+    Whether two OCR texts are of the same report: the same numbers in the same
+    order, and nearly the same words (OCR of a re-scan misreads a few letters)
+    """
+    if _NUMBER.findall(text) != _NUMBER.findall(earlier_text):
+        return False
+    matcher = difflib.SequenceMatcher(None, text.split(), earlier_text.split(), autojunk=False)
+    return matcher.ratio() >= MIN_TEXT_SIMILARITY
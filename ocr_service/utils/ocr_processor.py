@@ -0,0 +1,518 @@
+import asyncio
+import functools
+import logging
+import os
+import requests
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+from io import BytesIO
+from PIL import Image, ImageSequence
+from pdf2image import convert_from_bytes, convert_from_path, pdfinfo_from_bytes, pdfinfo_from_path
+from urllib.parse import urlparse
+
+from utils.metrics import track_stage
+from utils.job_memory import job_memory, note_pages_rasterized
+from utils.script_detection import detect_script, note_page_language
+from utils.page_buffers import PageBuffer
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Constants
+REQUEST_TIMEOUT = 360  # 3 minutes for downloading files
+LARGE_FILE_THRESHOLD = 5_000_000  # 5MB threshold for large files
+TESSERACT_CONFIG = r'--oem 3 --psm 6'
+# Lab template value regions hold a single line of text
+REGION_TESSERACT_CONFIG = r'--oem 3 --psm 7'
+RASTER_DPI = 200  # pdf2image's default resolution, made explicit for memory estimates
+PREVIEW_DPI = 50  # enough for perceptual hashes of a page
+# Long side of decoded photos and scans (an A4 page at 300 DPI); larger ones
+# are downscaled while decoding where the format allows it (JPEG)
+MAX_IMAGE_SIDE = 3508
+# Used when a PDF's page size cannot be read: A4 at RASTER_DPI
+DEFAULT_PAGE_SIZE_PTS = (595.0, 842.0)
+# Tesseract keeps its own copies of the page being recognized (grey, binarized)
+OCR_WORKING_SET_FACTOR = 2
+# Bump when rasterization or OCR changes so stored page text is recomputed
+OCR_STAGE_VERSION = f"tesseract-v2 {TESSERACT_CONFIG} -l {settings.OCR_LANGUAGES}"
+
+# A document is either its raw bytes or the path of a file holding them
+Document = Union[bytes, str]
+
+class DocumentShape(NamedTuple):
+    """Size of a document once rasterized, estimated from its metadata"""
+    pages: int
+    page_pixels: int
+    bytes_per_pixel: int
+
+# A page region as fractions of the page: (left, top, right, bottom)
+Box = Tuple[float, float, float, float]
+FULL_PAGE: Box = (0.0, 0.0, 1.0, 1.0)
+
+class WordBox(NamedTuple):
+    """A recognized word and its position, as fractions of the page size"""
+    text: str
+    left: float
+    top: float
+    right: float
+    bottom: float
+    line: int  # words on the same text line share this number
+
+# URL Handler class - simplified for Cloudinary only
+class URLHandler:
+    @staticmethod
+    def is_cloudinary_url(url):
+        """Check if a URL is from Cloudinary (or one of ALLOWED_DOCUMENT_HOSTS)."""
+        parsed_url = urlparse(url)
+        hostname = parsed_url.netloc
+        if hostname.lower() in settings.ALLOWED_DOCUMENT_HOSTS:
+            return True
+        return hostname == 'cloudinary.com' or hostname.endswith('.cloudinary.com')
+
+    @staticmethod
+    def get_cloudinary_direct_url(url):
+        """
+        Get direct access URL for Cloudinary images.
+        Add fl_attachment to prevent transformations that might affect OCR quality.
+        """
+        if '?' in url:
+            return f"{url}&fl_attachment=true&fl_sanitize=true"
+        else:
+            return f"{url}?fl_attachment=true&fl_sanitize=true"
+
+# OCR Processor class - simplified for Cloudinary only
+class OCRProcessor:
+    stage_version = OCR_STAGE_VERSION
+
+    def __init__(self):
+        self.url_handler = URLHandler()
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        }
+
+    def get_image_from_url(self, url):
+        """Get image from Cloudinary URL."""
+        logger.info("Processing Cloudinary URL")
+        direct_url = URLHandler.get_cloudinary_direct_url(url)
+        response = requests.get(direct_url, headers=self.headers, timeout=REQUEST_TIMEOUT)
+
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch image from URL: HTTP {response.status_code}")
+
+        return Image.open(BytesIO(response.content))
+
+    def download_document(self, url: str) -> Tuple[bytes, str]:
+        """
+        Download a document from a Cloudinary URL.
+
+        Returns:
+            Tuple: (file content, lower-cased content type)
+        """
+        # Handle Cloudinary URL
+        if not URLHandler.is_cloudinary_url(url):
+            logger.warning("URL is not from Cloudinary, but processing anyway")
+
+        logger.info("Processing Cloudinary URL")
+        processed_url = URLHandler.get_cloudinary_direct_url(url)
+
+        # Check if the file is large before downloading
+        try:
+            head_response = requests.head(processed_url, headers=self.headers, timeout=10)
+            content_length = int(head_response.headers.get('content-length', 0))
+
+            if content_length > LARGE_FILE_THRESHOLD:
+                logger.info(f"Warning: Large file detected ({content_length/1_000_000:.2f}MB). Processing may take longer.")
+
+        except Exception as e:
+            logger.warning(f"Could not get content length: {e}")
+
+        # Download the file from the provided URL
+        response = requests.get(processed_url, headers=self.headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch file from URL: HTTP {response.status_code}")
+
+        return response.content, response.headers.get('content-type', '').lower()
+
+    @staticmethod
+    def is_pdf(content_type: str, url: str) -> bool:
+        """Determine if a downloaded document is a PDF."""
+        return 'pdf' in content_type or url.lower().endswith('.pdf')
+
+    def page_language(self, image: Image.Image) -> str:
+        """Tesseract language string for a page (see OCR_LANGUAGES)"""
+        if settings.OCR_LANGUAGES != "auto":
+            return settings.OCR_LANGUAGES
+        language = detect_script(image).language
+        if language != "eng" and "ben" not in _installed_languages():
+            logger.warning("Page looks Bangla but the tesseract ben model is not installed; using eng")
+            return "eng"
+        return language
+
+    def ocr_image(self, image: Image.Image, language: Optional[str] = None) -> str:
+        """Run Tesseract OCR on a single page image (in its detected language unless given)."""
+        import pytesseract  # Imported on first use, it pulls in numpy (and pandas if installed)
+
+        with track_stage("preprocess"):
+            language = language or self.page_language(image)
+            buffer = PageBuffer.from_image(image)
+        try:
+            with track_stage("ocr_page"):
+                text = pytesseract.image_to_string(buffer.path, lang=language, config=TESSERACT_CONFIG)
+        finally:
+            buffer.release()
+        note_page_language(language)
+        return text
+
+    def ocr_words(self, image: Image.Image, box: Box = FULL_PAGE, single_line: bool = False) -> List[WordBox]:
+        """
+        Run Tesseract on a region of a page image, returning each word with its
+        position on the whole page. single_line suits small value regions.
+        """
+        import pytesseract
+
+        crop, (offset_x, offset_y) = _crop(image, box)
+        config = REGION_TESSERACT_CONFIG if single_line else TESSERACT_CONFIG
+        with track_stage("ocr_words"):
+            data = pytesseract.image_to_data(crop, config=config, output_type=pytesseract.Output.DICT)
+
+        return _word_boxes(data, image.size, (offset_x, offset_y))
+
+    async def ocr_words_async(self, image: Image.Image, box: Box = FULL_PAGE, single_line: bool = False) -> List[WordBox]:
+        """ocr_words in a tesseract subprocess that is killed if the caller is cancelled"""
+        with track_stage("preprocess"):
+            crop, offset = await asyncio.to_thread(_crop, image, box)
+        config = REGION_TESSERACT_CONFIG if single_line else TESSERACT_CONFIG
+        with track_stage("ocr_words"):
+            tsv = await _run_tesseract(crop, *config.split(), "tsv")
+        return _word_boxes(_parse_tsv(tsv.decode("utf-8")), image.size, offset)
+
+    def iter_pdf_pages(self, document: Document) -> Iterator[Image.Image]:
+        """Rasterize a PDF (bytes or file path), yielding one page image at a time."""
+        from_path = isinstance(document, str)
+        # Check file size to determine processing strategy
+        content_length = os.path.getsize(document) if from_path else len(document)
+        convert = convert_from_path if from_path else convert_from_bytes
+
+        if content_length > LARGE_FILE_THRESHOLD:
+            logger.info(f"Warning: Large PDF detected ({content_length/1_000_000:.2f}MB). Processing may take longer.")
+            # For large files, process one page at a time to avoid memory issues
+            info = pdfinfo_from_path(document) if from_path else pdfinfo_from_bytes(document)
+            max_pages = info["Pages"]
+
+            for page in range(1, max_pages + 1):
+                logger.info(f"Processing page {page}/{max_pages}")
+                images = convert(document, dpi=RASTER_DPI, first_page=page, last_page=page)
+                if images:
+                    note_pages_rasterized(1, images[0].width * images[0].height)
+                    yield images[0]
+        else:
+            # For smaller files, convert all at once
+            images = convert(document, dpi=RASTER_DPI)
+            note_pages_rasterized(len(images), sum(image.width * image.height for image in images))
+            yield from images
+
+    def inspect_document(self, document: Document, is_pdf: bool) -> DocumentShape:
+        """
+        Page count and rasterized page size of a document, without rasterizing it.
+
+        PDFs are sized from the page count and page size reported by pdfinfo at
+        RASTER_DPI; images from the frame count and dimensions in their header,
+        as decoded (at most MAX_IMAGE_SIDE).
+        """
+        from_path = isinstance(document, str)
+        if not is_pdf:
+            try:
+                with Image.open(document if from_path else BytesIO(document)) as image:
+                    width, height = _fitted_size(image.size, MAX_IMAGE_SIDE)
+                    bands = 1 if _decodes_to_grey(image) else len(image.getbands())
+                    return DocumentShape(getattr(image, "n_frames", 1), width * height, bands)
+            except Exception as e:
+                logger.warning(f"Could not read image header, inspecting as a PDF: {e}")
+
+        try:
+            info = pdfinfo_from_path(document) if from_path else pdfinfo_from_bytes(document)
+            pages = max(int(info.get("Pages", 1)), 1)
+            width_pts, height_pts = _parse_page_size(info.get("Page size", ""))
+        except Exception as e:
+            logger.warning(f"Could not read PDF info, assuming one A4 page: {e}")
+            pages = 1
+            width_pts, height_pts = DEFAULT_PAGE_SIZE_PTS
+
+        # pdftoppm renders RGB, 3 bytes per pixel
+        page_pixels = round(width_pts / 72 * RASTER_DPI) * round(height_pts / 72 * RASTER_DPI)
+        return DocumentShape(pages, page_pixels, 3)
+
+    def estimate_memory(self, document: Document, is_pdf: bool, shape: Optional[DocumentShape] = None) -> int:
+        """
+        Estimate the peak memory (bytes) of OCRing a document.
+
+        Small PDFs are rasterized all at once, so every page counts; large PDFs
+        are rasterized page by page and images are a single page.
+        """
+        shape = shape or self.inspect_document(document, is_pdf)
+        content_length = os.path.getsize(document) if isinstance(document, str) else len(document)
+        pages_held = shape.pages if is_pdf and content_length <= LARGE_FILE_THRESHOLD else 1
+        return shape.page_pixels * shape.bytes_per_pixel * (pages_held + OCR_WORKING_SET_FACTOR)
+
+    def iter_page_images(self, document: Document, is_pdf: bool) -> Iterator[Image.Image]:
+        """
+        Page images of a document, rasterized one at a time.
+
+        Content that is not a PDF is an image with one page per frame (e.g. a
+        multi-page TIFF fax), falling back to PDF processing if it cannot be
+        opened as an image.
+        """
+        if not is_pdf:
+            try:
+                frames = _iter_frames(document, MAX_IMAGE_SIDE)
+                first = next(frames)
+            except Exception as e:
+                logger.warning(f"Could not open document as image, trying PDF: {e}")
+            else:
+                note_pages_rasterized(1, first.width * first.height)
+                yield first
+                for image in frames:
+                    note_pages_rasterized(1, image.width * image.height)
+                    yield image
+                return
+
+        yield from self.iter_pdf_pages(document)
+
+    def preview_pages(self, document: Document, is_pdf: bool, pages: int, dpi: int = PREVIEW_DPI) -> List[Image.Image]:
+        """
+        The first pages of a document at low resolution, e.g. for perceptual
+        hashing. Images are scaled as if MAX_IMAGE_SIDE were 300 DPI.
+        """
+        if not is_pdf:
+            try:
+                with track_stage("preview"):
+                    frames = _iter_frames(document, round(MAX_IMAGE_SIDE * dpi / 300))
+                    try:
+                        return [image for _, image in zip(range(pages), frames)]
+                    finally:
+                        frames.close()
+            except Exception as e:
+                logger.warning(f"Could not open document as image, trying PDF: {e}")
+
+        convert = convert_from_path if isinstance(document, str) else convert_from_bytes
+        with track_stage("preview"):
+            return convert(document, dpi=dpi, first_page=1, last_page=pages)
+
+    def iter_page_texts(self, document: Document, is_pdf: bool) -> Iterator[str]:
+        """
+        OCR a document page by page, yielding the text of each page as it finishes.
+
+        The document can be given as bytes or as a file path; a path lets
+        poppler and PIL read the file directly instead of a copy in memory.
+        """
+        for image in self.iter_page_images(document, is_pdf):
+            yield self.ocr_image(image)
+
+    async def ocr_image_async(self, image: Image.Image, language: Optional[str] = None) -> str:
+        """
+        Run Tesseract OCR on a page image in a subprocess owned by the caller,
+        in the page's detected language unless one is given.
+
+        If the caller is cancelled (client gone, page deadline passed) the
+        tesseract process is killed instead of running on for a result nobody reads.
+        """
+        with track_stage("preprocess"):
+            language = language or await asyncio.to_thread(self.page_language, image)
+        with track_stage("ocr_page"):
+            stdout = await _run_tesseract(image, "-l", language, *TESSERACT_CONFIG.split())
+        note_page_language(language)
+        return stdout.decode("utf-8")
+
+    def extract_text_from_pdf_content(self, pdf_content: bytes) -> str:
+        """Extract text from PDF content using Tesseract OCR."""
+        try:
+            with job_memory.trace_allocations("ocr"):
+                extracted_text = "".join(f"{text}\n" for text in self.iter_page_texts(pdf_content, is_pdf=True))
+
+            if extracted_text:
+                # The text is patient data: only its length at INFO
+                logger.info(f"Extracted {len(extracted_text)} characters of text from PDF")
+                logger.debug(f"Extracted Text from PDF: {extracted_text[:100]}...")
+                return extracted_text
+            else:
+                logger.warning("No text extracted from PDF.")
+                return ""
+
+        except Exception as e:
+            logger.exception(f"Error processing PDF content: {e}")
+            return ""
+
+    def extract_text_from_url(self, url: str) -> str:
+        """Extract text from a Cloudinary URL, handling both images and PDFs."""
+        try:
+            content, content_type = self.download_document(url)
+
+            # Determine if this is a PDF or image
+            if self.is_pdf(content_type, url):
+                # Process as PDF
+                return self.extract_text_from_pdf_content(content)
+
+            # Process as image (falls back to PDF if the image cannot be opened)
+            text = "\n".join(self.iter_page_texts(content, is_pdf=False))
+            if text:
+                logger.info(f"Extracted {len(text)} characters of text from image")
+                logger.debug(f"Extracted Text from image: {text[:100]}...")
+                return text
+            else:
+                logger.warning("No text extracted from image.")
+                return ""
+
+        except Exception as e:
+            logger.exception(f"Error processing URL: {e}")
+            return ""
+
+@functools.lru_cache(maxsize=1)
+def _installed_languages() -> frozenset:
+    """Languages tesseract has models for (checked once)"""
+    import pytesseract
+
+    try:
+        return frozenset(pytesseract.get_languages(config=""))
+    except Exception as e:
+        logger.warning(f"Could not list tesseract languages: {e}")
+        return frozenset({"eng"})
+
+
+def _fitted_size(size: Tuple[int, int], max_side: int) -> Tuple[int, int]:
+    """An image size scaled down (never up) so its long side is at most max_side"""
+    scale = min(max_side / max(size), 1.0)
+    return max(round(size[0] * scale), 1), max(round(size[1] * scale), 1)
+
+
+def _decodes_to_grey(image: Image.Image) -> bool:
+    """Colour JPEGs are decoded straight to greyscale (their luma channel), which is all OCR uses"""
+    return image.format == "JPEG" and image.mode in ("RGB", "L")
+
+
+def _decode_frame(image: Image.Image, max_side: int) -> Image.Image:
+    """
+    Decode the current frame of an opened image, at most max_side pixels on
+    its long side.
+
+    JPEGs use draft mode: libjpeg scales by 1/2, 1/4 or 1/8 and drops the
+    colour channels while decoding, so memory and decode time follow the
+    target size rather than the camera's resolution. Other formats are
+    decoded in full and then downscaled.
+    """
+    target = _fitted_size(image.size, max_side)
+    if _decodes_to_grey(image):
+        image.draft("L", target)
+    image.load()
+    if image.size != target:
+        return image.resize(target, Image.Resampling.LANCZOS)
+    return image
+
+
+def _iter_frames(document: Document, max_side: int) -> Iterator[Image.Image]:
+    """Decoded frames of an image document, one at a time (see _decode_frame)"""
+    image = Image.open(document if isinstance(document, str) else BytesIO(document))
+    if getattr(image, "n_frames", 1) == 1:
+        yield _decode_frame(image, max_side)
+        return
+    try:
+        for frame in ImageSequence.Iterator(image):
+            decoded = _decode_frame(frame, max_side)
+            # Seeking to the next frame replaces this one's pixels
+            yield decoded.copy() if decoded is frame else decoded
+    finally:
+        image.close()
+
+
+async def _run_tesseract(image: Image.Image, *args: str) -> bytes:
+    """
+    Run tesseract on a page image (passed in a page buffer) and return its
+    stdout. The process is killed if the caller is cancelled.
+    """
+    import pytesseract
+
+    buffer = await _to_page_buffer(image)
+    try:
+        process = await asyncio.create_subprocess_exec(
+            pytesseract.pytesseract.tesseract_cmd, buffer.path, "stdout", *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await process.communicate()
+        except BaseException:
+            if process.returncode is None:
+                logger.info(f"Killing tesseract process {process.pid}")
+                process.kill()
+            raise
+    finally:
+        buffer.release()
+    if process.returncode != 0:
+        raise pytesseract.TesseractError(process.returncode, stderr.decode("utf-8", "replace").strip())
+    return stdout
+
+
+def _parse_tsv(tsv: str) -> Dict[str, List[Any]]:
+    """tesseract's tsv output as columns, like pytesseract.image_to_data(output_type=DICT)"""
+    rows = [line.split("\t") for line in tsv.splitlines() if line]
+    if not rows:
+        return {"text": []}
+    header = rows[0]
+    rows = [row for row in rows[1:] if len(row) >= len(header) - 1]
+    data = {}
+    for column, name in enumerate(header):
+        values = [row[column] if column < len(row) else "" for row in rows]
+        data[name] = values if name in ("text", "conf") else [int(value) for value in values]
+    return data
+
+
+def _word_boxes(data: Dict[str, List[Any]], page_size: Tuple[int, int], offset: Tuple[int, int]) -> List[WordBox]:
+    """Words of tesseract's image_to_data output, positioned as fractions of the whole page"""
+    width, height = page_size
+    words = []
+    lines = {}
+    for index, text in enumerate(data["text"]):
+        text = text.strip()
+        if not text:
+            continue
+        left, top = offset[0] + data["left"][index], offset[1] + data["top"][index]
+        line_key = (data["block_num"][index], data["par_num"][index], data["line_num"][index])
+        words.append(WordBox(
+            text,
+            left / width,
+            top / height,
+            (left + data["width"][index]) / width,
+            (top + data["height"][index]) / height,
+            lines.setdefault(line_key, len(lines)),
+        ))
+    return words
+
+
+async def _to_page_buffer(image: Image.Image) -> PageBuffer:
+    """
+    Write a page to a shared page buffer in a worker thread. If the caller is
+    cancelled meanwhile, the buffer is released once the thread has made it.
+    """
+    task = asyncio.ensure_future(asyncio.to_thread(PageBuffer.from_image, image))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        task.add_done_callback(lambda done: done.cancelled() or done.exception() or done.result().release())
+        raise
+
+def _crop(image: Image.Image, box: Box) -> Tuple[Image.Image, Tuple[int, int]]:
+    """The part of an image inside a box of page fractions, and its offset in pixels"""
+    if box == FULL_PAGE:
+        return image, (0, 0)
+    left, top = int(box[0] * image.width), int(box[1] * image.height)
+    right, bottom = max(int(box[2] * image.width), left + 1), max(int(box[3] * image.height), top + 1)
+    return image.crop((left, top, right, bottom)), (left, top)
+
+def _parse_page_size(page_size: str) -> Tuple[float, float]:
+    """Width and height in points from pdfinfo's "612 x 792 pts (letter)" format"""
+    parts = page_size.split()
+    try:
+        return float(parts[0]), float(parts[2])
+    except (IndexError, ValueError):
+        return DEFAULT_PAGE_SIZE_PTS
+
+# Create a singleton instance of the OCR processor
+ocr_processor = OCRProcessor()
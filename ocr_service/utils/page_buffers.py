@@ -0,0 +1,173 @@
+"""
+Page images handed to tesseract worker processes through shared memory.
+
+Tesseract used to get each page as a PNG on stdin, so every page was
+compressed, copied through a pipe and decompressed again. Now each page is
+written once as raw 8-bit greyscale (a binary PGM: a short header, then the
+pixels) into a memory-mapped file in PAGE_BUFFER_DIR. That is /dev/shm by
+default, which is RAM. The worker only gets the file's path, and reads the
+pixels from the same memory.
+
+Every user frees its buffer with release() in a finally block, so buffers are
+freed on completion, on errors and on cancellation. A buffer's file name
+carries the pid of its process. sweep_stale_buffers() runs at startup and
+removes the files of processes that no longer exist, e.g. killed workers.
+
+Space is reserved (posix_fallocate) before the file is mapped. Writing
+through a mapping into a full tmpfs kills the process with SIGBUS, while a
+failed reservation only falls back to the system temp directory. Docker
+limits /dev/shm to 64MB unless --shm-size is set.
+"""
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import uuid
+from typing import List, Tuple
+
+from PIL import Image
+
+from core.config import settings
+from utils.metrics import PAGE_BUFFER_BYTES
+
+logger = logging.getLogger(__name__)
+
+FILE_PREFIX = "ocr-page-"
+SHARED_MEMORY_DIR = "/dev/shm"
+WRITE_BAND_BYTES = 1 << 20  # pixels converted and copied into a buffer at a time
+
+
+def buffer_dirs() -> List[str]:
+    """Directories for page buffers, in order of preference"""
+    if settings.PAGE_BUFFER_DIR:
+        return [settings.PAGE_BUFFER_DIR]
+    dirs = [SHARED_MEMORY_DIR] if os.path.isdir(SHARED_MEMORY_DIR) else []
+    return dirs + [tempfile.gettempdir()]
+
+
+def _reserve(fd: int, size: int) -> None:
+    if hasattr(os, "posix_fallocate"):
+        os.posix_fallocate(fd, 0, size)
+    else:
+        os.ftruncate(fd, size)
+
+
+def _map_new_file(path: str, size: int) -> mmap.mmap:
+    """Create the file, reserve its space and map it; nothing is left behind if any step fails"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        _reserve(fd, size)
+        return mmap.mmap(fd, size)
+    except BaseException:
+        os.unlink(path)
+        raise
+    finally:
+        # The mapping keeps the file open
+        os.close(fd)
+
+
+class PageBuffer:
+    """A greyscale page image in a memory-mapped PGM file, passed to workers by path"""
+
+    def __init__(self, path: str, mapping: mmap.mmap, shape: Tuple[int, int]):
+        self.path = path
+        self.shape = shape  # (height, width) of uint8 pixels after the PGM header
+        self._mapping = mapping
+        self._lock = threading.Lock()
+        self._released = False
+        PAGE_BUFFER_BYTES.inc(len(mapping))
+
+    @classmethod
+    def from_image(cls, image: Image.Image) -> "PageBuffer":
+        width, height = image.size
+        header = f"P5\n{width} {height}\n255\n".encode("ascii")
+        size = len(header) + width * height
+        dirs = buffer_dirs()
+        for index, directory in enumerate(dirs):
+            path = os.path.join(directory, f"{FILE_PREFIX}{os.getpid()}-{uuid.uuid4().hex}.pgm")
+            try:
+                mapping = _map_new_file(path, size)
+            except OSError as e:
+                # Full, missing or read-only (e.g. no permission on /dev/shm)
+                if index == len(dirs) - 1:
+                    raise
+                logger.warning(f"Cannot create a page buffer in {directory}, using {dirs[index + 1]}: {e}")
+                continue
+            break
+        buffer = cls(path, mapping, (height, width))
+        try:
+            mapping[:len(header)] = header
+            # Converted and copied in bands of rows, so the page never exists
+            # twice in full (the image and a bytes copy of it)
+            rows = max(WRITE_BAND_BYTES // max(width, 1), 1)
+            offset = len(header)
+            for top in range(0, height, rows):
+                band = image.crop((0, top, width, min(top + rows, height)))
+                pixels = (band if band.mode == "L" else band.convert("L")).tobytes()
+                mapping[offset:offset + len(pixels)] = pixels
+                offset += len(pixels)
+        except BaseException:
+            buffer.release()
+            raise
+        return buffer
+
+    def release(self) -> None:
+        """Free the buffer (idempotent); a worker still reading the file keeps it until it closes it"""
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        PAGE_BUFFER_BYTES.dec(len(self._mapping))
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._mapping.close()
+
+    def __enter__(self) -> "PageBuffer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sweep_stale_buffers() -> int:
+    """
+    Remove page buffers left by processes that no longer exist. Run once at
+    startup: this process has no buffers yet, so files carrying its pid (reused
+    after a container restart) are stale too. Returns the number removed.
+    """
+    removed = 0
+    for directory in buffer_dirs():
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            if not name.startswith(FILE_PREFIX):
+                continue
+            try:
+                pid = int(name[len(FILE_PREFIX):].split("-", 1)[0])
+            except ValueError:
+                continue
+            if pid != os.getpid() and _pid_alive(pid):
+                continue
+            try:
+                os.unlink(os.path.join(directory, name))
+                removed += 1
+            except OSError:
+                pass
+    if removed:
+        logger.info(f"Removed {removed} stale page buffers")
+    return removed
@@ -0,0 +1,122 @@
+"""
+On-demand profiling of single requests.
+
+An admin sends X-Profile: true together with X-Admin-Key (settings.ADMIN_API_KEY)
+and the request runs under a profiler. The profile is saved to PROFILE_DIR as
+<request id>.html, where the request id is the X-Request-ID header or a
+generated one, and its file name is returned in X-Profile-File.
+
+pyinstrument (optional, pip install pyinstrument) is a sampling profiler with
+async support, so the profile shows only this request's call stacks as an
+HTML flame chart. Without it, cProfile is used and <request id>.pstats is
+written instead. cProfile traces every call on the event loop thread, so
+other requests running concurrently show up in it too.
+"""
+import cProfile
+import hmac
+import logging
+import os
+import re
+import uuid
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+try:
+    from pyinstrument import Profiler
+    PYINSTRUMENT_AVAILABLE = True
+except ImportError:
+    PYINSTRUMENT_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Sampling interval for pyinstrument, in seconds
+SAMPLE_INTERVAL = 0.001
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def request_id_from(headers: Headers) -> str:
+    """The client's X-Request-ID if it is safe to use as a file name, else a new one"""
+    request_id = headers.get("x-request-id", "")
+    return request_id if _REQUEST_ID.match(request_id) and request_id not in (".", "..") else uuid.uuid4().hex
+
+
+class _RequestProfiler:
+    def __init__(self):
+        if PYINSTRUMENT_AVAILABLE:
+            self._profiler = Profiler(interval=SAMPLE_INTERVAL, async_mode="enabled")
+        else:
+            self._profiler = cProfile.Profile()
+
+    def start(self) -> None:
+        if PYINSTRUMENT_AVAILABLE:
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop_and_save(self, profile_dir: str, request_id: str) -> str:
+        os.makedirs(profile_dir, exist_ok=True)
+        if PYINSTRUMENT_AVAILABLE:
+            self._profiler.stop()
+            path = os.path.join(profile_dir, f"{request_id}.html")
+            with open(path, "w", encoding="utf-8") as profile_file:
+                profile_file.write(self._profiler.output_html())
+        else:
+            self._profiler.disable()
+            path = os.path.join(profile_dir, f"{request_id}.pstats")
+            self._profiler.dump_stats(path)
+        return path
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles requests carrying X-Profile: true and a valid
+    X-Admin-Key. Profiling is disabled when no admin key is configured.
+    """
+
+    def __init__(self, app, admin_key: str, profile_dir: str):
+        self.app = app
+        self.admin_key = admin_key
+        self.profile_dir = profile_dir
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        if headers.get("x-profile", "").lower() not in ("1", "true"):
+            await self.app(scope, receive, send)
+            return
+
+        if not self.admin_key or not hmac.compare_digest(
+            headers.get("x-admin-key", "").encode(), self.admin_key.encode()
+        ):
+            response = JSONResponse({"detail": "Profiling requires a valid admin key"}, status_code=403)
+            await response(scope, receive, send)
+            return
+
+        request_id = request_id_from(headers)
+        profile_name = f"{request_id}.html" if PYINSTRUMENT_AVAILABLE else f"{request_id}.pstats"
+
+        async def send_with_profile_name(message):
+            if message["type"] == "http.response.start":
+                response_headers = MutableHeaders(scope=message)
+                response_headers.append("X-Request-ID", request_id)
+                response_headers.append("X-Profile-File", profile_name)
+            await send(message)
+
+        profiler = _RequestProfiler()
+        try:
+            profiler.start()
+        except (RuntimeError, ValueError) as e:
+            # Only one cProfile (or pyinstrument) profiler can run at a time
+            logger.warning(f"Not profiling request {request_id}: {e}")
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send_with_profile_name)
+        finally:
+            path = profiler.stop_and_save(self.profile_dir, request_id)
+            logger.info(f"Saved profile of request {request_id} to {path}")
+
@@ -0,0 +1,176 @@
+"""
+Quota-aware rate limiting for LLM calls.
+
+Requests-per-minute and tokens-per-minute budgets are kept as token buckets in
+a small SQLite database, so every uvicorn worker on the host draws from the
+same budget instead of each one bursting up to the provider limit.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+REQUESTS_BUCKET = "requests"
+TOKENS_BUCKET = "tokens"
+
+
+class RateLimitTimeout(Exception):
+    """Raised when budget did not become available before the caller's deadline"""
+
+
+class SharedTokenBucket:
+    """Request and token buckets shared between processes through SQLite"""
+
+    def __init__(
+        self,
+        db_path: str,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.db_path = db_path
+        self.capacities = {
+            REQUESTS_BUCKET: float(requests_per_minute),
+            TOKENS_BUCKET: float(tokens_per_minute),
+        }
+        self._clock = clock
+        self._initialized = False
+
+    @property
+    def enabled(self) -> bool:
+        return any(capacity > 0 for capacity in self.capacities.values())
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+        if not self._initialized:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._initialized = True
+        return connection
+
+    def _load_levels(self, connection: sqlite3.Connection, now: float) -> Dict[str, float]:
+        """Read bucket levels refilled up to now (starting full for new buckets)"""
+        rows = dict(
+            (name, (level, updated))
+            for name, level, updated in connection.execute("SELECT name, level, updated FROM buckets")
+        )
+        levels = {}
+        for name, capacity in self.capacities.items():
+            level, updated = rows.get(name, (capacity, now))
+            refill = max(now - updated, 0.0) * capacity / 60.0
+            levels[name] = min(level + refill, capacity)
+        return levels
+
+    def _store_levels(self, connection: sqlite3.Connection, levels: Dict[str, float], now: float) -> None:
+        connection.executemany(
+            "INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)",
+            [(name, level, now) for name, level in levels.items()],
+        )
+
+    def try_acquire(self, tokens: int) -> float:
+        """
+        Take one request and the given number of tokens if both are available.
+
+        Returns:
+            float: 0.0 if the budget was taken, otherwise seconds until it should be
+        """
+        if not self.enabled:
+            return 0.0
+        needed = {REQUESTS_BUCKET: 1.0, TOKENS_BUCKET: float(tokens)}
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            now = self._clock()
+            levels = self._load_levels(connection, now)
+            wait = 0.0
+            for name, capacity in self.capacities.items():
+                if capacity <= 0:
+                    continue
+                # A single call larger than the whole bucket waits for a full bucket
+                amount = min(needed[name], capacity)
+                if levels[name] < amount:
+                    wait = max(wait, (amount - levels[name]) * 60.0 / capacity)
+            if wait == 0.0:
+                for name, capacity in self.capacities.items():
+                    if capacity > 0:
+                        levels[name] -= min(needed[name], capacity)
+                self._store_levels(connection, levels, now)
+            connection.execute("COMMIT")
+            return wait
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    async def acquire(self, tokens: int, timeout: float) -> None:
+        """
+        Wait until the budget for one call of the given size is available.
+
+        Raises:
+            RateLimitTimeout: If the budget is not available within timeout seconds
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, tokens)
+            if wait == 0.0:
+                return
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                raise RateLimitTimeout(f"LLM budget not available within {timeout:.0f}s (needs {wait:.1f}s)")
+            logger.info(f"LLM budget exhausted, waiting {wait:.2f}s")
+            await asyncio.sleep(wait)
+
+    def record_actual(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Correct the token bucket once the provider reports the real token count"""
+        capacity = self.capacities[TOKENS_BUCKET]
+        if capacity <= 0 or actual_tokens == estimated_tokens:
+            return
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            now = self._clock()
+            levels = self._load_levels(connection, now)
+            # The level may go negative, which delays the next calls accordingly
+            levels[TOKENS_BUCKET] = min(levels[TOKENS_BUCKET] + estimated_tokens - actual_tokens, capacity)
+            self._store_levels(connection, levels, now)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def usage(self) -> Dict[str, Any]:
+        """Current budget usage per bucket, for health reporting"""
+        if not self.enabled:
+            return {"enabled": False}
+        connection = self._connect()
+        try:
+            levels = self._load_levels(connection, self._clock())
+        finally:
+            connection.close()
+        usage = {"enabled": True}
+        for name, capacity in self.capacities.items():
+            if capacity <= 0:
+                continue
+            usage[name] = {
+                "limit_per_minute": int(capacity),
+                "available": round(levels[name], 1),
+                "used_fraction": round(1.0 - levels[name] / capacity, 3),
+            }
+        return usage
+
+
+def estimate_tokens(text: str, max_output_tokens: int) -> int:
+    """Rough token estimate for a call: about four characters per input token plus the output cap"""
+    return len(text) // 4 + max_output_tokens
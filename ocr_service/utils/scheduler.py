@@ -0,0 +1,230 @@
+"""
+Cost-aware, per-client fair scheduling of OCR work.
+
+OCR runs page by page, and every page needs one of a fixed number of worker
+slots. When all slots are busy, waiting pages are ordered in two levels:
+
+- Across clients, by weighted fair queuing: each client's next page gets a
+  virtual finish tag (start tag plus page cost divided by the client's weight),
+  and the smallest tag is served first. A client with a long backfill keeps
+  making steady progress, but cannot crowd out everyone else.
+- Within a client, shortest job first: the page belonging to the job with the
+  least remaining work (pages left times page area) goes first.
+
+Since a single-photo request only ever waits for the pages already running,
+one 80-page upload no longer delays every small request queued behind it.
+
+Clients are identified per request (API key or forwarded user id) through the
+current_client context variable.
+"""
+import asyncio
+import contextlib
+import contextvars
+import hashlib
+import heapq
+import itertools
+import logging
+import threading
+from typing import Any, AsyncIterator, Dict, List, Mapping, NamedTuple, Optional
+
+from starlette.datastructures import Headers
+
+logger = logging.getLogger(__name__)
+
+# Pages are costed in megapixels to keep virtual time in a sensible range
+_PIXELS_PER_COST_UNIT = 1_000_000
+
+
+class ClientIdentity(NamedTuple):
+    """Who a piece of work is scheduled for, and its share of the workers"""
+    name: str
+    weight: float = 1.0
+
+
+ANONYMOUS_CLIENT = ClientIdentity("anonymous")
+
+# Set per request by the HTTP middleware; inherited by the pipeline's tasks and threads
+current_client: contextvars.ContextVar[ClientIdentity] = contextvars.ContextVar(
+    "current_client", default=ANONYMOUS_CLIENT
+)
+
+
+def identify_client(headers: Mapping[str, str], weights: Optional[Mapping[str, float]] = None) -> ClientIdentity:
+    """
+    Identify the client of a request from its headers.
+
+    A forwarded user id (X-Forwarded-User, set by the backend proxy) is preferred
+    over the API key (X-API-Key), so users behind one shared key still get
+    separate fair shares. Weights are looked up by API key; the key itself is
+    only kept as a short hash.
+    """
+    weights = weights or {}
+    api_key = headers.get("x-api-key")
+    weight = float(weights.get(api_key, 1.0)) if api_key else 1.0
+    user = headers.get("x-forwarded-user")
+    if user:
+        return ClientIdentity(f"user:{user}", weight)
+    if api_key:
+        return ClientIdentity(f"key:{hashlib.sha256(api_key.encode()).hexdigest()[:12]}", weight)
+    return ANONYMOUS_CLIENT
+
+
+class ClientIdentityMiddleware:
+    """
+    ASGI middleware that sets current_client for each HTTP request.
+
+    A plain ASGI middleware rather than @app.middleware("http"), which would
+    hide client disconnects from the endpoints.
+    """
+
+    def __init__(self, app, weights: Optional[Mapping[str, float]] = None):
+        self.app = app
+        self.weights = weights or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            current_client.set(identify_client(Headers(scope=scope), self.weights))
+        await self.app(scope, receive, send)
+
+
+class _Waiter:
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: ClientIdentity, cost: float):
+        self.loop = loop
+        self.client = client
+        self.cost = cost
+        self.future = loop.create_future()
+        self.granted = False
+
+
+class FairScheduler:
+    """
+    Fixed pool of worker slots with weighted fair queuing across clients and
+    shortest-job-first within a client. Usable from several event loops.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = max(workers, 1)
+        self._lock = threading.Lock()
+        self._busy = 0
+        # Per-client heaps of (job cost, arrival order, waiter)
+        self._queues: Dict[str, List[tuple]] = {}
+        # Virtual finish tag of each client's last dispatched page, and the start
+        # tag of the next page of each backlogged client
+        self._finish_tags: Dict[str, float] = {}
+        self._start_tags: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._arrivals = itertools.count()
+        self.dispatched = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self, page_pixels: int, job_pixels: Optional[int] = None, client: Optional[ClientIdentity] = None
+    ) -> AsyncIterator[None]:
+        """
+        Hold a worker slot for one page of OCR.
+
+        Args:
+            page_pixels: Cost of this page (its pixel area)
+            job_pixels: Remaining cost of the whole job, for shortest-job-first
+                ordering within the client (defaults to the page cost)
+            client: Client to charge (defaults to current_client)
+        """
+        client = client or current_client.get()
+        cost = page_pixels / _PIXELS_PER_COST_UNIT
+        job_cost = (job_pixels if job_pixels is not None else page_pixels) / _PIXELS_PER_COST_UNIT
+
+        with self._lock:
+            if self._busy < self.workers and not self._queues:
+                self._start(client, cost)
+                waiter = None
+            else:
+                waiter = _Waiter(asyncio.get_running_loop(), client, cost)
+                self._enqueue(waiter, job_cost)
+
+        if waiter is not None:
+            try:
+                await asyncio.shield(waiter.future)
+            except BaseException:
+                with self._lock:
+                    granted = waiter.granted
+                    if not granted:
+                        self._remove(waiter)
+                if granted:
+                    self._finish()
+                raise
+        try:
+            yield
+        finally:
+            self._finish()
+
+    def _start(self, client: ClientIdentity, cost: float, start_tag: Optional[float] = None) -> None:
+        # Called with the lock held: charge the client and take a slot
+        if start_tag is None:
+            start_tag = max(self._virtual_time, self._finish_tags.get(client.name, 0.0))
+        self._finish_tags[client.name] = start_tag + cost / client.weight
+        self._virtual_time = max(self._virtual_time, start_tag)
+        self._busy += 1
+        self.dispatched += 1
+
+    def _enqueue(self, waiter: _Waiter, job_cost: float) -> None:
+        # Called with the lock held. A client's start tag is fixed when it becomes
+        # backlogged, so it cannot be pushed back by virtual time advancing
+        name = waiter.client.name
+        if name not in self._queues:
+            self._queues[name] = []
+            self._start_tags[name] = max(self._virtual_time, self._finish_tags.get(name, 0.0))
+        heapq.heappush(self._queues[name], (job_cost, next(self._arrivals), waiter))
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = self._queues[waiter.client.name]
+        queue[:] = [entry for entry in queue if entry[2] is not waiter]
+        heapq.heapify(queue)
+        if not queue:
+            del self._queues[waiter.client.name]
+            del self._start_tags[waiter.client.name]
+
+    def _finish(self) -> None:
+        with self._lock:
+            self._busy -= 1
+            while self._busy < self.workers and self._queues:
+                self._dispatch_next()
+            self._forget_idle_clients()
+
+    def _dispatch_next(self) -> None:
+        # Called with the lock held: serve the client whose next page finishes
+        # first in virtual time
+        def finish_tag(name: str) -> float:
+            head = self._queues[name][0][2]
+            return self._start_tags[name] + head.cost / head.client.weight
+
+        name = min(self._queues, key=finish_tag)
+        _, _, waiter = heapq.heappop(self._queues[name])
+        start_tag = self._start_tags.pop(name)
+        self._start(waiter.client, waiter.cost, start_tag)
+        if self._queues[name]:
+            self._start_tags[name] = self._finish_tags[name]
+        else:
+            del self._queues[name]
+        waiter.granted = True
+        waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+
+    def _forget_idle_clients(self) -> None:
+        # A client whose tag is behind virtual time starts from virtual time anyway
+        for name in [name for name, tag in self._finish_tags.items() if tag <= self._virtual_time]:
+            if name not in self._queues:
+                del self._finish_tags[name]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "busy": self._busy,
+                "queued": sum(len(queue) for queue in self._queues.values()),
+                "queued_clients": len(self._queues),
+                "dispatched": self.dispatched,
+            }
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,115 @@
+"""
+Per-page script detection, to choose the Tesseract language models.
+
+Reports mix English and Bangla. OCR with eng+ben is much slower than with
+eng alone, so each page is first checked for Bangla script. The check runs
+on a greyscale copy shrunk to DETECTION_WIDTH pixels, and needs no OCR.
+
+Bangla letters hang from a headline (matra), a horizontal stroke along the
+top of each word. Latin letters have nothing like it. The detector works as
+follows:
+
+1. Ruling lines (runs longer than RULE_WIDTH of the page) are erased.
+2. Text lines are found from the rows that contain ink.
+3. For each line, it measures the best coverage of the line's ink columns by
+   long horizontal runs (longer than HEADLINE_RUN line heights, i.e.
+   spanning several letters), over the rows of the line's upper part.
+4. Lines whose best coverage reaches HEADLINE_COVERAGE count as Bangla.
+
+The page language is "eng" when under BANGLA_MIN_SHARE of its lines are
+Bangla, "ben" when at least BANGLA_ONLY_SHARE are, and "eng+ben" in between.
+"""
+import contextlib
+import contextvars
+from collections import Counter
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from utils.metrics import OCR_PAGE_LANGUAGES
+
+DETECTION_WIDTH = 800  # about 100 DPI for an A4 page
+INK_LEVEL = 128  # after auto-contrast, darker pixels are ink
+RULE_WIDTH = 0.25  # runs longer than this share of the width are table rules, not text
+MIN_LINE_HEIGHT = 5  # pixels; thinner bands are rules or noise
+HEADLINE_RUN = 1.5  # headline runs are longer than this many line heights
+HEADLINE_ZONE = 0.6  # the headline is in this upper share of a line
+HEADLINE_COVERAGE = 0.4
+BANGLA_MIN_SHARE = 0.1
+BANGLA_ONLY_SHARE = 0.9
+
+_page_languages: contextvars.ContextVar[Optional[Counter]] = contextvars.ContextVar("page_languages", default=None)
+
+
+class ScriptDetection(NamedTuple):
+    language: str  # Tesseract language string: "eng", "ben" or "eng+ben"
+    bangla_lines: int
+    lines: int
+
+
+def _runs(row: np.ndarray) -> List[Tuple[int, int]]:
+    """(start, end) of the runs of True in a boolean row"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], row.view(np.int8), [0]))))
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def _text_lines(ink: np.ndarray) -> List[Tuple[int, int]]:
+    """(top, bottom) of the bands of rows holding ink"""
+    return [(top, bottom) for top, bottom in _runs(ink.any(axis=1)) if bottom - top >= MIN_LINE_HEIGHT]
+
+
+def _headline_coverage(band: np.ndarray) -> float:
+    height = band.shape[0]
+    ink_columns = int(band.any(axis=0).sum())
+    if ink_columns < 2 * height:
+        return 0.0
+    best = 0
+    for row in band[:max(int(height * HEADLINE_ZONE), 1)]:
+        covered = sum(end - start for start, end in _runs(row) if end - start >= HEADLINE_RUN * height)
+        best = max(best, covered)
+    return best / ink_columns
+
+
+def detect_script(image: Image.Image) -> ScriptDetection:
+    """Count the Bangla text lines of a page image and choose its OCR language"""
+    grey = ImageOps.autocontrast(image.convert("L"))
+    if grey.width > DETECTION_WIDTH:
+        grey = grey.resize((DETECTION_WIDTH, max(round(grey.height * DETECTION_WIDTH / grey.width), 1)))
+    ink = np.asarray(grey) < INK_LEVEL
+
+    rule_length = RULE_WIDTH * ink.shape[1]
+    for y in np.flatnonzero(ink.sum(axis=1) >= rule_length):
+        for start, end in _runs(ink[y]):
+            if end - start >= rule_length:
+                ink[y, start:end] = False
+
+    lines = _text_lines(ink)
+    bangla = sum(int(_headline_coverage(ink[top:bottom]) >= HEADLINE_COVERAGE) for top, bottom in lines)
+    share = bangla / len(lines) if lines else 0.0
+    if share < BANGLA_MIN_SHARE:
+        language = "eng"
+    elif share >= BANGLA_ONLY_SHARE:
+        language = "ben"
+    else:
+        language = "eng+ben"
+    return ScriptDetection(language, bangla, len(lines))
+
+
+@contextlib.contextmanager
+def record_page_languages() -> Iterator[Counter]:
+    """Count the pages OCRed with each language in this block (including worker threads it starts)"""
+    languages = Counter()
+    token = _page_languages.set(languages)
+    try:
+        yield languages
+    finally:
+        _page_languages.reset(token)
+
+
+def note_page_language(language: str) -> None:
+    """Record the language a page was OCRed with, for the enclosing record_page_languages()"""
+    OCR_PAGE_LANGUAGES.labels(language=language).inc()
+    languages = _page_languages.get()
+    if languages is not None:
+        languages[language] += 1
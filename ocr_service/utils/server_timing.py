@@ -0,0 +1,78 @@
+"""
+Per-request stage timings reported in the Server-Timing response header.
+
+Every HTTP request gets a RequestTimings collector in a context variable. The
+pipeline's track_stage() blocks add to it, including from worker threads and
+coalesced tasks started by the request, since both inherit the context. The
+header lists each stage's total duration in milliseconds, e.g.
+
+    Server-Timing: download;dur=412.3, rasterize;desc="3x";dur=1280.0, total;dur=5230.9
+
+Streaming responses send their headers before processing finishes, so they
+only report what had completed by then.
+"""
+import contextvars
+import threading
+import time
+from typing import Dict, Optional
+
+from starlette.datastructures import MutableHeaders
+
+
+class RequestTimings:
+    """Durations of the stages run for one request, summed per stage"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._totals: Dict[str, float] = {}
+        self._counts: Dict[str, int] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._totals[stage] = self._totals.get(stage, 0.0) + seconds
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+
+    def header_value(self) -> str:
+        with self._lock:
+            entries = []
+            for stage, seconds in self._totals.items():
+                count = self._counts[stage]
+                description = f';desc="{count}x"' if count > 1 else ""
+                entries.append(f"{stage}{description};dur={seconds * 1000:.1f}")
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar(
+    "current_timings", default=None
+)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Add a stage duration to the current request's timings, if there is one"""
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware adding a Server-Timing header to every HTTP response"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        _current_timings.set(timings)
+
+        async def send_with_timings(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("Server-Timing", timings.header_value())
+            await send(message)
+
+        await self.app(scope, receive, send_with_timings)
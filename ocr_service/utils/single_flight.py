@@ -0,0 +1,93 @@
+"""
+Single-flight coalescing of concurrent identical work.
+
+When several callers ask for the same key while a call is already running,
+they all await that one call instead of starting their own. Its result or
+exception is delivered to every caller. A caller that is cancelled simply
+stops waiting; the shared call is only cancelled once nobody is waiting for it.
+Nothing is cached: once the call finishes, the next caller starts a new one.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# Query parameters added by URLHandler that do not change the document
+_IGNORED_QUERY_PARAMS = {"fl_attachment", "fl_sanitize"}
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Registry of in-flight calls keyed by an arbitrary hashable key"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Tuple[int, Hashable], _Call] = {}
+
+    @staticmethod
+    def _registry_key(key: Hashable) -> Tuple[int, Hashable]:
+        # Tasks belong to one event loop, so calls are never shared across loops
+        return id(asyncio.get_running_loop()), key
+
+    def in_flight(self, key: Hashable) -> bool:
+        return self._registry_key(key) in self._calls
+
+    def call_when_idle(self, key: Hashable, callback: Callable[[], Any]) -> None:
+        """Run callback once no call for key is in flight (immediately if none is)"""
+        call = self._calls.get(self._registry_key(key))
+        if call is None:
+            callback()
+        else:
+            call.task.add_done_callback(lambda _: callback())
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run func for key, or join the call already running for it.
+
+        Returns:
+            Tuple: (result, True if the result came from another caller's call)
+        """
+        registry_key = self._registry_key(key)
+        call = self._calls.get(registry_key)
+        shared = call is not None
+        if call is None:
+            call = _Call(asyncio.ensure_future(func()))
+            self._calls[registry_key] = call
+            call.task.add_done_callback(lambda _: self._forget(registry_key, call))
+        else:
+            logger.info(f"Joining in-flight {self.name} call for {key}")
+
+        call.waiters += 1
+        try:
+            # Shield so that cancelling one caller does not cancel the shared call
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                logger.info(f"All callers of {self.name} call for {key} are gone, cancelling it")
+                call.task.cancel()
+
+    def _forget(self, registry_key: Tuple[int, Hashable], call: _Call) -> None:
+        if self._calls.get(registry_key) is call:
+            del self._calls[registry_key]
+        if not call.task.cancelled():
+            # Waiters get the exception through their shields; retrieving it here
+            # avoids "exception was never retrieved" warnings
+            call.task.exception()
+
+
+def normalize_document_url(url: str) -> str:
+    """Normalize a document URL so equivalent URLs map to the same single-flight key"""
+    parts = urlsplit(url.strip())
+    query = sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name not in _IGNORED_QUERY_PARAMS
+    )
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ""))
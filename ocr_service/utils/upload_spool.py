@@ -0,0 +1,226 @@
+"""
+Streaming multipart uploads spooled to disk.
+
+The request body is parsed as it arrives: the file part is written to a
+temporary file chunk by chunk and hashed on the way, with a size cap enforced
+while reading. Nothing but the current chunk is held in memory, and the OCR
+stage gets a file path instead of the document bytes.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Optional
+
+from starlette.requests import Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+# Leading bytes of the document types the OCR pipeline accepts
+_SIGNATURES = {
+    b"%PDF": "application/pdf",
+    b"\x89PNG": "image/png",
+    b"\xff\xd8\xff": "image/jpeg",
+    b"II*\x00": "image/tiff",
+    b"MM\x00*": "image/tiff",
+    b"BM": "image/bmp",
+    b"GIF8": "image/gif",
+}
+
+# OpenAPI request body for endpoints that parse the upload with spool_upload,
+# since FastAPI cannot infer it from a raw Request parameter
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                }
+            }
+        },
+    }
+}
+
+
+class UploadError(Exception):
+    """Raised for malformed or unsupported uploads"""
+
+
+class UploadTooLargeError(UploadError):
+    """Raised when an upload exceeds the configured size cap"""
+
+
+def detect_document_type(head: bytes) -> Optional[str]:
+    """Content type of a PDF or image from its first bytes, or None if unsupported"""
+    for signature, content_type in _SIGNATURES.items():
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+@dataclass
+class SpooledUpload:
+    """An uploaded file written to disk, with the metadata gathered while reading it"""
+    path: str
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+
+    @property
+    def is_pdf(self) -> bool:
+        return self.content_type == "application/pdf"
+
+    def cleanup(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to delete spooled upload {self.path}: {e}")
+
+
+class _FilePartWriter:
+    """MultipartParser callbacks that spool one file field to disk"""
+
+    def __init__(self, field_name: str, max_bytes: int, spool_dir: Optional[str]):
+        self.field_name = field_name
+        self.max_bytes = max_bytes
+        self.spool_dir = spool_dir
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+        self.filename = None
+        self.file = None
+        self.path = None
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._in_target_part = False
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self) -> None:
+        self._headers = {}
+        self._in_target_part = False
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        if name != self.field_name or filename is None or self.file is not None:
+            return
+        self._in_target_part = True
+        self.filename = filename.decode("utf-8", "replace")
+        self.file = tempfile.NamedTemporaryFile(dir=self.spool_dir, prefix="upload-", delete=False)
+        self.path = self.file.name
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if not self._in_target_part:
+            return
+        chunk = data[start:end]
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds the {self.max_bytes // 1_000_000}MB limit")
+        if len(self.head) < 16:
+            self.head += chunk[:16 - len(self.head)]
+        self.hasher.update(chunk)
+        self.file.write(chunk)
+
+    def on_part_end(self) -> None:
+        if self._in_target_part:
+            self.file.close()
+            self._in_target_part = False
+
+    def discard(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+async def spool_upload(
+    request: Request, field_name: str = "file", max_bytes: int = 50_000_000, spool_dir: Optional[str] = None
+) -> SpooledUpload:
+    """
+    Stream a multipart request's file field to a temporary file.
+
+    Args:
+        request: Incoming multipart/form-data request
+        field_name: Name of the form field holding the file
+        max_bytes: Reading stops with UploadTooLargeError beyond this size
+        spool_dir: Directory for the temporary file (system default if None)
+
+    Returns:
+        SpooledUpload: The spooled file; the caller must call cleanup()
+
+    Raises:
+        UploadTooLargeError: If the file is larger than max_bytes
+        UploadError: If the request has no such file field or it is not a PDF or image
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise UploadError("Expected a multipart/form-data request")
+
+    writer = _FilePartWriter(field_name, max_bytes, spool_dir)
+    parser = MultipartParser(options[b"boundary"], writer.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except BaseException as e:
+        # Also covers cancellation and client disconnects mid-upload
+        writer.discard()
+        if isinstance(e, Exception) and not isinstance(e, UploadError):
+            raise UploadError(f"Invalid multipart upload: {e}") from e
+        raise
+
+    if writer.file is None:
+        raise UploadError(f"No file uploaded in field '{field_name}'")
+
+    document_type = detect_document_type(writer.head)
+    if document_type is None:
+        writer.discard()
+        raise UploadError("Only PDF and image files are supported")
+
+    logger.info(f"Spooled upload of {writer.size} bytes ({document_type}) to disk")
+    return SpooledUpload(
+        path=writer.path,
+        filename=writer.filename,
+        content_type=document_type,
+        size=writer.size,
+        sha256=writer.hasher.hexdigest(),
+    )
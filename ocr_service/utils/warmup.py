@@ -0,0 +1,99 @@
+"""
+Startup warm-up, reported by the /ready endpoint.
+
+Heavy libraries are imported lazily, so that the app starts quickly, and the
+first request would otherwise pay for them, for loading Tesseract and its
+traineddata from disk, and for building the Gemini client. The warm-up does
+all of that in the background right after startup:
+
+1. imports the heavy modules, timing each
+2. OCRs a small built-in image
+3. builds the Gemini client (no API call)
+
+/ready reports false until it has finished, so an autoscaler or load balancer
+only routes requests to warm instances, while /health keeps answering. A step
+that fails is logged and skipped: the service then reports ready in the
+"degraded" state, since a warm-up problem must not keep it out of rotation
+for good (the first request pays for that step instead, or fails with a
+clear error).
+"""
+import asyncio
+import importlib
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger(__name__)
+
+PROBE_TEXT = "Hemoglobin: 14.2 g/dL"
+
+
+def probe_image() -> Image.Image:
+    """A small image with one line of text for the OCR probe"""
+    image = Image.new("L", (520, 60), 255)
+    try:
+        font = ImageFont.load_default(size=32)
+    except TypeError:
+        # Pillow before 10.1 only has the small bitmap font
+        font = ImageFont.load_default()
+    ImageDraw.Draw(image).text((10, 10), PROBE_TEXT, fill=0, font=font)
+    return image
+
+
+class WarmUp:
+    """Runs the warm-up once and keeps its state and step timings"""
+
+    def __init__(self):
+        self.state = "pending"  # pending, running, ready, degraded or skipped
+        self.error: Optional[str] = None
+        self.errors: List[str] = []
+        self.timings: Dict[str, float] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.state in ("ready", "degraded", "skipped")
+
+    def record(self, step: str, seconds: float) -> None:
+        self.timings[step] = round(seconds * 1000, 1)
+        logger.info(f"Warm-up: {step} took {seconds * 1000:.0f}ms")
+
+    async def _step(self, step: str, func, *args) -> None:
+        """Run one timed warm-up step; a failure is logged and recorded, not raised"""
+        started = time.perf_counter()
+        try:
+            await func(*args)
+        except Exception as e:
+            self.errors.append(f"{step}: {e}")
+            logger.warning(f"Warm-up step {step} failed, continuing: {e}", exc_info=True)
+            return
+        self.record(step, time.perf_counter() - started)
+
+    def skip(self) -> None:
+        self.state = "skipped"
+
+    async def run(self, ocr, ai) -> None:
+        """Warm up the OCR processor and the AI processor; failed steps leave the service ready but degraded"""
+        self.state = "running"
+        started = time.perf_counter()
+        modules = ["pytesseract", "pdf2image"] + (["google.generativeai"] if ai.gemini_enabled else [])
+        for module in modules:
+            await self._step(f"import:{module}", asyncio.to_thread, importlib.import_module, module)
+        await self._step("ocr_probe", lambda: ocr.ocr_image_async(probe_image()))
+        await self._step("llm_client", asyncio.to_thread, ai.warm_up)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if self.errors:
+            self.state = "degraded"
+            self.error = "; ".join(self.errors)
+            logger.warning(f"Warm-up finished in {elapsed_ms:.0f}ms with errors, service is ready: {self.error}")
+            return
+        self.state = "ready"
+        logger.info(f"Warm-up finished in {elapsed_ms:.0f}ms, service is ready")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"ready": self.ready, "state": self.state, "error": self.error, "timings_ms": self.timings}
+
+
+# Create a singleton instance of the warm-up
+warm_up = WarmUp()